@@ -89,3 +89,623 @@ def test_runequality():
     assert a.inside(b)
     assert b.inside(a)
     assert a.__hash__() == b.__hash__()
+
+    #All variables must match, not only the first one
+    assert Run({"A": 1, "B": 2}) != Run({"A": 1, "B": 3})
+    assert Run({"A": 1.0, "B": "x"}) == Run({"B": "x", "A": "1"})
+    c = Run({"A": 1, "B": 2})
+    h = hash(c)
+    c.variables["B"] = 3
+    assert hash(c) != h
+    assert c == Run({"A": 1, "B": 3})
+    assert {a: 1}.get(Run({"A": "1", "B": 2.0})) == 1
+
+def test_journal(tmp_path):
+    args = test_args()
+    testie = Testie("tests/examples/math.npf", options=args, tags=args.tags)
+    build = Build(test_repo(), "version", result_path=[str(tmp_path)])
+    build.appendversion(testie, {Run({"N": 1}): {"RESULT": [1.0, 2.0]}})
+    build.appendversion(testie, {Run({"N": 2}): {"RESULT": [3.0]}})
+    build.appendversion(testie, {Run({"N": 1}): {"RESULT": [4.0]}})
+    build.appendversion(testie, {"time": {Run({"N": 1, "time": 0.5}): {"RESULT": [5.0]}}}, kind=True)
+    expected = {Run({"N": 1}): {"RESULT": [4.0]}, Run({"N": 2}): {"RESULT": [3.0]}}
+    assert build.load_results(testie, cache=False) == expected
+
+    #A run interrupted while being appended is ignored
+    with open(str(tmp_path) + "/click-2021/version/math.npf.results.journal", "a") as f:
+        f.write("N:3={RESULT:1.")
+    assert build.load_results(testie, cache=False) == expected
+    build.appendversion(testie, {Run({"N": 2}): {"RESULT": [6.0]}})
+    expected[Run({"N": 2})] = {"RESULT": [6.0]}
+    assert build.load_results(testie, cache=False) == expected
+
+    build.compact(testie)
+    assert not os.path.exists(str(tmp_path) + "/click-2021/version/math.npf.results.journal")
+    assert build.load_results(testie, cache=False) == expected
+    assert build.load_results(testie, kind=True, cache=False) == {"time": {Run({"N": 1, "time": 0.5}): {"RESULT": [5.0]}}}
+
+def test_result_format(tmp_path, monkeypatch):
+    import sys
+    from npf.store.__main__ import main
+    args = test_args()
+    testie = Testie("tests/examples/math.npf", options=args, tags=args.tags)
+    build = Build(test_repo(), "version", result_path=[str(tmp_path)])
+    build.writeversion(testie, {Run({"N": 1}): {"RESULT": [1.0]}})
+    folder = str(tmp_path) + "/click-2021/version"
+    #Writing in another format leaves the existing file untouched
+    npf.options.result_format = "npz"
+    build.writeversion(testie, {Run({"N": 1}): {"RESULT": [2.0]}}, allow_overwrite=True)
+    assert sorted(os.listdir(folder)) == ["math.npf.results", "math.npf.results.npz"]
+    assert build.load_results(testie, cache=False) == {Run({"N": 1}): {"RESULT": [2.0]}}
+    npf.options.result_format = "text"
+    assert build.load_results(testie, cache=False) == {Run({"N": 1}): {"RESULT": [1.0]}}
+    #Only the converter removes the other formats
+    monkeypatch.setattr(sys, "argv", ["npf.store", "--result-format", "npz", str(tmp_path)])
+    main()
+    assert os.listdir(folder) == ["math.npf.results.npz"]
+
+def test_npz_store(tmp_path):
+    import numpy as np
+    from npf.store import get_store
+    from npf.types.resulttable import array_items
+    from npf.store.textstore import format_line
+    results = OrderedDict()
+    results[Run({"N": 1, "MODE": "a,b"})] = {"RESULT": [1.5, 2.0], "LAT": None}
+    results[Run({"N": 2.5, "MODE": "1.0"})] = {"RESULT": []}
+    results[Run({"N": 3})] = {"LAT": [7.0]}
+    filename = str(tmp_path) + "/test.npf.results"
+    get_store('npz').write(filename, results)
+    assert os.path.exists(filename + ".npz")
+    loaded = get_store('npz').load(None, filename)
+    assert [format_line(run, r) for run, r in loaded.items()] == [format_line(run, r) for run, r in results.items()]
+    assert list(loaded.keys())[1].variables["MODE"] == "1.0"
+    assert isinstance(loaded.table.types["RESULT"][0], np.memmap)
+    assert loaded[Run({"N": 1, "MODE": "a,b"})] == {"RESULT": [1.5, 2.0], "LAT": None}
+    arrays = dict(array_items(loaded))
+    assert isinstance(arrays[Run({"N": 3})]["LAT"], np.ndarray)
+    assert list(loaded.arrays(Run({"N": 1, "MODE": "a,b"}))["RESULT"]) == [1.5, 2.0]
+    loaded[Run({"N": 4})] = {"RESULT": [3.0]}
+    del loaded[Run({"N": 3})]
+    assert list(loaded.keys()) == [Run({"N": 1, "MODE": "a,b"}), Run({"N": 2.5, "MODE": "1.0"}), Run({"N": 4})]
+    assert Run({"N": 3}) not in loaded and len(loaded) == 3
+
+def test_store_interface():
+    from npf.store.store import ResultStore
+    class ReadOnlyStore(ResultStore):
+        def load(self, testie, filename):
+            return OrderedDict()
+    try:
+        ReadOnlyStore()
+        assert False, "A store must implement write"
+    except TypeError:
+        pass
+
+def test_series_store(tmp_path):
+    from npf.store import get_store
+    from npf.types.series import KindDataset
+    kd = KindDataset("time")
+    kd.extend(Run({"N": 1}), {0: {"LAT": [1.0, 2.0]}, 1: {"LAT": [3.0], "TP": [4.0]}})
+    kd.extend(Run({"N": 2}), {0: {"TP": [5.0]}})
+    kd.extend(Run({"N": 1}), {1: {"LAT": [6.0]}})
+    expected = {Run({"N": 1, "time": 0}): {"LAT": [1.0, 2.0]},
+                Run({"N": 1, "time": 1}): {"LAT": [3.0, 6.0], "TP": [4.0]},
+                Run({"N": 2, "time": 0}): {"TP": [5.0]}}
+    assert dict(kd.items()) == expected
+    filename = str(tmp_path) + "/test.npf.results-time"
+    get_store('npz', kind=True).write(filename, kd)
+    loaded = get_store('npz', kind=True).load(None, filename)
+    assert dict(loaded.items()) == expected
+    assert loaded[Run({"N": 1, "time": 1})] == {"LAT": [3.0, 6.0], "TP": [4.0]}
+    assert list(loaded.series(Run({"N": 1})).kind_values) == [0, 1]
+
+def test_sqlite_store(tmp_path):
+    from npf.store import get_store
+    store = get_store('sqlite')
+    filename = str(tmp_path) + "/click-2021/v1/math.npf.results"
+    store.write(filename, OrderedDict([(Run({"N": 1}), {"RESULT": [1.0, 2.0]}), (Run({"N": 2}), {})]))
+    store.append(filename, {Run({"N": 1}): {"RESULT": [3.0]}, Run({"N": 3}): {"RESULT": None}})
+    store.write(filename.replace("v1", "v2") + "-time", {Run({"N": 1, "time": 0}): {"RESULT": [4.0]}})
+    assert store.exists(filename)
+    assert not store.exists(filename.replace("v1", "v3"))
+    assert store.kinds(filename.replace("v1", "v2")) == ["time"]
+    expected = OrderedDict([(Run({"N": 1}), {"RESULT": [3.0]}), (Run({"N": 2}), {}), (Run({"N": 3}), {"RESULT": None})])
+    loaded = store.load(None, filename)
+    assert list(loaded.items()) == list(expected.items())
+    testie = types.SimpleNamespace(filename="math.npf", variables=types.SimpleNamespace(is_numeric=lambda k: True))
+    versions = store.load_versions(testie, str(tmp_path), "click-2021", ["v3", "v1"])
+    assert list(versions.keys()) == ["v1"]
+    assert list(versions["v1"].keys())[0].variables["N"] == 1
+    store.delete(filename)
+    assert not store.exists(filename)
+
+def test_results_cache(tmp_path):
+    from npf.store.cache import ResultCache, signature, estimate_size
+    test_args()
+    cache = ResultCache()
+    f = str(tmp_path) + "/a.results"
+    with open(f, "w") as fd:
+        fd.write("N:1={RESULT:1.0}\n")
+    results = {Run({"N": 1}): {"RESULT": [1.0]}}
+    cache.put(f, signature([f]), results)
+    cached = cache.get(f, signature([f]))
+    assert cached == results and cached is not results
+    with open(f, "a") as fd:
+        fd.write("N:2={RESULT:2.0}\n")
+    assert cache.get(f, signature([f])) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    npf.options.results_cache_size = 2 * estimate_size(results) / (1024 * 1024)
+    for i in range(3):
+        cache.put(str(i), (), results)
+    assert list(cache.entries.keys()) == ["1", "2"]
+    assert cache.evictions == 2
+
+def test_results_cache_copy(tmp_path):
+    args = test_args()
+    testie = Testie("tests/examples/math.npf", options=args, tags=args.tags)
+    build = Build(test_repo(), "version", result_path=[str(tmp_path)])
+    build.writeversion(testie, {Run({"N": 1}): {"RESULT": [1.0]}})
+    r = build.load_results(testie)
+    r[Run({"N": 99})] = {}
+    r[Run({"N": 1})]["RESULT"] += [2.0]
+    assert Build(test_repo(), "version", result_path=[str(tmp_path)]).load_results(testie) == {Run({"N": 1}): {"RESULT": [1.0]}}
+    build.appendversion(testie, {Run({"N": 2}): {"RESULT": [3.0]}})
+    assert Run({"N": 2}) not in r
+    assert build.load_results(testie) == {Run({"N": 1}): {"RESULT": [1.0]}, Run({"N": 2}): {"RESULT": [3.0]}}
+
+def test_result_table():
+    from npf.types.resulttable import ResultTable
+    import numpy as np
+    from npf.types.dataset import group_val
+    dataset = OrderedDict()
+    dataset[Run({"N": 1, "M": "a"})] = {"R": [1.0, 2.0, 6.0], "S": [1.0]}
+    dataset[Run({"N": 2, "M": "a"})] = {"R": []}
+    dataset[Run({"N": 1, "M": "b"})] = {"R": None, "S": [2.0, 4.0]}
+    dataset[Run({"N": 2, "M": "b"})] = {"R": [5.0]}
+    table = ResultTable.from_dataset(dataset)
+    for how in ["mean", "std", "min", "max", "median", "perc90", "first", "last"]:
+        assert np.allclose(table.reduce("R", how), [group_val([1.0, 2.0, 6.0], how), np.nan, np.nan, group_val([5.0], how)], equal_nan=True)
+    assert list(table.present("R")) == [True, True, False, True]
+    assert table.filter(M="b").as_dataset() == {Run({"N": 1, "M": "b"}): {"R": None, "S": [2.0, 4.0]}, Run({"N": 2, "M": "b"}): {"R": [5.0]}}
+    assert [list(v) for v in table.group_by(["M"]).values()] == [[0, 1], [2, 3]]
+    index, columns, matrix = table.pivot("N", "M", "S")
+    assert index == [1, 2] and columns == ["a", "b"]
+    assert np.allclose(matrix, [[1.0, 3.0], [np.nan, np.nan]], equal_nan=True)
+    assert table.as_dataset()[Run({"M": "a", "N": 1})] == dataset[Run({"N": 1, "M": "a"})]
+
+def test_kind_dataset_find():
+    from npf.types.series import KindDataset
+    kd = KindDataset("time")
+    for n in range(1, 4):
+        for t in range(3):
+            kd[Run({"N": n, "M": "a", "time": t})] = {"LAT": [n * t]}
+    assert kd.find(Run({"N": "2", "M": "a"})) == [Run({"N": 2, "M": "a"})]
+    assert len(kd.find(Run({"M": "a"}))) == 3
+    other = KindDataset("time")
+    kd.move(Run({"N": 2, "M": "a"}), other)
+    assert kd.find(Run({"N": 2, "M": "a"})) == [] and len(kd.find(Run({"M": "a"}))) == 2
+    kd.merge(other)
+    assert kd.find(Run({"N": 2, "M": "a"})) == [Run({"N": 2, "M": "a"})]
+    assert kd[Run({"N": 2, "M": "a", "time": 2})] == {"LAT": [4]}
+
+def test_expander():
+    from npf.section import SectionVariable
+    from npf.variable import ListVariable, RangeVariable, SimpleVariable
+    v = SectionVariable()
+    v.vlist["A"] = ListVariable("A", ["x", "y"])
+    v.vlist["B"] = RangeVariable("B", 1, 3, False)
+    v.vlist["C"] = SimpleVariable("C", 5)
+    expanded = list(v.expand())
+    assert len(v.expand()) == 6
+    assert expanded == [{"A": a, "B": b, "C": 5} for b in [1, 2, 3] for a in ["x", "y"]]
+    assert v.expand()[3] == expanded[3]
+    shuffled = list(v.expand(method="random"))
+    assert len(shuffled) == 6 and all(e in shuffled for e in expanded)
+
+def test_search_expander():
+    from npf.section import SectionVariable
+    from npf.variable import VariableFactory, ListVariable
+    v = SectionVariable()
+    v.vlist["RATE"] = VariableFactory.build("RATE", "SEARCH(0,100,result=DROPPED,target=0)")
+    v.vlist["N"] = ListVariable("N", [1, 2])
+    expander = v.expand()
+    tried = []
+    for z in expander:
+        assert list(z.keys()) == ["RATE", "N"]
+        tried.append((z["N"], z["RATE"]))
+        expander.feed(z, {"DROPPED": [max(0, z["RATE"] - 37 * z["N"])]})
+    assert len(tried) <= len(expander)
+    assert max([r for n, r in tried if n == 1 and r <= 37]) == 37 and (1, 38) in tried
+    assert max([r for n, r in tried if n == 2 and r <= 74]) == 74 and (2, 75) in tried
+
+def test_design_expander():
+    from npf.section import SectionVariable
+    from npf.variable import ListVariable, RangeVariable
+    v = SectionVariable()
+    v.vlist["A"] = RangeVariable("A", 0, 1000, False)
+    v.vlist["B"] = RangeVariable("B", 1, 1024, True)
+    v.vlist["C"] = ListVariable("C", ["x", "y"])
+    for method in ["lhs:16", "sobol:16:3"]:
+        expanded = list(v.expand(method=method))
+        assert len(expanded) == 32 and expanded == list(v.expand(method=method))
+        assert all([list(z.keys()) == ["A", "B", "C"] and 0 <= z["A"] <= 1000 and z["B"] in v.vlist["B"].makeValues() for z in expanded])
+    #With a Latin hypercube, each value of a range having as many values as points is tested once
+    v.vlist["A"] = RangeVariable("A", 0, 7, False)
+    assert sorted([z["A"] for z in v.expand(method="lhs:8") if z["C"] == "x"]) == list(range(8))
+    #The upper bound of a range that is not aligned on its step is part of the domain, as in the full grid
+    v.vlist["A"] = RangeVariable("A", 0, 10, False, step=3)
+    assert sorted(set([z["A"] for z in v.expand(method="lhs:16")])) == [0, 3, 6, 9, 10]
+
+def test_needed_runs():
+    args = test_args()
+    testie = Testie("integration/math.npf", options=args, tags=args.tags)
+    testie.config.override("n_runs", "auto")
+    assert testie.config.adaptive_runs() and testie.config.get_ratio("target_ci") == 0.02
+    assert testie.needed_runs({}) == 3
+    assert testie.needed_runs({"R": [100.0]}) == 2
+    assert testie.needed_runs({"R": [100.0, 100.0, 100.0]}) == 0
+    assert testie.needed_runs({"R": [100.0, 100.5, 99.5]}) == 0
+    assert 0 < testie.needed_runs({"R": [80.0, 100.0, 120.0]}) <= 27
+    assert testie.needed_runs({"R": [80.0, 120.0] * 15}) == 0
+
+def test_stop_when():
+    from npf.stopwhen import StopCondition, SweepStopper
+    assert StopCondition.parse("LATENCY>10ms").value == 0.01
+    stopper = SweepStopper([StopCondition.parse("TP:plateau(2,1%)"), StopCondition.parse("LAT > 10ms")], "LOAD")
+    for load in range(1, 11):
+        for n in [1, 3]:
+            v = OrderedDict([("LOAD", load), ("N", n)])
+            if stopper.skip(v):
+                continue
+            stopper.feed(v, {"TP": [min(load * 10, 40)], "LAT": [load * n / 1000]})
+    assert not stopper.skip({"LOAD": 6, "N": 1}) and stopper.skip({"LOAD": 7, "N": 1})
+    assert not stopper.skip({"LOAD": 4, "N": 3}) and stopper.skip({"LOAD": 5, "N": 3})
+
+def test_template():
+    from npf.variable import Template, replace_variables, replace_variables_regex
+    content = "a $A ${B}c \\$A $((1 + $N)) \\$(( $N * 2 )) $UNKNOWN\n"
+    for v in [{"A": 1, "B": "b", "N": 2}, {"A": "$B", "B": "x", "N": 3}, {"A": 1, "B": 2, "N": "2)"}]:
+        assert replace_variables(v, content) == replace_variables_regex(v, content)
+    assert replace_variables({"A": 1, "B": "b", "N": 2}, content) == "a 1 bc \\$A 3 $((2 * 2)) $UNKNOWN\n"
+    assert Template.get(content) is Template.get(content)
+
+def test_config_cache():
+    from npf.section import SectionConfig
+    from npf.variable import ListVariable, DictVariable
+    config = SectionConfig()
+    assert config.match("accept_zero", "DROPPED") and not config.match("accept_zero", "THROUGHPUT")
+    assert config.get_dict_value("var_divider", "result", result_type="THROUGHPUT", default=1) == 1
+    config.override("accept_zero", ListVariable("accept_zero", ["THROUGH.*"]))
+    config.override("var_divider", DictVariable("var_divider", ["THROUGHPUT:1000"]))
+    assert config.match("accept_zero", "THROUGHPUT") and not config.match("accept_zero", "DROPPED")
+    assert config.get_dict_value("var_divider", "result", result_type="THROUGHPUT", default=1) == "1000"
+    config.get_list("accept_zero").append("X")
+    assert config.get_list("accept_zero") == ["THROUGH.*"]
+
+def test_event_bus():
+    import multiprocessing
+    import pickle
+    from npf.eventbus import EventBus
+    bus = EventBus()
+    assert pickle.loads(pickle.dumps(bus)) is bus
+    p = multiprocessing.get_context('fork').Process(target=lambda: [bus.post("READY") for i in range(2)])
+    p.start()
+    bus.listen("READY", 2)
+    p.join()
+    assert bus.count("READY") == 2 and bus.count("OTHER") == 0
+    name, count, posted, woken = bus.timeline()[0]
+    assert name == "READY" and count == 2 and woken >= posted and len(bus.skews()) == 1
+    bus.terminate()
+    bus.listen("OTHER")
+    bus.reset()
+    assert not bus.is_terminated() and bus.count("READY") == 0 and bus.timeline() == []
+    bus.close()
+
+def test_async_executor():
+    import asyncio
+    from npf.eventbus import AsyncEventBus
+    from npf.executor.asyncexecutor import AsyncExecutor
+    from npf.executor.localexecutor import LocalExecutor
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    bus = AsyncEventBus(loop)
+    executor = AsyncExecutor.of(LocalExecutor())
+
+    async def client():
+        await bus.async_listen("READY")
+        return await executor.exec("echo CLIENT", event=bus)
+
+    server = executor.exec("echo EVENT READY; echo SERVER", event=bus)
+    expired = executor.exec("sleep 5", timeout=0.2, event=bus)
+    (spid, so, se, sc), (cpid, co, ce, cc), (epid, eo, ee, ec) = loop.run_until_complete(
+        asyncio.gather(server, client(), expired))
+    asyncio.set_event_loop(None)
+    loop.close()
+    assert so == "EVENT READY\nSERVER\n" and co == "CLIENT\n" and sc == 0 and cc == 0
+    assert epid == 0
+    assert bus.count("READY") == 1 and len(bus.skews()) == 1
+
+def test_result_parser():
+    from npf.resultparser import ResultParser
+    from npf.section import SectionConfig
+    from npf.executor.localexecutor import LocalExecutor
+    regex_list = SectionConfig().get_list("result_regex")
+    parser = ResultParser(regex_list, tail=2)
+    script = "echo RESULT-A 1; echo 'RESULT-B 2ms'; echo 3-RESULT-C 4"
+    pid, o, e, c = LocalExecutor().exec(script, on_output=parser.feed)
+    assert o == '' and c == 0
+    expected = [('A', 'time', None, 1.0), ('B', 'time', None, 0.002), ('C', 'time', '3', 4.0)]
+    assert list(parser.matches) == expected
+    assert list(ResultParser(regex_list).parse("RESULT-A 1\nRESULT-B 2ms\n3-RESULT-C 4\n").matches) == expected
+    assert parser.output() == "[1 lines not kept]\nRESULT-B 2ms\n3-RESULT-C 4\n"
+
+    #The matches found while the script runs are forwarded to the main process, that merges them in script order
+    import queue, time
+    from npf.testie import PartialResults
+    forwarded = []
+    parser = ResultParser(regex_list, forward=forwarded.append, interval=0)
+    for lines in ["RESULT-A 1\n", "nothing\n", "RESULT-A 2\nRESULT-B 3\n"]:
+        parser.feed(lines)
+    assert [list(m) for m in forwarded] == [[('A', 'time', None, 1.0)], [('A', 'time', None, 2.0), ('B', 'time', None, 3.0)]]
+    got = []
+    partial = PartialResults(queue.Queue(), lambda matches: got.append(list(matches)))
+    partial.queue.put((1, forwarded[1]))
+    partial.queue.put((0, forwarded[0]))
+    start = time.time()
+    while (not got or len(got[-1]) < 3) and time.time() - start < 5:
+        time.sleep(0.01)
+    partial.close()
+    assert got[-1] == [('A', 'time', None, 1.0), ('A', 'time', None, 2.0), ('B', 'time', None, 3.0)]
+
+def test_live_feed():
+    import json
+    import socket
+    import time
+    import pytest
+    from npf.livefeed import LiveFeed
+    with pytest.raises(Exception):
+        LiveFeed("udp:1")
+    feed = LiveFeed("tcp:0")
+    feed.publish("lost")
+    assert feed.queue.empty()
+    client = socket.create_connection(('127.0.0.1', feed.port()))
+    while not feed.clients:
+        time.sleep(0.01)
+    feed.publish("result", variables={"N": 1}, results={"X": [1.0]})
+    message = json.loads(client.makefile().readline())
+    assert message["event"] == "result" and message["variables"] == {"N": 1} and message["results"] == {"X": [1.0]}
+    feed.close()
+    client.close()
+
+def test_ssh_pool():
+    import socket
+    import threading
+    import paramiko
+    from npf.executor.sshpool import SSHConnectionPool
+    key = paramiko.RSAKey.generate(1024)
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(4)
+
+    class Server(paramiko.ServerInterface):
+        def get_allowed_auths(self, username):
+            return "password"
+
+        def check_auth_password(self, username, password):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+    transports = []
+
+    def serve():
+        while True:
+            try:
+                conn, addr = listener.accept()
+            except OSError:
+                return
+            t = paramiko.Transport(conn)
+            t.add_server_key(key)
+            t.start_server(server=Server())
+            transports.append(t)
+
+    server = threading.Thread(target=serve)
+    server.daemon = True
+    server.start()
+
+    def connect():
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect('127.0.0.1', port=listener.getsockname()[1], username='npf', password='npf', look_for_keys=False,
+                    allow_agent=False)
+        return ssh
+
+    pool = SSHConnectionPool()
+    ssh = pool.get('node', connect)
+    assert pool.get('node', connect) is ssh and pool.opened == 1 and pool.reused == 1
+    ssh.get_transport().close()
+    assert pool.get('node', connect) is not ssh and pool.opened == 2
+    pool.close()
+
+    #A failing command only closes its own channel while the connection is alive
+    from npf.executor.sshexecutor import SSHExecutor
+    from npf.executor.sshpool import ssh_pool
+    ssh = ssh_pool.get('test-node', connect)
+    channel = ssh.get_transport().open_session()
+    SSHExecutor._abort(ssh, channel)
+    assert channel.closed and ssh_pool.get('test-node', connect) is ssh
+    ssh.get_transport().close()
+    SSHExecutor._abort(ssh, None)
+    assert ssh_pool.get('test-node', connect) is not ssh
+    ssh_pool.close()
+    listener.close()
+    for t in transports:
+        t.close()
+
+def test_ssh_reader():
+    import socket
+    import threading
+    import paramiko
+    from npf.executor.sshreader import ChannelReader
+    a, b = socket.socketpair()
+
+    class Server(paramiko.ServerInterface):
+        def get_allowed_auths(self, username):
+            return "password"
+
+        def check_auth_password(self, username, password):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+    server = paramiko.Transport(b)
+    server.add_server_key(paramiko.RSAKey.generate(1024))
+    server.start_server(threading.Event(), server=Server())
+    client = paramiko.Transport(a)
+    client.connect(username='npf', password='npf')
+    channel = client.open_session()
+    remote = server.accept(5)
+
+    lines = []
+    reader = ChannelReader()
+    watch = reader.watch(channel, lines.append, pid_line=True)
+    remote.sendall(b"42\r\nEVENT READY\r\n")
+    remote.sendall_stderr(b"warning\n")
+    remote.sendall(b"RESULT 1")
+    remote.send_exit_status(0)
+    remote.close()
+    assert watch.done.wait(5)
+    assert watch.pid == 42
+    assert ''.join(lines) == "EVENT READY\r\nRESULT 1"
+    assert watch.error() == "warning\n"
+    client.close()
+    server.close()
+
+def test_ssh_write_files():
+    import io
+    import tarfile
+    from npf.executor.sshexecutor import SSHExecutor
+    sent = []
+
+    class Channel:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def exec_command(self, cmd):
+            self.cmd = cmd
+            self.data = b''
+
+        def sendall(self, data):
+            self.data += data
+
+        def shutdown_write(self):
+            sent.append((self.cmd, tarfile.open(fileobj=io.BytesIO(self.data))))
+
+        def recv_exit_status(self):
+            return 0
+
+    class SSH:
+        def get_transport(self):
+            return self
+
+        def open_channel(self, kind):
+            return Channel()
+
+    executor = SSHExecutor('npf', 'node', '/npf', 22)
+    executor.get_connection = lambda cache=True: SSH()
+    assert executor.writeFiles([('a', 'A'), ('b', 'B')], 'testie')
+    assert len(sent) == 1
+    cmd, tar = sent[0]
+    assert cmd == 'mkdir -p /npf/testie && tar -x -m -f - -C /npf/testie'
+    assert tar.getnames() == ['a', 'b'] and tar.extractfile('b').read() == b'B'
+    assert executor.writeFiles([('a', 'A'), ('b', 'B')], 'testie')
+    assert len(sent) == 1
+    assert executor.writeFiles([('a', 'A'), ('b', 'C')], 'testie')
+    assert sent[1][1].getnames() == ['b']
+
+def test_folder_sync(tmpdir):
+    import io
+    import json
+    import tarfile
+    from npf.executor import sync
+    local = tmpdir.mkdir('local')
+    local.mkdir('build').join('bin').write('binary')
+    local.join('build').mkdir('.git').join('HEAD').write('ignored')
+    local.join('build').join('README').write('readme')
+    manifest = sync.local_manifest(str(local.join('build')), 'build')
+    assert list(manifest.keys()) == ['build', 'build/README', 'build/bin']
+    assert sync.changed(manifest, {}) == list(manifest.keys())
+
+    out = io.BytesIO()
+    assert sync.write_tar(out, str(local.join('build')), 'build', sync.changed(manifest, {}), manifest) == 12
+    remote = tmpdir.mkdir('remote')
+    with tarfile.open(fileobj=io.BytesIO(out.getvalue()), mode='r:gz') as tar:
+        tar.extractall(str(remote))
+    assert remote.join('build').join('bin').read() == 'binary'
+    sent = json.loads(remote.join(sync.MANIFEST_FOLDER).join(sync.manifest_name('build')).read())
+    assert sync.changed(manifest, sent) == []
+
+    local.join('build').join('bin').write('binary2')
+    assert sync.changed(sync.local_manifest(str(local.join('build')), 'build'), sent) == ['build/bin']
+
+def test_agent(tmpdir):
+    import time
+    from npf.eventbus import EventBus
+    from npf.executor.localexecutor import LocalExecutor
+    from npf.executor.agentexecutor import AgentExecutor
+    from npf.agent import AgentClient
+    executor = AgentExecutor(LocalExecutor())
+    event = EventBus()
+    pid, out, err, ret = executor.exec("echo 'EVENT READY'; read v; echo RESULT $v; echo oops >&2; exit 3",
+                                       stdin="4\n", event=event)
+    assert pid > 0 and ret == 3
+    assert out == "EVENT READY\nRESULT 4\n" and err == "oops\n"
+    assert event.count("READY") == 1
+
+    start = time.time()
+    pid, out, err, ret = executor.exec("echo started; sleep 10", timeout=0.5, event=EventBus())
+    assert pid == 0 and out == "started\n" and ret == -2
+    assert time.time() - start < 5
+
+    #Scripts are interrupted before being killed
+    pid, out, err, ret = executor.exec("trap 'echo bye; exit 5' INT; sleep 10", timeout=0.5, event=EventBus())
+    assert out == "bye\n" and ret == 5
+    pid, out, err, ret = executor.exec("trap '' INT; echo started; sleep 10 & wait", timeout=0.5, event=EventBus())
+    assert out == "started\n" and ret == -9
+
+    #The environment, PATH and folder are given to the agent instead of being set by a shell
+    tmpdir.join('npf-test-bin').write("#!/bin/sh\necho bin\n")
+    tmpdir.join('npf-test-bin').chmod(0o755)
+    pid, out, err, ret = executor.exec("echo $NPF_TEST $PWD; npf-test-bin", bin_paths=[str(tmpdir)],
+                                       env={'NPF_TEST': 'x'}, event=EventBus())
+    assert out == "x %s\nbin\n" % os.getcwd() and ret == 0
+
+    client = executor.client()
+    assert isinstance(client, AgentClient) and executor.client() is client
+    assert client.write(str(tmpdir.join('sub').join('f')), 'content').wait(5)['ok']
+    assert tmpdir.join('sub').join('f').read() == 'content'
+
+def test_send_folders(capsys):
+    class Executor:
+        def __init__(self):
+            self.sent = []
+
+        def sendFolder(self, path, local=None):
+            self.sent.append(path)
+            return 10
+
+    class Node:
+        def __init__(self, name):
+            self.name = name
+            self.executor = Executor()
+
+    a, b = Node('a'), Node('b')
+    Testie.send_folders([("software x", "client", a, "x", None), ("software x", "server", a, "x", None),
+                         ("software x", "server", b, "x", None)])
+    assert a.executor.sent == ["x"] and b.executor.sent == ["x"]
+    assert "Sending software x to client, server (a)... 10 bytes sent" in capsys.readouterr().out
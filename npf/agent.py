@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+NPF agent, started once per node to run the commands of NPF instead of opening an SSH session or spawning a process
+per command. It reads requests from its standard input and answers on its standard output, so it can be started
+through an SSH channel as well as locally.
+Every message is a JSON object preceded by its length as 4 bytes in network order. Requests have an "op" and an "id"
+chosen by the client, that is repeated in the messages about that request, so many commands share the connection :
+ - exec (argv or cmd, env, path, cwd, folders, sudo, stdin) : run argv, or cmd through the shell, in a new process
+   group, after creating the folders. Answers started (pid), then stdout and stderr (data, complete lines) as they are
+   printed, and exit (code) once the output is closed and the process is reaped
+ - write (path, content) : create a file and its folder, answers done (ok, error)
+ - kill (target, grace) : interrupt the exec request target, its process group and its descendants with SIGINT, then
+   kill them with SIGKILL if they are still running after grace seconds. Commands started with sudo are signaled
+   through sudo. Answers done (ok, error) once they finished or could not be killed
+When the input is closed, the agent kills the commands it started and exits.
+This file must only depend on the standard library, as it is copied to the nodes.
+"""
+import json
+import os
+import signal
+import struct
+import subprocess
+import sys
+import threading
+
+READ_SIZE = 65536
+# Seconds a command has to finish after SIGINT before being killed
+GRACE = 1
+_header = struct.Struct('>I')
+
+
+def send_message(out, lock, message):
+    data = json.dumps(message).encode()
+    with lock:
+        out.write(_header.pack(len(data)) + data)
+        out.flush()
+
+
+def _read_exactly(inp, n):
+    data = b''
+    while len(data) < n:
+        chunk = inp.read(n - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def receive_message(inp):
+    """
+    The next message, or None when the connection is closed
+    """
+    header = _read_exactly(inp, _header.size)
+    if header is None:
+        return None
+    data = _read_exactly(inp, _header.unpack(header)[0])
+    if data is None:
+        return None
+    return json.loads(data.decode())
+
+
+def descendants(pid):
+    """
+    The pids of the descendants of pid, found in /proc, or an empty list where there is no /proc
+    """
+    children = {}
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        ppid = int(stat[stat.rfind(')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    result = []
+    todo = [pid]
+    while todo:
+        for child in children.get(todo.pop(), []):
+            result.append(child)
+            todo.append(child)
+    return result
+
+
+class Running:
+    """
+    A command started by the agent, finished once its output is closed and it is reaped
+    """
+    def __init__(self, p, sudo):
+        self.p = p
+        self.sudo = sudo
+        self.finished = threading.Event()
+
+
+class Agent:
+    def __init__(self, inp, out):
+        self.inp = inp
+        self.out = out
+        self.lock = threading.Lock()
+        self.processes = {}
+
+    def send(self, message):
+        try:
+            send_message(self.out, self.lock, message)
+        except (BrokenPipeError, OSError):
+            pass
+
+    def serve(self):
+        while True:
+            m = receive_message(self.inp)
+            if m is None:
+                break
+            try:
+                getattr(self, '_' + m['op'])(m)
+            except Exception as e:
+                self.send({'op': 'error', 'id': m.get('id', None), 'error': str(e)})
+        for r in list(self.processes.values()):
+            self._signal(r, signal.SIGKILL, [])
+
+    def _exec(self, m):
+        env = os.environ.copy()
+        env.update(m.get('env', {}))
+        if m.get('path', None):
+            env['PATH'] = ':'.join(m['path']) + ':' + env.get('PATH', '')
+        cwd = m.get('cwd', None)
+        for folder in m.get('folders', []):
+            os.makedirs(os.path.join(cwd, folder) if cwd else folder, exist_ok=True)
+        argv = m.get('argv', None)
+        p = subprocess.Popen(argv if argv else m['cmd'], shell=not argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, preexec_fn=os.setsid, cwd=cwd, env=env)
+        r = Running(p, m.get('sudo', False))
+        self.processes[m['id']] = r
+        self.send({'op': 'started', 'id': m['id'], 'pid': p.pid})
+        t = threading.Thread(target=self._run, args=(m, r))
+        t.daemon = True
+        t.start()
+
+    def _forward(self, i, kind, read):
+        pending = b''
+        while True:
+            data = read(READ_SIZE)
+            if not data:
+                break
+            data = pending + data
+            n = data.rfind(b'\n') + 1
+            pending = data[n:]
+            if n:
+                self.send({'op': kind, 'id': i, 'data': data[:n].decode(errors='replace')})
+        if pending:
+            self.send({'op': kind, 'id': i, 'data': pending.decode(errors='replace')})
+
+    def _run(self, m, r):
+        i = m['id']
+        p = r.p
+        err = threading.Thread(target=self._forward, args=(i, 'stderr', p.stderr.read1))
+        err.daemon = True
+        err.start()
+        stdin = m.get('stdin', None)
+        if stdin:
+            try:
+                p.stdin.write(stdin.encode())
+            except BrokenPipeError:
+                pass
+        try:
+            p.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._forward(i, 'stdout', p.stdout.read1)
+        err.join()
+        code = p.wait()
+        self.processes.pop(i, None)
+        r.finished.set()
+        self.send({'op': 'exit', 'id': i, 'code': code})
+
+    def _write(self, m):
+        try:
+            folder = os.path.dirname(m['path'])
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            with open(m['path'], 'w') as f:
+                f.write(m['content'])
+            self.send({'op': 'done', 'id': m['id'], 'ok': True})
+        except OSError as e:
+            self.send({'op': 'done', 'id': m['id'], 'ok': False, 'error': str(e)})
+
+    @staticmethod
+    def _signal(r, sig, errors):
+        """
+        Send sig to the process group of a command and to its descendants, that may have left the group
+        """
+        pids = descendants(r.p.pid)
+        if r.sudo and os.geteuid() != 0:
+            #The processes of root cannot be signaled by the user of the agent
+            k = subprocess.run(['sudo', '-n', 'kill', '-s', signal.Signals(sig).name[3:], '--', '-%d' % r.p.pid] +
+                               [str(pid) for pid in pids], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            err = [l for l in k.stderr.decode(errors='replace').splitlines() if 'No such process' not in l]
+            if k.returncode != 0 and err:
+                errors.append(' '.join(err))
+            return
+        for target, kill in [(r.p.pid, os.killpg)] + [(pid, os.kill) for pid in pids]:
+            try:
+                kill(target, sig)
+            except ProcessLookupError:
+                pass
+            except PermissionError as e:
+                errors.append("%d : %s" % (target, e))
+
+    def _terminate(self, i, r, grace):
+        errors = []
+        self._signal(r, signal.SIGINT, errors)
+        if not r.finished.wait(grace):
+            self._signal(r, signal.SIGKILL, errors)
+            if not r.finished.wait(grace) and not errors:
+                errors.append("still running after SIGKILL")
+        self.send({'op': 'done', 'id': i, 'ok': not errors, 'error': ', '.join(errors)})
+
+    def _kill(self, m):
+        r = self.processes.get(m['target'], None)
+        if r is None:
+            self.send({'op': 'done', 'id': m['id'], 'ok': True})
+            return
+        #Waiting for the command to stop must not block the other requests
+        t = threading.Thread(target=self._terminate, args=(m['id'], r, m.get('grace', GRACE)))
+        t.daemon = True
+        t.start()
+
+
+class AgentProcess:
+    """
+    A command run by an agent, done once its output is closed and its exit code is known
+    """
+    def __init__(self, client, on_stdout, on_done):
+        self.client = client
+        self.id = None
+        self.on_stdout = on_stdout
+        self.on_done = on_done
+        self.pid = None
+        self.code = None
+        self.stderr = []
+        self.started = threading.Event()
+        self.done = threading.Event()
+
+    def handle(self, m):
+        op = m['op']
+        if op == 'stdout':
+            self.on_stdout(m['data'])
+        elif op == 'stderr':
+            self.stderr.append(m['data'])
+        elif op == 'started':
+            self.pid = m['pid']
+            self.started.set()
+        else:
+            if op == 'error':
+                self.stderr.append(m['error'])
+                self.code = -1
+            else:
+                self.code = m['code']
+            self.started.set()
+            self.done.set()
+            if self.on_done:
+                self.on_done()
+            return True
+        return False
+
+    def kill(self, grace=GRACE):
+        """
+        Interrupt the command, then kill it after grace seconds
+        :return: A reply to wait for, ok if the command is not running anymore
+        """
+        return self.client.request({'op': 'kill', 'target': self.id, 'grace': grace})
+
+    def error(self):
+        return ''.join(self.stderr)
+
+
+class _Reply:
+    def __init__(self):
+        self.id = None
+        self.message = None
+        self.done = threading.Event()
+
+    def handle(self, m):
+        self.message = m
+        self.done.set()
+        return True
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.message
+
+
+class AgentClient:
+    """
+    Connection to an agent, thread-safe. A thread reads the messages of the agent and gives them to the process or the
+    reply they are about.
+    """
+    def __init__(self, inp, out, close=None):
+        self.inp = inp
+        self.out = out
+        self._close = close
+        self.lock = threading.Lock()
+        self.handlers = {}
+        self.next_id = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._read)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _read(self):
+        while True:
+            try:
+                m = receive_message(self.inp)
+            except (OSError, ValueError):
+                m = None
+            if m is None:
+                break
+            handler = self.handlers.get(m.get('id', None), None)
+            if handler is not None and handler.handle(m):
+                self.handlers.pop(m['id'], None)
+        self.closed = True
+        for i, handler in list(self.handlers.items()):
+            handler.handle({'op': 'error', 'id': i, 'error': 'Connection to the agent lost'})
+        self.handlers = {}
+
+    def request(self, message, handler=None):
+        if handler is None:
+            handler = _Reply()
+        with self.lock:
+            if self.closed:
+                raise Exception("The connection to the agent is closed")
+            self.next_id += 1
+            message['id'] = handler.id = self.next_id
+            self.handlers[self.next_id] = handler
+        send_message(self.out, self.lock, message)
+        return handler
+
+    def exec(self, cmd=None, argv=None, env=None, path=None, cwd=None, folders=None, sudo=False, stdin=None,
+             on_stdout=None, on_done=None):
+        """
+        Start argv, or cmd through the shell, on_stdout being given the lines of its output as they are printed
+        :return: An AgentProcess, done when the command finished
+        """
+        p = AgentProcess(self, on_stdout if on_stdout else lambda lines: None, on_done)
+        return self.request({'op': 'exec', 'cmd': cmd, 'argv': argv, 'env': env if env else {},
+                             'path': path if path else [], 'cwd': cwd, 'folders': folders if folders else [],
+                             'sudo': sudo, 'stdin': stdin}, p)
+
+    def write(self, path, content):
+        """
+        Create a file, returning a reply to wait for
+        """
+        return self.request({'op': 'write', 'path': path, 'content': content})
+
+    def close(self):
+        try:
+            self.out.close()
+        except OSError:
+            pass
+        if self._close:
+            self._close()
+
+
+def main():
+    agent = Agent(sys.stdin.buffer, sys.stdout.buffer)
+    #Nothing else may write on the output used to answer
+    sys.stdout = sys.stderr
+    agent.serve()
+
+
+if __name__ == '__main__':
+    main()
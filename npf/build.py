@@ -3,11 +3,18 @@ import subprocess
 from collections import OrderedDict
 from subprocess import PIPE
 from pathlib import Path
-import re
 from npf import variable, npf
 from npf.types.dataset import Run, Dataset
+from npf.types.series import KindDataset
+from npf.store import get_store, stores
+from npf.store.sqlitestore import split_filename
+from npf.store.cache import results_cache, signature
+from npf.store.textstore import format_line, parse_line
 import copy
 
+# Extension of the append-only journal kept next to each result file
+JOURNAL_EXT = '.journal'
+
 renametable = {
     'npf.script': 'npf.npf',
     'npf.testie': 'npf.npf'
@@ -36,7 +43,6 @@ class Build:
         self._pretty_name = None
         self._marker = '.'
         self._line = '-'
-        self.cache = {}
         self._result_path = result_path
 
     def copy(self):
@@ -96,105 +102,194 @@ class Build:
         if kind:
             for kind, kresult in all_results.items():
                 filename = self.__resultFilename(testie) + '-' + kind
-                self._writeversion(filename, kresult, allow_overwrite)
+                self._writeversion(filename, kresult, allow_overwrite, kind=kind)
         else:
             filename = self.__resultFilename(testie)
             self._writeversion(filename, all_results, allow_overwrite)
 
-    def _writeversion(self, filename, all_results, allow_overwrite):
+    def appendversion(self, testie, results: Dataset, kind = False):
+        """
+        Append some runs to the result journal of the testie, instead of rewriting the whole result file.
+        The journal is replayed on top of the result file by load_results, and folded into it by compact.
+        :param results: The runs to append. If kind is True, a dict of kind -> Dataset
+        """
+        if kind:
+            for kind, kresults in results.items():
+                if kresults:
+                    self._appendversion(self.__resultFilename(testie) + '-' + kind, kresults, kind=kind)
+        elif results:
+            self._appendversion(self.__resultFilename(testie), results)
+
+    def _appendversion(self, filename, results, kind=None):
+        try:
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+        except OSError:
+            print("Error : could not create %s" % os.path.dirname(filename))
+        #Stores that can update runs in place do not need the journal
+        if not get_store(kind=kind is not None).append(filename, results):
+            self._repair_journal(filename + JOURNAL_EXT)
+            with open(filename + JOURNAL_EXT, 'a') as f:
+                f.write(''.join([format_line(run, run_results) for run, run_results in results.items()]))
+                f.flush()
+                os.fsync(f.fileno())
+        if results_cache.contains(os.path.abspath(filename)):
+            results_cache.update(os.path.abspath(filename), self._signature(filename, kind), results)
+
+    @staticmethod
+    def _repair_journal(journal):
+        """
+        Remove the partial last line left by an interrupted append, so new runs are not appended to it
+        """
+        if not os.path.exists(journal):
+            return
+        with open(journal, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            f.seek(0)
+            data = f.read()
+            f.truncate(data.rfind(b'\n') + 1)
+
+    def compact(self, testie):
+        """
+        Fold the journals of the testie (and of all its kinds) into the result files
+        """
+        filename = self.__resultFilename(testie)
+        for f, kind in [(filename, None)] + [(filename + '-' + kind, kind) for kind in self._list_kinds(filename + '-')]:
+            if os.path.exists(f + JOURNAL_EXT):
+                results = self._load_results(testie, f, cache=False, kind=kind)
+                self._writeversion(f, results, allow_overwrite=True, kind=kind)
+
+    def _writeversion(self, filename, all_results, allow_overwrite, store=None, kind=None):
         try:
             if not os.path.exists(os.path.dirname(filename)):
                 os.makedirs(os.path.dirname(filename))
         except OSError:
             print("Error : could not create %s" % os.path.dirname(filename))
-        if not allow_overwrite and os.path.exists(filename):
+        if store is None:
+            store = get_store(kind=kind is not None)
+        if not allow_overwrite and self._find_store(filename):
             raise Exception("I refuse to overwrite %s" % filename)
-        f = open(filename, 'w+')
-        f.seek(0)
-        for run, results in all_results.items():
-            v = []
-            for key, val in sorted(run.variables.items()):
-                if type(val) is tuple:
-                    val = val[1]
-                v.append((key + ":" + str(val).replace(':','\:')).replace(',','\,'))
-            type_results = []
-            for t,r in results.items():
-                str_results = []
-                if r is None:
-                    pass
-                else:
-                    for val in r:
-                        if type(val) is list:
-                            str_results.extend([str(v) for v in val])
-                        else:
-                            str_results.append(str(val))
-                type_results.append(t+':'+(','.join(str_results)))
-            f.write(','.join(v) + "={" + '},{'.join(type_results) + "}\n")
-        f.close()
-        self.cache[filename] = all_results
+        store.write(filename, all_results)
+        #The journal is now part of the result file
+        if os.path.exists(filename + JOURNAL_EXT):
+            os.unlink(filename + JOURNAL_EXT)
+        results_cache.put(os.path.abspath(filename), self._signature(filename, kind), all_results)
+
+    @classmethod
+    def _signature(cls, filename, kind=None):
+        store = cls._find_store(filename, kind)
+        return signature((store.backing_files(filename) if store else []) + [filename + JOURNAL_EXT])
 
+    @staticmethod
+    def _find_store(filename, kind=None):
+        """
+        Return the store holding the result file, looking at the selected format first
+        """
+        store = get_store(kind=kind is not None)
+        if store.exists(filename):
+            return store
+        for other in stores.values():
+            if other.exists(filename):
+                return other
+        return None
+
+    @staticmethod
+    def _list_kinds(prefix):
+        kinds = OrderedDict()
+        if os.path.exists(os.path.dirname(prefix)):
+            for f in sorted(os.listdir(os.path.dirname(prefix))):
+                if f.endswith('.tmp') or f.endswith('.old'):
+                    continue
+                for ext in [JOURNAL_EXT] + [store.ext for store in stores.values() if store.ext]:
+                    if f.endswith(ext):
+                        f = f[:-len(ext)]
+                if os.path.basename(prefix) in f:
+                    kinds[f[f.rfind("-") + 1 :]] = True
+        for store in stores.values():
+            for kind in store.kinds(prefix[:-1]):
+                kinds[kind] = True
+        return list(kinds.keys())
 
     def load_results(self, testie, kind=False, cache=True):
         if kind:
             kr={}
             filename = self.__resultFilename(testie) + '-'
-            if os.path.exists(os.path.dirname(filename)):
-              for f in os.listdir(os.path.dirname(filename)):
-                if os.path.basename(filename) in f:
-                    kind = f[f.rfind("-") + 1 :]
-                    f = filename + kind
-                    kr[kind] = self._load_results(testie, f, cache)
+            for kind in self._list_kinds(filename):
+                kr[kind] = self._load_results(testie, filename + kind, cache, kind=kind)
             return kr
 
         else:
             filename = self.__resultFilename(testie)
             return self._load_results(testie, filename, cache)
 
-    def _load_results(self, testie, filename, cache):
-        if not Path(filename).exists():
+    def _load_results(self, testie, filename, cache, kind=None):
+        journal = filename + JOURNAL_EXT
+        store = self._find_store(filename, kind)
+        if store is None and not Path(journal).exists():
             return None
+        sig = signature(store.backing_files(filename) + [journal] if store else [journal])
         if cache:
-            if filename in self.cache:
-                return self.cache[filename]
-        f = open(filename, 'r')
-        all_results = OrderedDict()
-        try:
-            for iline,line in enumerate(f):
+            cached = results_cache.get(os.path.abspath(filename), sig)
+            if cached is not None:
+                return cached
+        if store:
+            all_results = store.load(testie, filename)
+        else:
+            all_results = OrderedDict()
+        if kind:
+            all_results = KindDataset.of(kind, all_results)
+        if Path(journal).exists():
+            with open(journal, 'r') as f:
+                lines = f.readlines()
+            for iline, line in enumerate(lines):
                 if not line.strip():
                     continue
-                variables_data, results_data = line.strip().split('=')
-
-                variables = OrderedDict()
-
-                for v_data in re.split(r'(?<!\\),', variables_data):
-                    if v_data.strip():
-                        k, v = re.split(r'(?<!\\):', v_data)
-                        variables[k] = variable.get_numeric(v) if testie.variables.is_numeric(k) else str(v).replace('\:',':')
-                results = {}
-
-                results_data = results_data.strip()[1:-1].split('},{')
-                if len(results_data) == 1 and results_data[0].strip() == '':
-                    pass
-                else:
-                    for type_r, results_type_data in [x.split(':') for x in results_data]:
-                        results_type_data = results_type_data.split(',')
-                        if len(results_type_data) == 1 and results_type_data[0].strip() == '':
-                            type_results = None
-                        else:
-                            type_results = []
-                            for result in results_type_data:
-                                type_results.append(float(result.strip()))
-                        results[type_r] = type_results
-                all_results[Run(variables)] = results
-        except:
-            print("Could not parse %s. The program will stop to avoid erasing data. Please correct or delete the file.\nLine %d : %s" % (filename,iline, line))
-            raise
-        f.close()
-        self.cache[filename] = all_results
+                #Only the last run may be lost if NPF was interrupted while appending it
+                if not line.endswith('\n'):
+                    print("WARNING : Ignoring the truncated last line of %s" % journal)
+                    break
+                try:
+                    run, results = parse_line(testie, line)
+                except:
+                    print("Could not parse %s. The program will stop to avoid erasing data. Please correct or delete the file.\nLine %d : %s" % (journal,iline, line))
+                    raise
+                all_results[run] = results
+        results_cache.put(os.path.abspath(filename), sig, all_results)
         return all_results
 
+    @staticmethod
+    def load_builds(builds, testie):
+        """
+        Load the results of testie for multiple builds of the same repository, skipping those without results.
+        Stores supporting it load all of them with a single query.
+        :return: A generator of (build, results)
+        """
+        store = get_store()
+        loaded = None
+        if builds:
+            root, repo, version, name, kind = split_filename(builds[0].__resultFilename(testie))
+            loaded = store.load_versions(testie, root, repo, [build.version for build in builds])
+        if loaded is None:
+            loaded = {}
+        for build in builds:
+            if build.version in loaded and not os.path.exists(build.__resultFilename(testie) + JOURNAL_EXT):
+                filename = build.__resultFilename(testie)
+                results_cache.put(os.path.abspath(filename), build._signature(filename), loaded[build.version])
+            elif not build.hasResults(testie):
+                continue
+            yield build, build.load_results(testie)
+
     def hasResults(self, script=None):
-        return os.path.exists(self.__resultFilename(script))
+        filename = self.__resultFilename(script)
+        if not script:
+            return os.path.exists(filename)
+        return self._find_store(filename) is not None or os.path.exists(filename + JOURNAL_EXT)
 
     def writeResults(self):
         filename = self.__resultFilename()
@@ -1,7 +1,279 @@
+import asyncio
+import ctypes
+import itertools
 import multiprocessing
 import os
+import threading
+import time
+
+_buses = {}
+_bus_ids = itertools.count()
+
+
+def _lookup(bus_id):
+    bus = _buses.get(bus_id, None)
+    if bus is None:
+        raise Exception("Event bus %s is not shared with this process, it must be created before the worker processes" % str(bus_id))
+    return bus
+
 
 class EventBus:
+    """
+    Events posted by the scripts of a run (EVENT NAME in their output), that other scripts wait for, and the
+    termination of the run.
+    The state lives in shared memory : one counter per event name, so waiting for the n-th event is a single
+    comparison, and a condition that wakes the listeners as soon as an event is posted. The times of the first post and
+    of the first wake-up of each event are recorded, to measure the delay between a script signaling it is ready and
+    the scripts waiting for it being started.
+    Shared memory cannot be sent to the workers of a pool, so the bus is inherited by the processes forked after its
+    creation, and is pickled as an identifier. It is reset between runs instead of being re-created.
+    """
+    MAX_EVENTS = 64
+    NAME_SIZE = 64
+
+    def __init__(self):
+        self.c = multiprocessing.Condition()
+        self._names = multiprocessing.RawArray(ctypes.c_char, self.MAX_EVENTS * self.NAME_SIZE)
+        self._counts = multiprocessing.RawArray(ctypes.c_long, self.MAX_EVENTS)
+        self._posted = multiprocessing.RawArray(ctypes.c_double, self.MAX_EVENTS)
+        self._woken = multiprocessing.RawArray(ctypes.c_double, self.MAX_EVENTS)
+        self._n = multiprocessing.RawValue(ctypes.c_int, 0)
+        self._generation = multiprocessing.RawValue(ctypes.c_long, 0)
+        self._terminated = multiprocessing.RawValue(ctypes.c_int, 0)
+        self._start = multiprocessing.RawValue(ctypes.c_double, time.time())
+        self._slots = {}
+        self._slots_generation = 0
+        self.id = (os.getpid(), next(_bus_ids))
+        _buses[self.id] = self
+
+    def __reduce__(self):
+        return _lookup, (self.id,)
+
+    def close(self):
+        _buses.pop(self.id, None)
+
+    def reset(self):
+        """
+        Forget the events and the termination of the previous run
+        """
+        with self.c:
+            self._n.value = 0
+            self._terminated.value = 0
+            self._generation.value += 1
+            self._start.value = time.time()
+
+    def _slot(self, ev, create=True):
+        """
+        Index of the counter of ev, the caller must hold the condition
+        """
+        if self._slots_generation != self._generation.value:
+            self._slots = {}
+            self._slots_generation = self._generation.value
+        slot = self._slots.get(ev, None)
+        if slot is not None:
+            return slot
+        name = ev.encode()
+        if len(name) > self.NAME_SIZE:
+            raise Exception("Event name %s is too long, the maximum is %d characters" % (ev, self.NAME_SIZE))
+        for i in range(len(self._slots), self._n.value):
+            self._slots[self._names[i * self.NAME_SIZE:(i + 1) * self.NAME_SIZE].rstrip(b'\0').decode()] = i
+        slot = self._slots.get(ev, None)
+        if slot is not None or not create:
+            return slot
+        slot = self._n.value
+        if slot == self.MAX_EVENTS:
+            raise Exception("Too many different events, the maximum is %d" % self.MAX_EVENTS)
+        self._names[slot * self.NAME_SIZE:(slot + 1) * self.NAME_SIZE] = name.ljust(self.NAME_SIZE, b'\0')
+        self._counts[slot] = 0
+        self._posted[slot] = 0
+        self._woken[slot] = 0
+        self._n.value = slot + 1
+        self._slots[ev] = slot
+        return slot
+
+    def post(self, ev):
+        with self.c:
+            slot = self._slot(ev)
+            self._counts[slot] += 1
+            if self._posted[slot] == 0:
+                self._posted[slot] = time.time()
+            self.c.notify_all()
+
+    def terminate(self):
+        with self.c:
+            self._terminated.value = 1
+            self.c.notify_all()
+
+    def wait_for_termination(self, t):
+        if t <= 0:
+            return
+        with self.c:
+            self.c.wait_for(self.is_terminated, t)
+
+    def wait_until(self, predicate, t=None):
+        """
+        Wait until predicate() is true, the run is terminated or t seconds passed. A predicate depending on something
+        else than the events must be followed by a call to wake when it becomes true.
+        """
+        with self.c:
+            self.c.wait_for(lambda: predicate() or self.is_terminated(), t)
+
+    def wake(self):
+        with self.c:
+            self.c.notify_all()
+
+    def is_terminated(self):
+        return self._terminated.value != 0
+
+    def count(self, ev):
+        with self.c:
+            slot = self._slot(ev, create=False)
+            return 0 if slot is None else self._counts[slot]
+
+    def listen(self, ev, n=1):
+        """
+        Wait until ev has been posted n times in this run, or the run is terminated
+        """
+        with self.c:
+            slot = self._slot(ev)
+            self.c.wait_for(lambda: self._counts[slot] >= n or self.is_terminated())
+            if self._counts[slot] >= n and self._woken[slot] == 0:
+                self._woken[slot] = time.time()
+
+    def timeline(self):
+        """
+        Events of the run as a list of (name, number of posts, time of the first post, time the first listener woke
+        up), the times being in seconds since the start of the run, or None
+        """
+        with self.c:
+            events = []
+            start = self._start.value
+            for i in range(self._n.value):
+                name = self._names[i * self.NAME_SIZE:(i + 1) * self.NAME_SIZE].rstrip(b'\0').decode()
+                posted = self._posted[i] - start if self._posted[i] else None
+                woken = self._woken[i] - start if self._woken[i] else None
+                events.append((name, self._counts[i], posted, woken))
+            return events
+
+    def skews(self):
+        """
+        For each event that was waited for, the time between its first post and the first listener waking up
+        """
+        return [woken - posted for name, count, posted, woken in self.timeline()
+                if posted is not None and woken is not None]
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class AsyncEventBus:
+    """
+    Event bus of the scripts of a run executed as coroutines of a single event loop, see --async. Executors without an
+    asyncio implementation run in threads and use the blocking methods, so the state is protected by a threading
+    condition, and the coroutines wait on futures resolved in the loop when their condition is met.
+    """
+    def __init__(self, loop):
+        self.c = threading.Condition()
+        self._loop = loop
+        self.reset()
+
+    def reset(self):
+        with self.c:
+            self._counts = {}
+            self._posted = {}
+            self._woken = {}
+            self._terminated = False
+            self._start = time.time()
+            self._waiters = []  # (predicate, future)
+
+    def _wake(self):
+        self.c.notify_all()
+        waiters = []
+        for predicate, future in self._waiters:
+            if predicate():
+                self._loop.call_soon_threadsafe(_resolve, future)
+            else:
+                waiters.append((predicate, future))
+        self._waiters = waiters
+
+    def post(self, ev):
+        with self.c:
+            self._counts[ev] = self._counts.get(ev, 0) + 1
+            if ev not in self._posted:
+                self._posted[ev] = time.time()
+            self._wake()
+
+    def terminate(self):
+        with self.c:
+            self._terminated = True
+            self._wake()
+
+    def is_terminated(self):
+        return self._terminated
+
+    def count(self, ev):
+        return self._counts.get(ev, 0)
+
+    def _woke(self, ev, n):
+        if self._counts.get(ev, 0) >= n and ev not in self._woken:
+            self._woken[ev] = time.time()
+
+    def wait_for_termination(self, t):
+        if t <= 0:
+            return
+        with self.c:
+            self.c.wait_for(self.is_terminated, t)
+
+    def listen(self, ev, n=1):
+        with self.c:
+            self.c.wait_for(lambda: self._counts.get(ev, 0) >= n or self._terminated)
+            self._woke(ev, n)
+
+    def wait_until(self, predicate, t=None):
+        with self.c:
+            self.c.wait_for(lambda: predicate() or self._terminated, t)
+
+    def wake(self):
+        with self.c:
+            self._wake()
+
+    async def _wait(self, predicate, timeout=None):
+        with self.c:
+            if predicate():
+                return
+            future = self._loop.create_future()
+            self._waiters.append((predicate, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with self.c:
+                self._waiters = [(p, f) for p, f in self._waiters if f is not future]
+
+    async def async_wait_for_termination(self, t):
+        if t > 0:
+            await self._wait(self.is_terminated, t)
+
+    async def async_listen(self, ev, n=1):
+        await self._wait(lambda: self._counts.get(ev, 0) >= n or self._terminated)
+        with self.c:
+            self._woke(ev, n)
+
+    def timeline(self):
+        with self.c:
+            return [(ev, count, self._posted[ev] - self._start,
+                     self._woken[ev] - self._start if ev in self._woken else None) for ev, count in self._counts.items()]
+
+    def skews(self):
+        return [woken - posted for name, count, posted, woken in self.timeline() if woken is not None]
+
+
+class ManagerEventBus:
+    """
+    Event bus using the proxies of a multiprocessing manager, for platforms where the workers are not forked and
+    cannot inherit the shared memory of EventBus
+    """
     def __init__(self, m = None):
         if not m:
             m = multiprocessing.Manager()
@@ -31,28 +303,44 @@ class EventBus:
 
         self.c.release()
 
+    def wait_until(self, predicate, t=None):
+        self.c.acquire()
+        step = 0.1
+        while not predicate() and not self.terminated.is_set():
+            if t is not None:
+                if t <= 0:
+                    break
+                t = t - step
+            self.c.wait(step)
+        self.c.release()
+
+    def wake(self):
+        self.c.acquire()
+        self.c.notify_all()
+        self.c.release()
+
     def is_terminated(self):
         self.c.acquire()
         r = self.terminated.is_set()
         self.c.release()
         return r
 
-    def listen(self, ev):
+    def count(self, ev):
+        self.c.acquire()
+        r = list(self.list).count(ev)
+        self.c.release()
+        return r
+
+    def listen(self, ev, n=1):
         self.c.acquire()
-        i = 0
-        while len(self.list) == 0:
+        while list(self.list).count(ev) < n:
             self.c.wait()
             if self.terminated.is_set():
-                self.c.release()
-                return
-        while self.list[i] != ev:
-            i += 1
-            if i == len(self.list):
-                self.c.wait()
-                if self.terminated.is_set():
-                    self.c.release()
-                    return
+                break
         self.c.release()
 
+    def timeline(self):
+        return []
 
-
+    def skews(self):
+        return []
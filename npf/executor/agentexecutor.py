@@ -0,0 +1,216 @@
+import atexit
+import os
+import pwd
+import sys
+import threading
+import time
+from subprocess import PIPE, Popen
+from typing import List
+
+from .executor import Executor
+from .localexecutor import LocalKiller
+from .sshexecutor import SSHExecutor
+from .. import agent
+
+# Name of the agent in the NPF folder of the nodes
+AGENT_FILE = 'npf-agent.py'
+# Seconds to wait for the agent to report the end of a killed script, that it interrupts then kills after agent.GRACE
+KILL_TIMEOUT = 5
+
+#Connections to the agents of this process, by node
+_clients = {}
+_clients_pid = os.getpid()
+_clients_lock = threading.Lock()
+
+
+def _close_clients():
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            return
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+atexit.register(_close_clients)
+
+
+class AgentExecutor(Executor):
+    """
+    Runs the commands of an executor through an NPF agent started on the node at the first command, see --agent. The
+    agent spawns the scripts itself, so a command costs a message on a connection shared by all the commands of the
+    process, instead of an SSH session, a shell and unbuffer, or a local shell. The command is sent as its arguments,
+    environment, PATH and folder, only sudo and virt wrapping the bash running the script, and its output is not
+    buffered as it is read from pipes by the agent. The agent interrupts a killed script before killing it, through
+    sudo if the script was started with sudo, and reports its real exit code.
+    Files and folders are sent by the executor, that is also used for everything else.
+    """
+    def __init__(self, executor: Executor):
+        self.executor = executor
+        self.color = executor.color
+        self.remote = isinstance(executor, SSHExecutor)
+
+    def __getattr__(self, name):
+        if name == 'executor' or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.executor, name)
+
+    def key(self):
+        if self.remote:
+            return 'ssh', self.executor.user, self.executor.addr, self.executor.port, self.executor.path
+        return 'local',
+
+    def start(self):
+        """
+        Start the agent and connect to it
+        """
+        #The agent only uses the standard library, it runs in isolated mode so the files next to it cannot shadow it
+        if not self.remote:
+            p = Popen([sys.executable, '-I', '-u', agent.__file__], stdin=PIPE, stdout=PIPE)
+            return agent.AgentClient(p.stdout, p.stdin, close=p.wait)
+
+        with open(agent.__file__) as f:
+            source = f.read()
+        if not self.executor.writeFiles([(AGENT_FILE, source)], '.'):
+            raise Exception("Could not send the agent to %s" % self.executor.addr)
+        channel = self.executor.get_connection().get_transport().open_session()
+        channel.exec_command("cd '%s' && python3 -I -u %s" % (self.executor.path, AGENT_FILE))
+
+        def close():
+            channel.shutdown_write()
+            channel.close()
+        return agent.AgentClient(channel.makefile('rb'), channel.makefile('wb'), close=close)
+
+    def client(self):
+        """
+        The connection to the agent of the node, started by the first command of this process
+        """
+        global _clients_pid
+        with _clients_lock:
+            if _clients_pid != os.getpid():
+                #The connections of the parent process cannot be shared
+                _clients.clear()
+                _clients_pid = os.getpid()
+            client = _clients.get(self.key(), None)
+            if client is None or client.closed:
+                client = self.start()
+                _clients[self.key()] = client
+            return client
+
+    def request(self, cmd, bin_paths, options, sudo, testdir, env, virt):
+        """
+        The fields of the exec request running cmd : the node only runs bash, under sudo and virt if given, the
+        environment, PATH and folder being set by the agent
+        """
+        if self.remote:
+            cwd = self.executor.path
+            root = self.executor.user == "root"
+            env = self.executor.npf_env(env.copy())
+        else:
+            cwd = os.path.dirname(os.getcwd()) if testdir is not None else os.getcwd()
+            root = pwd.getpwuid(os.getuid()).pw_name == "root"
+            env = env.copy()
+        path = [p if os.path.isabs(p) else cwd + '/' + p for p in (bin_paths if bin_paths else [])]
+        sudo = sudo and not root
+        if options and options.show_cmd:
+            if self.remote:
+                print("Executing on %s%s (PATH+=%s) :\n%s" % (self.executor.addr, (' with sudo' if sudo else ''), ':'.join(path) + (("NS:" + virt) if virt else ""), cmd.strip()))
+            else:
+                print("Executing (PATH+=%s) :\n%s" % (':'.join(path), cmd.strip()))
+
+        folders = []
+        argv = virt.split() + ['bash', '-c', cmd]
+        if sudo:
+            #sudo resets the PATH
+            if path:
+                argv[-1] = 'export PATH="%s:$PATH"\n' % ':'.join(path) + cmd
+                path = []
+            argv = ['sudo', '-E'] + argv
+            if testdir and self.remote:
+                folders.append(testdir)
+        return {'argv': argv, 'env': {k: str(v) for k, v in env.items() if v is not None}, 'path': path, 'cwd': cwd,
+                'folders': folders, 'sudo': sudo}
+
+    def exec(self, cmd, bin_paths : List[str] = None, queue = None, options = None, stdin = None, timeout=None, sudo=False, testdir=None, event=None, title=None, env={}, virt = "", raw = False, on_output=None):
+        name = self.executor.addr if self.remote else "local"
+        title = name if not title else (name + ' - ' + title if self.remote else title)
+        request = self.request(cmd, bin_paths, options, sudo, testdir, env, virt)
+        if stdin is not None and type(stdin) is not str:
+            stdin = stdin.decode()
+
+        output = []
+        try:
+            p = self.client().exec(stdin=stdin,
+                                   on_stdout=lambda lines: self.output_lines(lines, title, options, event, on_output, output),
+                                   on_done=event.wake if event else None, **request)
+        except Exception as e:
+            print("Could not run the command through the agent of %s" % name)
+            print(e)
+            return 0, '', '', -1
+
+        if queue and not self.remote:
+            p.started.wait()
+            if p.pid:
+                queue.put(LocalKiller(p.pid))
+
+        deadline = time.time() + timeout if timeout is not None else None
+        expired = False
+        try:
+            while not p.done.is_set() and not (event and event.is_terminated()):
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    expired = True
+                    break
+                if event:
+                    event.wait_until(p.done.is_set, remaining)
+                else:
+                    p.done.wait(remaining)
+        except KeyboardInterrupt:
+            self.kill(p, name)
+            return -1, ''.join(output), p.error(), -1
+
+        if not p.done.is_set():
+            if expired:
+                if not self.remote:
+                    print("Test expired")
+                elif event:
+                    event.terminate()
+            self.kill(p, name)
+        pid = p.pid if p.pid else os.getpid()
+        if expired:
+            return 0, ''.join(output), p.error(), p.code
+        return pid, ''.join(output), p.error(), 0 if event and event.is_terminated() else p.code
+
+    @staticmethod
+    def kill(p, name):
+        """
+        Stop a script and wait for its end, reporting when it could not be killed
+        """
+        try:
+            m = p.kill().wait(KILL_TIMEOUT)
+        except Exception as e:
+            #The connection is lost, and the agent killed its scripts
+            m = {'ok': p.done.is_set(), 'error': str(e)}
+        if m is None or not m.get('ok', False):
+            print("WARNING : could not kill the script %s on %s : %s" % (str(p.pid), name, m.get('error', '') if m else 'no answer from the agent'))
+        p.done.wait(KILL_TIMEOUT)
+
+    def writeFile(self, filename, path_to_root, content):
+        with open(filename, "w") as f:
+            f.write(content)
+        return self.writeFiles([(filename, content)], path_to_root)
+
+    def writeFiles(self, files, path_to_root):
+        if not self.remote:
+            return self.executor.writeFiles(files, path_to_root)
+        client = self.client()
+        folder = '%s/%s' % (self.executor.path, path_to_root)
+        #All the requests are sent before waiting for the first reply
+        replies = [(filename, client.write(folder + '/' + filename, content)) for filename, content in files]
+        for filename, reply in replies:
+            m = reply.wait()
+            if not m.get('ok', False):
+                print("Could not create file %s on %s : %s" % (filename, self.executor.addr, m.get('error', '')))
+                return False
+        return True
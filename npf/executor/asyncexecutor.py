@@ -0,0 +1,108 @@
+import asyncio
+import functools
+import os
+import signal
+from abc import ABCMeta, abstractmethod
+from asyncio.subprocess import PIPE
+
+from .executor import Executor
+from .localexecutor import LocalExecutor, LocalKiller, READ_SIZE
+
+
+class AsyncExecutor(metaclass=ABCMeta):
+    """
+    Runs the scripts of an executor as coroutines, so all the scripts of a run can share a single event loop instead of
+    needing one process each. The result of exec is the same (pid, stdout, stderr, return code) as Executor.exec,
+    and on_output is given the lines of stdout as they are read instead of keeping them.
+    """
+    def __init__(self, executor: Executor):
+        self.executor = executor
+
+    @staticmethod
+    def of(executor: Executor, threads=None):
+        """
+        The asyncio implementation for an executor, local scripts being subprocesses of the loop while the other
+        executors are run as they are in a thread of threads
+        """
+        if isinstance(executor, LocalExecutor):
+            return AsyncLocalExecutor(executor)
+        return AsyncThreadExecutor(executor, threads)
+
+    @abstractmethod
+    async def exec(self, cmd, bin_paths=None, queue=None, options=None, stdin=None, timeout=None, sudo=False,
+                   testdir=None, event=None, title=None, env={}, virt="", on_output=None):
+        """
+        Run cmd on the node of the executor
+        :return: (pid, stdout, stderr, return code)
+        """
+
+
+class AsyncLocalExecutor(AsyncExecutor):
+    async def exec(self, cmd, bin_paths=None, queue=None, options=None, stdin=None, timeout=None, sudo=False,
+                   testdir=None, event=None, title=None, env={}, virt="", on_output=None):
+        if not title:
+            title = "local"
+        #Scripts of all the tests share the process, so instead of changing folder, the script runs from where
+        #LocalExecutor would go
+        cwd = os.path.dirname(os.getcwd()) if testdir is not None else os.getcwd()
+        cmd, env = self.executor.command(cmd, bin_paths if bin_paths else [], options, sudo, env, virt, cwd)
+
+        p = await asyncio.create_subprocess_shell(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE, preexec_fn=os.setsid,
+                                                  env=env, cwd=cwd)
+        pid = p.pid
+        #The script is the leader of its session, and may already be reaped by the loop
+        pgpid = pid
+        if queue:
+            queue.put(LocalKiller(pgpid))
+        output = []
+
+        async def read_stdout():
+            pending = b''
+            while True:
+                data = await p.stdout.read(READ_SIZE)
+                if not data:
+                    break
+                data = pending + data
+                i = data.rfind(b'\n') + 1
+                pending = data[i:]
+                if i:
+                    self.executor.output_lines(data[:i].decode(), title, options, event, on_output, output)
+            if pending:
+                self.executor.output_lines(pending.decode(), title, options, event, on_output, output)
+
+        if stdin:
+            p.stdin.write(stdin.encode() if type(stdin) is str else stdin)
+            try:
+                await p.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        p.stdin.close()
+        running = asyncio.ensure_future(asyncio.gather(read_stdout(), p.stderr.read(), p.wait()))
+        try:
+            await asyncio.wait_for(asyncio.shield(running), timeout)
+        except asyncio.TimeoutError:
+            print("Test expired")
+            try:
+                os.killpg(pgpid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            s_err = (await running)[1]
+            return 0, ''.join(output), s_err.decode(), p.returncode
+        s_err = running.result()[1]
+        return pid, ''.join(output), s_err.decode(), 0 if event and event.is_terminated() else p.returncode
+
+
+class AsyncThreadExecutor(AsyncExecutor):
+    """
+    Adapter running the blocking exec of an executor, such as SSHExecutor, in a thread. The executor only uses the
+    thread-safe methods of the event bus.
+    """
+    def __init__(self, executor: Executor, threads=None):
+        super().__init__(executor)
+        self.threads = threads
+
+    async def exec(self, cmd, bin_paths=None, queue=None, options=None, stdin=None, timeout=None, sudo=False,
+                   testdir=None, event=None, title=None, env={}, virt="", on_output=None):
+        return await asyncio.get_event_loop().run_in_executor(self.threads, functools.partial(
+            self.executor.exec, cmd=cmd, bin_paths=bin_paths, queue=queue, options=options, stdin=stdin,
+            timeout=timeout, sudo=sudo, testdir=testdir, event=event, title=title, env=env, virt=virt, on_output=on_output))
@@ -18,6 +18,31 @@ class Executor:
         for result in results:
             eb.post(result.group(1))
 
+    def output_lines(self, lines, title, options, event, on_output, output):
+        """
+        Handle some lines of stdout of a script as soon as they are read : post their events, print them with
+        --show-full, and give them to on_output or keep them in output
+        """
+        if event:
+            self.searchEvent(lines, event)
+        if options and options.show_full:
+            for line in lines.splitlines():
+                self._print(title, line, True)
+        if on_output:
+            on_output(lines)
+        else:
+            output.append(lines)
+
+    def writeFiles(self, files, path_to_root):
+        """
+        Create the files, a list of (filename, content), in the folder path_to_root of the node
+        :return: True if all the files were created
+        """
+        for filename, content in files:
+            if not self.writeFile(filename, path_to_root, content):
+                return False
+        return True
+
     def _print(self, title, line, nl = True):
         try:
             print(self.color + title + Style.RESET_ALL + ' ' + line, end=None if nl else '')
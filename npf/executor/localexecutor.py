@@ -1,11 +1,16 @@
 import os
 import pwd
 import signal
+import threading
+import time
 from multiprocessing import Queue, Event
 from subprocess import PIPE, Popen, TimeoutExpired
 from typing import List
 from .executor import Executor
 
+# Bytes read from the output of a script at once
+READ_SIZE = 65536
+
 class LocalKiller:
     def __init__(self, pgpid):
         self.pgpid = pgpid
@@ -25,16 +30,35 @@ class LocalKiller:
             return False
         return True
 
+def read_lines(read):
+    """
+    Iterate over the complete lines given by successive calls to read, a few lines at a time
+    """
+    pending = b''
+    while True:
+        data = read()
+        if not data:
+            break
+        data = pending + data
+        i = data.rfind(b'\n') + 1
+        pending = data[i:]
+        if i:
+            yield data[:i].decode()
+    if pending:
+        yield pending.decode()
+
+
 class LocalExecutor(Executor):
     def __init__(self):
         super().__init__()
 
-    def exec(self, cmd, bin_paths : List[str]=[], queue: Queue = None, options = None, stdin = None, timeout = None, sudo = False, testdir=None, event=None, title=None, env = {}, virt="" ):
-        if testdir is not None:
-            os.chdir("..")
-        if not title:
-            title = "local"
-        cwd = os.getcwd()
+    def command(self, cmd, bin_paths, options, sudo, env, virt, cwd=None):
+        """
+        The shell command running cmd and its environment, the bin paths being relative to cwd, the current folder by
+        default
+        """
+        if cwd is None:
+            cwd = os.getcwd()
         env = env.copy()
         env.update(os.environ)
         if bin_paths:
@@ -50,7 +74,19 @@ class LocalExecutor(Executor):
             cmd = "sudo -E " + virt + "  bash -c '"+ cmd.replace("'", "'\"'\"'") + "'";
         else:
             cmd = virt + " bash -c '"+ cmd.replace("'", "'\"'\"'") + "'";
+        return cmd, env
 
+    def exec(self, cmd, bin_paths : List[str]=[], queue: Queue = None, options = None, stdin = None, timeout = None, sudo = False, testdir=None, event=None, title=None, env = {}, virt="", on_output=None):
+        """
+        Run a script, its output being read while it runs so events are posted as soon as they are printed.
+        If on_output is given, it is called with the lines of stdout as they are read, a few complete lines at a time,
+        instead of keeping them, the returned stdout being empty.
+        """
+        if testdir is not None:
+            os.chdir("..")
+        if not title:
+            title = "local"
+        cmd, env = self.command(cmd, bin_paths, options, sudo, env, virt)
 
         p = Popen(cmd,
                   stdin=PIPE, stdout=PIPE, stderr=PIPE,
@@ -62,40 +98,70 @@ class LocalExecutor(Executor):
         killer = LocalKiller(pgpid)
         if queue:
             queue.put(killer)
+
+        output = []
+        err = []
+
+        def read_stdout():
+            for lines in read_lines(lambda: p.stdout.read1(READ_SIZE)):
+                self.output_lines(lines, title, options, event, on_output, output)
+
+        def read_stderr():
+            err.append(p.stderr.read())
+
+        readers = [threading.Thread(target=read_stdout), threading.Thread(target=read_stderr)]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+        deadline = time.time() + timeout if timeout is not None else None
+
+        def remaining():
+            return None if deadline is None else max(0, deadline - time.time())
+
         try:
-            s_output, s_err = [x.decode() for x in
-                               p.communicate(input = stdin,  timeout=timeout)]
-            self.searchEvent(s_output, event)
-            if options and options.show_full:
-                for line in s_output.splitlines():
-                    self._print(title, line, True)
+            if stdin:
+                try:
+                    p.stdin.write(stdin.encode() if type(stdin) is str else stdin)
+                except BrokenPipeError:
+                    pass
             p.stdin.close()
+            #Like communicate, wait for the output to be closed, even by processes left in background
+            for reader in readers:
+                reader.join(remaining())
+                if reader.is_alive():
+                    raise TimeoutExpired(cmd, timeout)
+            p.wait(remaining())
             p.stderr.close()
             p.stdout.close()
             if testdir is not None:
                 os.chdir(testdir)
-            return pid, s_output, s_err, 0 if event and event.is_terminated() else p.returncode
+            return pid, ''.join(output), b''.join(err).decode(), 0 if event and event.is_terminated() else p.returncode
         except TimeoutExpired:
             print("Test expired")
             p.terminate()
             p.kill()
             os.killpg(pgpid, signal.SIGKILL)
             os.killpg(pgpid, signal.SIGTERM)
-            s_output, s_err = [x.decode() for x in p.communicate()]
-            p.stdin.close()
+            for reader in readers:
+                reader.join()
+            p.wait()
             p.stderr.close()
             p.stdout.close()
             if testdir is not None:
                 os.chdir(testdir)
-            return 0, s_output, s_err, p.returncode
+            return 0, ''.join(output), b''.join(err).decode(), p.returncode
         except KeyboardInterrupt:
             os.killpg(pgpid, signal.SIGKILL)
             if testdir is not None:
                 os.chdir(testdir)
-            return -1, s_output, s_err, p.returncode
+            return -1, ''.join(output), b''.join(err).decode(), p.returncode
 
     def writeFile(self,filename,path_to_root,content):
         f = open(filename, "w")
         f.write(content)
         f.close()
         return True
+
+    def writeFiles(self, files, path_to_root):
+        #The testie already wrote them in the current folder
+        return True
@@ -1,13 +1,20 @@
+import hashlib
+import io
+import json
 import multiprocessing
 import os,errno
+import tarfile
 import time
 from multiprocessing import Queue
+from collections import OrderedDict
 from typing import List
 import paramiko
 from .executor import Executor
+from .sshpool import ssh_pool
+from .sshreader import channel_reader
+from . import sync
 from ..eventbus import EventBus
 from .. import npf
-from paramiko.buffered_pipe import PipeTimeout
 import socket
 import stat
 
@@ -19,45 +26,62 @@ class SSHExecutor(Executor):
         self.addr = addr
         self.path = path
         self.port = port
-        self.ssh = False
+        #Digest of the content of the files sent to the node, by remote path
+        self.sent_files = {}
         #Executor should not make any connection in init as parameters can be overwritten afterward
 
-    def __del__(self):
-        if self.ssh:
-            self.ssh.close()
-
-    def get_connection(self, cache=True):
-        import paramiko
-        if cache and self.ssh:
-            return self.ssh
+    def connect(self):
         ssh = paramiko.SSHClient()
         ssh.load_system_host_keys()
         ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         ssh.connect(self.addr, username=self.user, port=self.port)
-        if cache:
-            self.ssh = ssh
         return ssh
 
+    def get_connection(self, cache=True):
+        """
+        The connection to the node, shared by all the commands through the connection pool unless cache is False
+        """
+        if not cache:
+            return self.connect()
+        return ssh_pool.get((self.user, self.addr, self.port), self.connect)
+
+    def open_session(self, cmd, timeout=None, get_pty=False):
+        """
+        Run cmd in a new channel of the pooled connection, trying once more, on a new connection if it was lost
+        """
+        ssh = self.get_connection()
+        try:
+            return ssh, ssh.exec_command(cmd, timeout=timeout, get_pty=get_pty)
+        except (paramiko.ssh_exception.SSHException, EOFError, OSError):
+            #Other commands may be using a connection that is still alive
+            if not ssh_pool.is_alive(ssh):
+                ssh_pool.invalidate(ssh)
+                ssh = self.get_connection()
+            return ssh, ssh.exec_command(cmd, timeout=timeout, get_pty=get_pty)
+
+
+    def npf_env(self, env):
+        """
+        Add the paths of NPF on the node to env
+        """
+        if self.path:
+            env['NPF_ROOT'] = self.path
+            env['NPF_CWD_PATH'] = os.path.relpath(npf.cwd_path(),self.path)
+            env['NPF_EXPERIMENT_PATH'] = '../' + os.path.relpath(npf.experiment_path(), self.path)
+            env['NPF_ROOT_PATH'] = '../' + os.path.relpath(npf.npf_root_path(), self.path)
+        return env
 
-    def exec(self, cmd, bin_paths : List[str] = None, queue: Queue = None, options = None, stdin = None, timeout=None, sudo=False, testdir=None, event=None, title=None, env={}, virt = "", raw = False):
-        if not title:
-            title = self.addr
-        else:
-            title = self.addr + ' - ' + title
-        if not event:
-            event = EventBus()
+    def command(self, cmd, bin_paths, options, sudo, testdir, env, virt, raw=False, stdin=None):
+        """
+        The shell command running cmd on the node, from the NPF path, with the environment and the bin paths
+        """
         path_list = [p if os.path.isabs(p) else self.path+'/'+p for p in (bin_paths if bin_paths is not None else [])]
         if options and options.show_cmd:
             print("Executing on %s%s (PATH+=%s) :\n%s" % (self.addr,(' with sudo' if sudo and self.user != "root" else ''),':'.join(path_list) + (("NS:"  + virt) if virt else ""), cmd.strip()))
 
         pre = 'cd '+ self.path + ';'
 
-        if self.path:
-            env['NPF_ROOT'] = self.path
-            env['NPF_CWD_PATH'] = os.path.relpath(npf.cwd_path(),self.path)
-            env['NPF_EXPERIMENT_PATH'] = '../' + os.path.relpath(npf.experiment_path(), self.path)
-            env['NPF_ROOT_PATH'] = '../' + os.path.relpath(npf.npf_root_path(), self.path)
-
+        self.npf_env(env)
         for k,v in env.items():
             if v is not None:
                 pre += 'export ' + k + '='+v+'\n'
@@ -78,92 +102,80 @@ class SSHExecutor(Executor):
         else:
             cmd = virt +" "+unbuffer+" bash -c '"+path_cmd + cmd.replace("'", "'\"'\"'") + "'";
             #pre = path_cmd + pre
+        return pre + cmd
+
+    @staticmethod
+    def _abort(ssh, channel):
+        """
+        Close the channel of a command that failed, the connection is only closed if it is dead as other commands of
+        the node share it
+        """
+        if channel is not None:
+            channel.close()
+        if ssh is not None and not ssh_pool.is_alive(ssh):
+            ssh_pool.invalidate(ssh)
+
+    def exec(self, cmd, bin_paths : List[str] = None, queue: Queue = None, options = None, stdin = None, timeout=None, sudo=False, testdir=None, event=None, title=None, env={}, virt = "", raw = False, on_output=None):
+        if not title:
+            title = self.addr
+        else:
+            title = self.addr + ' - ' + title
+        if not event:
+            event = EventBus()
+        cmd = self.command(cmd, bin_paths, options, sudo, testdir, env, virt, raw, stdin)
 
         ssh = None
+        channel = None
         try:
-            ssh = self.get_connection(cache=False)
-
-            ssh_stdin, ssh_stdout, ssh_stderr = ssh.exec_command("echo $$;"+ pre + cmd,timeout=timeout, get_pty=True)
-            rpid = int(ssh_stdout.readline())
+            ssh, (ssh_stdin, ssh_stdout, ssh_stderr) = self.open_session("echo $$;" + cmd, timeout=timeout, get_pty=True)
+            channel = ssh_stdout.channel
+            output = []
+            #The output is read by the reader thread as soon as it arrives, so events are posted without delay
+            watch = channel_reader.watch(channel,
+                                         lambda lines: self.output_lines(lines, title, options, event, on_output, output),
+                                         on_done=event.wake, pid_line=True)
             if stdin is not None:
                 ssh_stdin.write(stdin)
-            channels = [ssh_stdout, ssh_stderr]
-            output = ['','']
 
             pid = os.getpid()
-            step = 0.2
-            for channel in channels:
-                channel.channel.setblocking(False)
-
-            while not event.is_terminated() and not ssh_stdout.channel.exit_status_ready():
-                try:
-                    line = None
-                    while ssh_stdout.channel.recv_ready() or ssh_stderr.channel.recv_ready():
-                        for ichannel,channel in enumerate(channels[:1]):
-                            if channel.channel.recv_ready():
-                                try:
-                                    line = channel.readline()
-                                    if options and options.show_full:
-                                        self._print(title, line, False)
-                                    self.searchEvent(line, event)
-                                    output[ichannel] += line
-                                except UnicodeDecodeError:
-                                    print("Could not decode SSH input")
-                    else:
-                        event.wait_for_termination(step)
-                        if timeout is not None:
-                            timeout -= step
-                except PipeTimeout:
-                    pass
-                except socket.timeout:
-                    self._print(title, "Interrupted by timeout", True)
-                    event.wait_for_termination(step)
-                    if timeout is not None:
-                        timeout -= step
-                except KeyboardInterrupt:
-                    event.terminate()
-                    ssh.close()
-                    return -1, out, err
-                if timeout is not None:
-                    if timeout < 0:
+            deadline = time.time() + timeout if timeout is not None else None
+            try:
+                while not watch.done.is_set() and not event.is_terminated():
+                    remaining = deadline - time.time() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
                         event.terminate()
                         pid = 0
                         break
-            if event.is_terminated():
-                if not ssh_stdin.channel.closed:
-                    ssh_stdin.channel.send(chr(3))
-                    ssh.exec_command("kill "+str(rpid))
-#                   unneeded ssh.exec_command("kill $(ps -s  "+str(rpid)+" -o pid=)" )
-                    i=0
-                    ssh_stdout.channel.status_event.wait(timeout=1)
-
+                    event.wait_until(watch.done.is_set, remaining)
+            except KeyboardInterrupt:
+                event.terminate()
+                channel.close()
+                return -1, ''.join(output), watch.error(), -1
+
+            if not watch.done.is_set():
+                if not channel.closed:
+                    channel.send(chr(3))
+                    if watch.pid:
+                        ssh.exec_command("kill "+str(watch.pid))
+                    channel.status_event.wait(timeout=1)
+                watch.done.wait(timeout=1)
                 ret = 0 #Ignore return code because we kill it before completion.
-                ssh.close()
-                ssh=None
             else:
-                ret = ssh_stdout.channel.recv_exit_status()
-                ssh.close()
-                ssh=None
-
-            for ichannel,channel in enumerate(channels):
-                for line in channel.readlines():
-                    if options and options.show_full:
-                        self._print(title, line, False)
-                    self.searchEvent(line, event)
-                    output[ichannel] += line
-
-            return pid,output[0], output[1],ret
+                ret = channel.recv_exit_status()
+                if event.is_terminated():
+                    ret = 0
+            channel.close()
+
+            return pid, ''.join(output), watch.error(), ret
         except socket.gaierror as e:
             print("Error while connecting to %s" % self.addr)
             print(e)
-            if ssh:
-                ssh.close()
+            self._abort(ssh, channel)
             return 0,'','',-1
         except paramiko.ssh_exception.SSHException as e:
             print("Error while connecting to %s" % self.addr)
             print(e)
-            if ssh:
-                    ssh.close()
+            self._abort(ssh, channel)
             return 0,'','',-1
 
     def writeFile(self,filename,path_to_root,content):
@@ -172,144 +184,139 @@ class SSHExecutor(Executor):
         f.close()
 
         try:
-            with paramiko.SSHClient() as ssh:
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh.load_system_host_keys()
-                try:
-                    ssh = self.get_connection()
-                except Exception as e:
-                    print("Cannot connect to %s with username %s" % (self.addr,self.user))
-                    raise e
-
-                transport = ssh.get_transport()
-                with transport.open_channel(kind='session') as channel:
-                    channel.exec_command('mkdir -p %s/%s' % (self.path, path_to_root))
-                    if channel.recv_exit_status() != 0:
-                        return False
-                with transport.open_channel(kind='session') as channel:
-                    channel.exec_command('cat > %s/%s/%s' % (self.path,path_to_root,filename))
-                    channel.sendall(content)
-                    channel.shutdown_write()
-                    return channel.recv_exit_status() == 0
+            try:
+                ssh = self.get_connection()
+            except Exception as e:
+                print("Cannot connect to %s with username %s" % (self.addr,self.user))
+                raise e
+
+            transport = ssh.get_transport()
+            with transport.open_channel(kind='session') as channel:
+                channel.exec_command('mkdir -p %s/%s' % (self.path, path_to_root))
+                if channel.recv_exit_status() != 0:
+                    return False
+            with transport.open_channel(kind='session') as channel:
+                channel.exec_command('cat > %s/%s/%s' % (self.path,path_to_root,filename))
+                channel.sendall(content)
+                channel.shutdown_write()
+                return channel.recv_exit_status() == 0
         except paramiko.ssh_exception.SSHException as e:
             print("Error while connecting to %s" % self.addr)
             raise e
 
-    def sendFolder(self, path, local=None):
-        sftp = None
-        try:
-            with paramiko.SSHClient() as ssh:
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh.load_system_host_keys()
-                try:
-                    ssh = self.get_connection()
-                except Exception as e:
-                    print("Cannot connect to %s with username %s" % (self.addr,self.user))
-                    raise e
-
-                transport = ssh.get_transport()
-
-                sftp = paramiko.SFTPClient.from_transport(transport)
-
-                ignored = ['.git', '.vimhistory']
-                def _send(path):
-                    total = 0
-                    try:
-                        rlist = sftp.listdir(self.path + path)
-                        lpath = lpath if not local else local + os.sep + path
-                        for entry in os.scandir(lpath):
-                            if entry.is_file():
-                                remote = self.path + path + '/' + entry.name
-                                if not entry.name in rlist or entry.stat().st_size != sftp.stat(remote).st_size:
-                                    try:
-                                        es = entry.stat()
-                                        sftp.put(lpath + '/' + entry.name, remote)
-                                        sftp.chmod(remote, es.st_mode)
-                                        total += es.st_size
-                                    except FileNotFoundError:
-                                        sftp.close()
-                                        raise(Exception("Could not send %s to %s"  % (path + '/' + entry.name, remote)))
-                            else:
-                                if entry.name in ignored:
-                                    continue
-                                if entry.name not in rlist:
-                                    sftp.mkdir(self.path + path + '/' + entry.name, mode=0o777 )
-                                    total += _send(path +'/'+entry.name + '/')
-                        return total
-                    except FileNotFoundError:
-                        sftp.close()
-                        raise FileNotFoundError("No such file : %s" % (self.path + os.sep + path))
-                curpath = ''
-                total = 0
-                for d in path.split('/'):
-                    curpath = curpath + d + '/'
-                    lcurpath = curpath if not local else local + os.sep + curpath
-                    if not os.path.isdir(lcurpath):
-                        remote = self.path + path
-                        try:
-                            sftp.stat(remote)
-                        except IOError as e:
-                            if e.errno is errno.ENOENT:
-                                lpath = path if not local else local + os.sep + path
-                                es = os.stat(lpath)
-                                sftp.put(lpath, remote)
-                                sftp.chmod(remote, es.st_mode)
-                                total += es.st_size
-                        finally:
-                            sftp.close()
-                        return total
-                    try:
-                        f = self.path + '/' + curpath
-                        sftp.stat(f)
-                    except FileNotFoundError:
-                        try:
-                            sftp.mkdir(f,mode=0o777)
-                        except IOError as e:
-                            sftp.close()
-                            print("Could not make folder %s" % f)
-                            raise e
-                    except PermissionError as e:
-                        sftp.close()
-                        print("Could not make folder %s" % f)
-                        raise e
-
-
-                total += _send(path)
-
-                sftp.close()
-                return total
+    def writeFiles(self, files, path_to_root):
+        """
+        Send the files as a single tar stream over one channel, skipping those whose content did not change since they
+        were last sent. The local copies must already be written.
+        """
+        folder = '%s/%s' % (self.path, path_to_root)
+        changed = OrderedDict()
+        for filename, content in files:
+            data = content.encode()
+            digest = hashlib.sha1(data).digest()
+            remote = folder + '/' + filename
+            if self.sent_files.get(remote, None) != digest or remote in changed:
+                changed[remote] = (filename, data, digest)
+        if not changed:
+            return True
+
+        buffer = io.BytesIO()
+        now = time.time()
+        with tarfile.open(fileobj=buffer, mode='w') as tar:
+            for filename, data, digest in changed.values():
+                info = tarfile.TarInfo(filename)
+                info.size = len(data)
+                info.mode = 0o644
+                info.mtime = now
+                tar.addfile(info, io.BytesIO(data))
 
+        try:
+            try:
+                ssh = self.get_connection()
+            except Exception as e:
+                print("Cannot connect to %s with username %s" % (self.addr,self.user))
+                raise e
+
+            with ssh.get_transport().open_channel(kind='session') as channel:
+                channel.exec_command('mkdir -p %s && tar -x -m -f - -C %s' % (folder, folder))
+                channel.sendall(buffer.getvalue())
+                channel.shutdown_write()
+                if channel.recv_exit_status() != 0:
+                    for remote in changed.keys():
+                        self.sent_files.pop(remote, None)
+                    return False
+            for remote, (filename, data, digest) in changed.items():
+                self.sent_files[remote] = digest
+            return True
         except paramiko.ssh_exception.SSHException as e:
             print("Error while connecting to %s" % self.addr)
-            if sftp:
-                sftp.close()
             raise e
 
+    def sendFolder(self, path, local=None):
+        """
+        Synchronize the file or folder path, relative to local if given, to the same path on the node. A manifest of
+        the digests of the files is kept on the node, only the files that changed since are sent, as a single
+        compressed tar stream.
+        :return: The number of bytes of the files sent
+        """
+        path = os.path.normpath(path).replace(os.sep, '/')
+        lpath = path if not local else local + os.sep + path
+        try:
+            ssh = self.get_connection()
+        except Exception as e:
+            print("Cannot connect to %s with username %s" % (self.addr,self.user))
+            raise e
 
-    def deleteFolder(self, path):
         try:
-            with paramiko.SSHClient() as ssh:
-                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-                ssh.load_system_host_keys()
+            manifest = sync.local_manifest(lpath, path)
+            transport = ssh.get_transport()
+            #The manifest is ignored if the folder was deleted since
+            with transport.open_channel(kind='session') as channel:
+                channel.exec_command("test -e '%s/%s' && cat '%s/%s/%s'" % (self.path, path, self.path, sync.MANIFEST_FOLDER, sync.manifest_name(path)))
+                stdout = channel.makefile('rb').read()
                 try:
-                    ssh = self.get_connection()
-                except Exception as e:
-                    print("Cannot connect to %s with username %s" % (self.addr,self.user))
-                    raise e
-
-                transport = ssh.get_transport()
+                    remote = json.loads(stdout.decode()) if channel.recv_exit_status() == 0 else {}
+                except ValueError:
+                    remote = {}
+            entries = sync.changed(manifest, remote)
+            if not entries:
+                return 0
+
+            with transport.open_channel(kind='session') as channel:
+                channel.exec_command("mkdir -p '%s' && tar -xz --no-same-owner -f - -C '%s'" % (self.path, self.path))
+                stdin = channel.makefile('wb')
+                total = sync.write_tar(stdin, lpath, path, entries, manifest)
+                stdin.flush()
+                channel.shutdown_write()
+                if channel.recv_exit_status() != 0:
+                    raise Exception("Could not send %s to %s : %s" % (path, self.addr, channel.makefile_stderr('rb').read().decode().strip()))
+            return total
+        except paramiko.ssh_exception.SSHException as e:
+            print("Error while connecting to %s" % self.addr)
+            raise e
 
-                sftp = paramiko.SFTPClient.from_transport(transport)
 
-                fileattr = sftp.lstat(self.path + path)
-                try:
-                    if stat.S_ISDIR(fileattr.st_mode):
-                        sftp.rmdir(self.path + path)
-                    else:
-                        sftp.remove(self.path + path)
-                except FileNotFoundError:
-                    raise FileNotFoundError("Could not find %s, unable to delete it..." % (self.path + path))
-                sftp.close()
+    def deleteFolder(self, path):
+        try:
+            try:
+                ssh = self.get_connection()
+            except Exception as e:
+                print("Cannot connect to %s with username %s" % (self.addr,self.user))
+                raise e
+
+            transport = ssh.get_transport()
+
+            sftp = paramiko.SFTPClient.from_transport(transport)
+
+            fileattr = sftp.lstat(self.path + path)
+            try:
+                if stat.S_ISDIR(fileattr.st_mode):
+                    sftp.rmdir(self.path + path)
+                else:
+                    sftp.remove(self.path + path)
+            except FileNotFoundError:
+                raise FileNotFoundError("Could not find %s, unable to delete it..." % (self.path + path))
+            sftp.close()
 
         except paramiko.ssh_exception.SSHException as e:
             print("Error while connecting to %s" % self.addr)
@@ -0,0 +1,83 @@
+import atexit
+import os
+import threading
+
+# Seconds between keepalive messages on idle connections, so dead peers and NAT timeouts are detected
+KEEPALIVE = 30
+
+
+class SSHConnectionPool:
+    """
+    One SSH connection per node, kept for all the commands of the process : each command opens its own session channel
+    on the shared transport instead of doing a TCP connection and a key exchange.
+    A connection is checked before being reused and re-opened if its transport died. The connections of a parent
+    process are never used nor closed by its forked children, as they share the sockets.
+    """
+    def __init__(self, keepalive=KEEPALIVE):
+        self.keepalive = keepalive
+        self.connections = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self._inherited = []
+        self.opened = 0
+        self.reused = 0
+
+    def _fork_check(self):
+        if self.pid != os.getpid():
+            #Closing would send a disconnect on the socket of the parent, so they are only forgotten
+            self._inherited.extend(self.connections.values())
+            self.connections = {}
+            self.locks = {}
+            self.pid = os.getpid()
+
+    @staticmethod
+    def is_alive(ssh):
+        transport = ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+    def get(self, key, connect):
+        """
+        The connection for key, such as (user, address, port), calling connect() to open it if needed
+        """
+        with self.lock:
+            self._fork_check()
+            lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            ssh = self.connections.get(key, None)
+            if ssh is not None:
+                if self.is_alive(ssh):
+                    self.reused += 1
+                    return ssh
+                ssh.close()
+            ssh = connect()
+            transport = ssh.get_transport()
+            if transport is not None and self.keepalive:
+                transport.set_keepalive(self.keepalive)
+            self.opened += 1
+            with self.lock:
+                self.connections[key] = ssh
+            return ssh
+
+    def invalidate(self, ssh):
+        """
+        Close a connection that failed, the next get will open a new one
+        """
+        with self.lock:
+            self._fork_check()
+            for key, c in list(self.connections.items()):
+                if c is ssh:
+                    del self.connections[key]
+        ssh.close()
+
+    def close(self):
+        with self.lock:
+            self._fork_check()
+            connections = list(self.connections.values())
+            self.connections = {}
+        for ssh in connections:
+            ssh.close()
+
+
+ssh_pool = SSHConnectionPool()
+atexit.register(ssh_pool.close)
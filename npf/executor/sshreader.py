@@ -0,0 +1,133 @@
+import os
+import selectors
+import threading
+import traceback
+
+# Bytes read from a channel at once
+READ_SIZE = 65536
+
+
+class ChannelWatch:
+    """
+    Output of a remote command being read by the ChannelReader. Complete lines of stdout are given to on_stdout as soon
+    as they are received, while stderr is kept. The first line may be the pid of the remote shell, as printed by
+    "echo $$".
+    """
+    def __init__(self, channel, on_stdout, on_done=None, pid_line=False):
+        self.channel = channel
+        self.on_stdout = on_stdout
+        self.on_done = on_done
+        self.pid_line = pid_line
+        self.pid = None
+        self.stderr = []
+        self.pending = b''
+        self.done = threading.Event()
+
+    def _lines(self, data):
+        if self.pid_line and self.pid is None:
+            first, _, data = data.partition(b'\n')
+            try:
+                self.pid = int(first)
+            except ValueError:
+                self.pid = -1
+            if not data:
+                return
+        try:
+            lines = data.decode()
+        except UnicodeDecodeError:
+            print("Could not decode SSH input")
+            return
+        try:
+            self.on_stdout(lines)
+        except Exception:
+            traceback.print_exc()
+
+    def read(self):
+        """
+        Read what the channel received
+        :return: True when the channel reached the end of its output
+        """
+        channel = self.channel
+        chunks = []
+        while channel.recv_ready():
+            chunks.append(channel.recv(READ_SIZE))
+        if chunks:
+            data = self.pending + b''.join(chunks)
+            i = data.rfind(b'\n') + 1
+            self.pending = data[i:]
+            if i:
+                self._lines(data[:i])
+        while channel.recv_stderr_ready():
+            self.stderr.append(channel.recv_stderr(READ_SIZE))
+        return (channel.eof_received or channel.closed) and not channel.recv_ready() and not channel.recv_stderr_ready()
+
+    def finish(self):
+        if self.pending:
+            self._lines(self.pending)
+            self.pending = b''
+        self.done.set()
+        if self.on_done:
+            self.on_done()
+
+    def error(self):
+        return b''.join(self.stderr).decode(errors='replace')
+
+
+class ChannelReader:
+    """
+    A single thread reading the output of all the remote commands of the process, waiting on the file descriptors of
+    their channels with a selector instead of polling them, so lines are dispatched as soon as they arrive.
+    Channels are registered through a queue and a wake-up pipe, as only the reader thread touches the selector. It is
+    re-created in forked processes.
+    """
+    def __init__(self):
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        self.selector = selectors.DefaultSelector()
+        self.requests = []
+        self.wake_r, self.wake_w = os.pipe()
+        self.selector.register(self.wake_r, selectors.EVENT_READ, None)
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.pid = os.getpid()
+
+    def watch(self, channel, on_stdout, on_done=None, pid_line=False):
+        """
+        Start reading a channel
+        :return: The ChannelWatch, whose done event is set when the output ended
+        """
+        w = ChannelWatch(channel, on_stdout, on_done, pid_line)
+        fd = channel.fileno()
+        with self.lock:
+            if self.pid != os.getpid():
+                self._start()
+            self.requests.append((fd, w))
+        os.write(self.wake_w, b'w')
+        return w
+
+    def _run(self):
+        while True:
+            for key, mask in self.selector.select():
+                w = key.data
+                if w is None:
+                    os.read(self.wake_r, READ_SIZE)
+                    with self.lock:
+                        requests = self.requests
+                        self.requests = []
+                    for fd, w in requests:
+                        self.selector.register(fd, selectors.EVENT_READ, w)
+                    continue
+                try:
+                    finished = w.read()
+                except Exception:
+                    traceback.print_exc()
+                    finished = True
+                if finished:
+                    self.selector.unregister(key.fileobj)
+                    w.finish()
+
+
+channel_reader = ChannelReader()
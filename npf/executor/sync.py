@@ -0,0 +1,94 @@
+import hashlib
+import io
+import json
+import os
+import tarfile
+import threading
+from collections import OrderedDict
+
+# Folder, relative to the NPF path of a node, where the manifest of each synchronized folder is kept
+MANIFEST_FOLDER = '.npf-manifest'
+IGNORED = ['.git', '.vimhistory']
+HASH_BLOCK = 1 << 20
+
+#Digest of the local files by path, kept while their size and modification time do not change
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path, st):
+    key = (st.st_size, st.st_mtime_ns)
+    with _digests_lock:
+        cached = _digests.get(path, None)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            h.update(block)
+    digest = h.hexdigest()
+    with _digests_lock:
+        _digests[path] = (key, digest)
+    return digest
+
+
+def manifest_name(path):
+    return hashlib.sha1(path.encode()).hexdigest()[:16]
+
+
+def local_manifest(lpath, path):
+    """
+    State of a local file or folder lpath, to be found at path on the nodes, as an OrderedDict of remote path ->
+    digest, or None for folders
+    """
+    manifest = OrderedDict()
+    if not os.path.isdir(lpath):
+        if not os.path.exists(lpath):
+            raise FileNotFoundError("No such file : %s" % lpath)
+        manifest[path] = file_digest(lpath, os.stat(lpath))
+        return manifest
+    for root, dirs, files in os.walk(lpath, followlinks=True):
+        dirs[:] = sorted([d for d in dirs if d not in IGNORED])
+        rel = os.path.relpath(root, lpath)
+        rpath = path if rel == '.' else path + '/' + rel.replace(os.sep, '/')
+        manifest[rpath] = None
+        for name in sorted(files):
+            f = os.path.join(root, name)
+            try:
+                manifest[rpath + '/' + name] = file_digest(f, os.stat(f))
+            except FileNotFoundError:
+                #Dangling link
+                continue
+    return manifest
+
+
+def changed(local, remote):
+    """
+    Entries of the local manifest that differ from the manifest of the node
+    """
+    return [p for p, digest in local.items() if p not in remote or remote[p] != digest]
+
+
+def write_tar(out, lpath, path, entries, manifest):
+    """
+    Write a gzip-compressed tar stream of the entries of the local folder lpath to out, followed by the manifest, all
+    relative to the NPF path of the node
+    :return: The number of bytes of the files sent
+    """
+    total = 0
+    with tarfile.open(fileobj=out, mode='w|gz', dereference=True) as tar:
+        for rpath in entries:
+            local = lpath if rpath == path else os.path.join(lpath, os.path.relpath(rpath, path))
+            info = tar.gettarinfo(local, arcname=rpath)
+            if info.isdir():
+                tar.addfile(info)
+            else:
+                with open(local, 'rb') as f:
+                    tar.addfile(info, f)
+                total += info.size
+        data = json.dumps(manifest).encode()
+        info = tarfile.TarInfo(MANIFEST_FOLDER + '/' + manifest_name(path))
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return total
+
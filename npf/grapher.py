@@ -15,6 +15,7 @@ from pygtrie import Trie
 
 from npf.types import dataset
 from npf.types.dataset import Run, XYEB, AllXYEB, group_val
+from npf.types.resulttable import array_items
 from npf.variable import is_log, is_numeric, get_numeric, numericable, get_bool, is_bool
 from npf.section import SectionVariable
 from npf.build import Build
@@ -625,7 +626,7 @@ class Grapher:
         if graph_variables is None:
             graph_variables = OrderedSet()
             for serie in series:
-                for run, results in serie[2].items():
+                for run in serie[2]:
                     graph_variables.add(run)
 
         # Get all scripts, and execute pypost
@@ -702,7 +703,7 @@ class Grapher:
             newseries = []
             for i, (testie, build, all_results) in enumerate(series):
                 new_all_results = {}
-                for run, run_results in all_results.items():
+                for run, run_results in array_items(all_results):
                     newrun = run_map.get(run, None)
                     if newrun is not None:
                         new_all_results[newrun] = run_results
@@ -715,7 +716,7 @@ class Grapher:
         vars_values = OrderedDict()
         for i, (testie, build, all_results) in enumerate(series):
             new_results = OrderedDict()
-            for run, run_results in all_results.items():
+            for run, run_results in array_items(all_results):
                 if run in graph_variables:
                     for result_type, results in run_results.items():
                         if self.options.graph_reject_outliers:
@@ -0,0 +1,170 @@
+import atexit
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+# Messages waiting to be sent, the following ones are dropped
+DEFAULT_QUEUE_SIZE = 10000
+# Seconds a client may take to read a message before being disconnected
+SEND_TIMEOUT = 5
+
+
+def _default(o):
+    if isinstance(o, Decimal):
+        return float(o)
+    if hasattr(o, 'tolist'):
+        return o.tolist()
+    return str(o)
+
+
+def _variables(run):
+    variables = OrderedDict()
+    for k, v in run.variables.items():
+        variables[k] = v[1] if type(v) is tuple else v
+    return variables
+
+
+class LiveFeed:
+    """
+    Publishes the progress of the tests as JSON lines to the clients connected to a local socket, given by
+    --live-feed unix:path or tcp:[host:]port. Every message is an object with an "event" (run_start, result, samples
+    or run_end) and a "time".
+    The runner only puts the messages in a bounded queue, a thread encodes and sends them. Nothing is queued when no
+    client is connected, and the messages that do not fit in the queue are dropped and counted.
+    """
+    def __init__(self, address, queue_size=DEFAULT_QUEUE_SIZE):
+        self.address = address
+        self.path = None
+        self.server = self._listen(address)
+        self.queue = queue.Queue(queue_size)
+        self.clients = []
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.dropped = 0
+        self._threads = [threading.Thread(target=self._accept), threading.Thread(target=self._send)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _listen(self, address):
+        kind, _, where = address.partition(':')
+        if kind == 'unix' and where:
+            self.path = where
+            if os.path.exists(where):
+                os.unlink(where)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(where)
+        elif kind == 'tcp' and where:
+            host, _, port = where.rpartition(':')
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host if host else '127.0.0.1', int(port)))
+        else:
+            raise Exception("Invalid live feed address %s, expected unix:path or tcp:[host:]port" % address)
+        server.listen(8)
+        return server
+
+    def port(self):
+        return self.server.getsockname()[1] if self.path is None else None
+
+    def _accept(self):
+        while True:
+            try:
+                client, addr = self.server.accept()
+            except OSError:
+                return
+            client.settimeout(SEND_TIMEOUT)
+            with self.lock:
+                self.clients.append(client)
+
+    def _send(self):
+        while True:
+            message = self.queue.get()
+            if message is None:
+                return
+            data = (json.dumps(message, default=_default) + '\n').encode()
+            with self.lock:
+                clients = list(self.clients)
+            for client in clients:
+                try:
+                    client.sendall(data)
+                except OSError:
+                    with self.lock:
+                        self.clients.remove(client)
+                    client.close()
+            self.sent += 1
+
+    def publish(self, event, **fields):
+        """
+        Queue a message, never blocking. The fields must not be modified afterwards.
+        """
+        if not self.clients:
+            return
+        message = OrderedDict([('event', event), ('time', time.time())])
+        message.update(fields)
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def run_start(self, testie, build, run, n_runs):
+        self.publish('run_start', testie=testie.filename, build=build.pretty_name(), variables=_variables(run),
+                     n_runs=n_runs)
+
+    def result(self, testie, build, run, results):
+        """
+        Results of one execution of a run, as a dict of result type -> list of values
+        """
+        self.publish('result', testie=testie.filename, build=build.pretty_name(), variables=_variables(run),
+                     results=OrderedDict([(k, list(v)) for k, v in results.items()]))
+
+    def samples(self, testie, build, run, kind, samples):
+        """
+        Samples of one kind of one execution of a run, as a dict of kind value -> {result type -> list of values}
+        """
+        self.publish('samples', testie=testie.filename, build=build.pretty_name(), variables=_variables(run), kind=kind,
+                     samples=[[t, OrderedDict([(k, list(v)) for k, v in results.items()])] for t, results in sorted(samples.items())])
+
+    def run_end(self, testie, build, run, results):
+        self.publish('run_end', testie=testie.filename, build=build.pretty_name(), variables=_variables(run),
+                     results=OrderedDict([(k, list(v) if v is not None else None) for k, v in results.items()]),
+                     dropped=self.dropped)
+
+    def close(self, timeout=1):
+        """
+        Send the queued messages for at most timeout seconds, then disconnect the clients
+        """
+        try:
+            self.queue.put(None, timeout=timeout)
+            self._threads[1].join(timeout)
+        except queue.Full:
+            pass
+        self.server.close()
+        with self.lock:
+            for client in self.clients:
+                client.close()
+            self.clients = []
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+_feed = None
+
+
+def get(options):
+    """
+    The live feed given by --live-feed, opened the first time, or None
+    """
+    global _feed
+    address = getattr(options, 'live_feed', None) if options else None
+    if not address:
+        return None
+    if _feed is None:
+        _feed = LiveFeed(address)
+        atexit.register(_feed.close)
+    return _feed
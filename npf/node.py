@@ -7,6 +7,7 @@ import time
 
 from npf.executor.localexecutor import LocalExecutor
 from npf.executor.sshexecutor import SSHExecutor
+from npf.executor.agentexecutor import AgentExecutor
 from npf.variable import Variable,get_bool
 from npf.nic import NIC
 from npf.executor.executor import Executor
@@ -151,6 +152,7 @@ class Node:
             node = Node('localhost', LocalExecutor(), options.tags)
             cls._nodes['localhost'] = node
         node.ip = '127.0.0.1'
+        node.use_agent(options)
         if test_access:
             pid, out, err, ret = node.executor.exec(cmd="pwd && test -e "+node.experiment_path() + ".access_test")
             if ret != 0:
@@ -196,6 +198,14 @@ class Node:
                     raise Exception("Could not find the access test file at %s. Verify the path= paramater in the cluster file and that this directory alread exists. It must match --root-path on the remote equivalent when nfs is active. If the path is not shared accross clusters, ensure you set nfs=0 in the cluster file." % sshex.path)
                 if out.split("\n")[-1] != "test":
                     raise Exception("Could not communicate with user %s on node %s, unbuffer (expect package) could not be installed, or passwordless sudo is not working, got return code %d : %s" %  (sshex.user, sshex.addr, ret, out + err))
+        node.use_agent(options)
         if options.do_test:
             node._find_nics()
         return node
+
+    def use_agent(self, options):
+        """
+        Run the commands through an agent on the node with --agent
+        """
+        if getattr(options, 'use_agent', False) and not isinstance(self.executor, AgentExecutor):
+            self.executor = AgentExecutor(self.executor)
@@ -43,6 +43,12 @@ def add_verbosity_options(parser: ArgumentParser):
                    dest='print_time_results', action='store_true',
                    default=False)
 
+    v.add_argument('--show-cache-stats', help='Show the hit and miss statistics of the results cache when finishing',
+                   dest='show_cache_stats', action='store_true',
+                   default=False)
+    v.add_argument('--show-overhead', help='Show the time spent orchestrating each run, outside of the scripts',
+                   dest='show_overhead', action='store_true',
+                   default=False)
     v.add_argument('--quiet', help='Quiet mode', dest='quiet', action='store_true', default=False)
     v.add_argument('--quiet-regression', help='Do not tell about the regression process', dest='quiet_regression',
                     action='store_true', default=False)
@@ -138,6 +144,10 @@ def add_testing_options(parser: ArgumentParser, regression: bool = False):
                    nargs='?',
                    default=0)
     t.add_argument('--result-path', '--result-folder', metavar='path', type=str, nargs=1, help='Path to NPF\'s own database of results. By default it is a "result" folder.', default=["results"])
+    t.add_argument('--result-format', dest='result_format', choices=['text', 'npz', 'sqlite'], default='text',
+                   help='Format of the result files written in the result path. text is the historical one-line-per-run format, npz is a columnar binary format much faster to load for large sweeps, with time series kept as memory-mapped arrays. sqlite keeps all the results of the result path in a single database, that multiple NPF processes may write concurrently. Files in any format can be read, those in the other formats are left untouched. Use python -m npf.store to convert an existing result path.')
+    t.add_argument('--results-cache-size', metavar='MB', dest='results_cache_size', type=int, default=256,
+                   help='Memory budget of the cache of loaded results, shared by all builds. Least recently used results are evicted first.')
     t.add_argument('--tags', metavar='tag', type=str, nargs='+', help='list of tags', default=[], action=ExtendAction)
     t.add_argument('--variables', metavar='variable=value', type=str, nargs='+', action=ExtendAction,
                    help='list of variables values to override', default=[])
@@ -158,7 +168,19 @@ def add_testing_options(parser: ArgumentParser, regression: bool = False):
     t.add_argument('--no-mp', dest='allow_mp', action='store_false',
                    default=True, help='Run tests in the same thread. If there is multiple script, they will run '
                                       'one after the other, hence breaking most of the tests.')
-    t.add_argument('--expand', type=str, default=None, dest="expand")
+    t.add_argument('--async', dest='use_async', action='store_true',
+                   default=False, help='Run all the scripts of a test as coroutines of a single process instead of one '
+                                       'process per script, local scripts being asyncio subprocesses and remote ones '
+                                       'using a thread each. This lowers the start-up cost and memory of tests with '
+                                       'many scripts in parallel.')
+    t.add_argument('--agent', dest='use_agent', action='store_true',
+                   default=False, help='Run the commands through an NPF agent started once on each node, over SSH for '
+                                       'remote nodes, instead of an SSH session or a shell per command. Requires '
+                                       'python3 on the nodes.')
+    t.add_argument('--live-feed', metavar='unix:path|tcp:[host:]port', type=str, default=None, dest='live_feed',
+                   help='Publish the start and end of the runs and their results as they are parsed, as JSON lines '
+                        'to the clients connected to this socket. Messages are dropped when a client is too slow.')
+    t.add_argument('--expand', type=str, default=None, dest="expand", help='Order in which the variables are expanded : random to shuffle the combinations, or search to search for the value of a SEARCH(a,b,result=TYPE,target=0) variable in each combination of the others, which is done anyway when there is such variable. lhs:N[:seed] or sobol:N[:seed] test N points picked across all the range variables by a Latin hypercube or a Sobol sequence instead of all their combinations (needs scipy >= 1.7)')
     t.add_argument('--rand-env', type=int, default=65536, dest="rand_env")
     t.add_argument('--experimental-design', type=str, default="matrix.csv", help="The path towards the experimental design point selection file")
     return t
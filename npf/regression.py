@@ -4,6 +4,7 @@ from npf.grapher import *
 from npf.repository import *
 from npf.testie import Testie, SectionScript, ScriptInitException
 from npf.types.dataset import Dataset
+from npf.types.resulttable import ResultTableMapping
 
 
 class Regression:
@@ -42,7 +43,7 @@ class Regression:
         tests_total = 0
         supp_done = False
         r = False
-        tot_runs = testie.config["n_runs"] + testie.config["n_supplementary_runs"]
+        tot_runs = (int(testie.config["max_runs"]) if testie.config.adaptive_runs() else testie.config["n_runs"]) + testie.config["n_supplementary_runs"]
         for v in variable_list:
             tests_total += 1
             run = Run(v)
@@ -54,7 +55,9 @@ class Regression:
             need_supp = False
             for result_type, result in results_types.items():
                 if run in old_all_results and not old_all_results[run] is None:
-                    old_result = old_all_results[run].get(result_type, None)
+                    #Stored results are compared as arrays viewing the result file
+                    old_run_results = old_all_results.arrays(run) if isinstance(old_all_results, ResultTableMapping) else old_all_results[run]
+                    old_result = old_run_results.get(result_type, None)
                     if old_result is None:
                         continue
 
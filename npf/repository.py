@@ -380,13 +380,14 @@ class Repository:
         parents = self.method.gitrepo().iter_commits(last_graph.version)
         next(parents)  # The first commit is last_graph itself
 
+        builds = []
         for i, commit in enumerate(parents):  # Get old results for graph
-            g_build = Build(self, commit.hexsha[:7], self.options.result_path)
-            if not g_build.hasResults(testie):
-                continue
-            g_all_results = g_build.load_results(testie)
+            builds.append(Build(self, commit.hexsha[:7], self.options.result_path))
+            if i > 100:
+                break
+        for g_build, g_all_results in Build.load_builds(builds, testie):
             graphs_series.append((testie, g_build, g_all_results))
-            if (i > 100 or len(graphs_series) == num_old):
+            if len(graphs_series) == num_old:
                 break
         return graphs_series
 
@@ -0,0 +1,116 @@
+import re
+import time
+from array import array
+from collections import deque
+
+from npf.variable import unit_value
+
+# Lines of the output of a script kept by a parser to show when the script fails
+DEFAULT_TAIL = 1000
+# Minimal number of seconds between two forwards of the matches found while a script runs
+FORWARD_INTERVAL = 1
+
+
+class ResultMatches:
+    """
+    Results found in an output, in the order they were printed, as a list of (result type, kind, kind value, value).
+    They are stored as two arrays, the index of the (result type, kind, kind value) and the value, so they stay small
+    when a script prints many results and are quick to send back from a worker process.
+    """
+    def __init__(self):
+        self.keys = []
+        self._key_ids = {}
+        self.ids = array('i')
+        self.values = array('d')
+
+    def append(self, result_type, kind, kind_value, value):
+        key = (result_type, kind, kind_value)
+        i = self._key_ids.get(key, None)
+        if i is None:
+            i = len(self.keys)
+            self.keys.append(key)
+            self._key_ids[key] = i
+        self.ids.append(i)
+        self.values.append(value)
+
+    def since(self, n):
+        """
+        The matches after the n first ones
+        """
+        m = ResultMatches()
+        for i, value in zip(self.ids[n:], self.values[n:]):
+            m.append(*(self.keys[i] + (value,)))
+        return m
+
+    def extend(self, other):
+        for (result_type, kind, kind_value), value in zip([other.keys[i] for i in other.ids], other.values):
+            self.append(result_type, kind, kind_value, value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        for i, value in zip(self.ids, self.values):
+            result_type, kind, kind_value = self.keys[i]
+            yield result_type, kind, kind_value, value
+
+
+class ResultParser:
+    """
+    Finds the results printed by a script in its output, either as a whole with parse, or while the script is running
+    by feeding it the lines of its output as they are read, so the output does not have to be kept : only the last
+    lines are, to be shown if the script fails.
+    If forward is given, it is called with the new matches while the script runs, at most every interval seconds.
+    """
+    def __init__(self, regex_list, tail=DEFAULT_TAIL, forward=None, interval=FORWARD_INTERVAL):
+        self.regex_list = [re.compile(regex, re.IGNORECASE) for regex in regex_list]
+        self.matches = ResultMatches()
+        self.tail = deque(maxlen=tail)
+        self.n_lines = 0
+        self.forward = forward
+        self.interval = interval
+        self.n_forwarded = 0
+        self.forwarded_at = time.time()
+
+    def _add(self, nr):
+        result_type, kind, kind_value, value, multiplier, unit = nr.group("type", "kind", "kind_value", "value", "multiplier", "unit")
+        self.matches.append(result_type if result_type is not None else '', kind if kind is not None else "time",
+                            kind_value, unit_value(float(value), multiplier, unit))
+
+    def parse(self, output):
+        """
+        Parse a whole output, all the matches of the first regex coming before those of the second one
+        """
+        for regex in self.regex_list:
+            for nr in regex.finditer(output.strip()):
+                self._add(nr)
+        return self
+
+    def feed(self, lines):
+        """
+        Parse some complete lines of output, as given by the on_output callback of the executors. With multiple
+        regex, the matches are kept in the order of the output.
+        """
+        split = lines.splitlines(True)
+        self.n_lines += len(split)
+        self.tail.extend(split)
+        if len(self.regex_list) == 1:
+            for nr in self.regex_list[0].finditer(lines):
+                self._add(nr)
+        else:
+            found = []
+            for i, regex in enumerate(self.regex_list):
+                found.extend([(nr.start(), i, nr) for nr in regex.finditer(lines)])
+            for start, i, nr in sorted(found, key=lambda f: (f[0], f[1])):
+                self._add(nr)
+        if self.forward and len(self.matches) > self.n_forwarded and time.time() - self.forwarded_at >= self.interval:
+            self.forward(self.matches.since(self.n_forwarded))
+            self.n_forwarded = len(self.matches)
+            self.forwarded_at = time.time()
+
+    def output(self):
+        """
+        The last lines fed, preceded by the number of lines that were dropped
+        """
+        dropped = self.n_lines - len(self.tail)
+        return ("[%d lines not kept]\n" % dropped if dropped > 0 else '') + ''.join(self.tail)
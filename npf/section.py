@@ -6,7 +6,7 @@ from npf import npf
 from npf.repository import Repository
 from .variable import *
 from collections import OrderedDict
-from random import shuffle
+from random import getrandbits
 
 import re
 
@@ -286,38 +286,178 @@ class SectionRequire(Section):
 
 
 class BruteVariableExpander:
-    """Expand all variables building the full
-    matrix first."""
+    """Expand all variables lazily. The values of each variable are computed
+    once, and the combination at a given index is decoded from it as a
+    mixed-radix number, the first variable varying the fastest."""
 
     def __init__(self, vlist):
-        self.expanded = [OrderedDict()]
+        self.values = []
+        self.n = 1
         for k, v in vlist.items():
-            newList = []
             l = v.makeValues()
+            self.values.append((k, l))
+            self.n *= len(l)
+        self.it = self.__iter__()
 
-            for nvalue in l:
-                for ovalue in self.expanded:
-                    z = ovalue.copy()
-                    z.update(nvalue if type(nvalue) is OrderedDict else {k: nvalue})
-                    newList.append(z)
-
-            self.expanded = newList
-        self.it = self.expanded.__iter__()
+    def __len__(self):
+        return self.n
+
+    def index(self, i):
+        """Combination index of the i-th element of the expansion"""
+        return i
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.n
+        if i < 0 or i >= self.n:
+            raise IndexError("Variable combination %d out of range" % i)
+        i = self.index(i)
+        z = OrderedDict()
+        for k, l in self.values:
+            i, d = divmod(i, len(l))
+            nvalue = l[d]
+            z.update(nvalue if type(nvalue) is OrderedDict else {k: nvalue})
+        return z
 
     def __iter__(self):
-        return self.expanded.__iter__()
+        for i in range(self.n):
+            yield self[i]
 
     def __next__(self):
         return self.it.__next__()
 
+    def feed(self, variables, results):
+        """Called with the results of each combination once it is tested"""
+        pass
+
+
+class IndexPermutation:
+    """Pseudo-random permutation of range(n), computed for one index at a
+    time with a small Feistel network over the next even power of two, the
+    indices falling outside of the range being encrypted again"""
+
+    def __init__(self, n, rounds=4):
+        self.n = n
+        bits = max(2, (n - 1).bit_length())
+        bits += bits % 2
+        self.half = bits // 2
+        self.mask = (1 << self.half) - 1
+        self.keys = [getrandbits(32) for i in range(rounds)]
+
+    def _round(self, x, key):
+        x = ((x ^ key) * 0x45d9f3b) & 0xffffffff
+        x ^= x >> 16
+        return x & self.mask
+
+    def _encrypt(self, i):
+        l, r = i >> self.half, i & self.mask
+        for key in self.keys:
+            l, r = r, l ^ self._round(r, key)
+        return (l << self.half) | r
+
+    def __getitem__(self, i):
+        i = self._encrypt(i)
+        while i >= self.n:
+            i = self._encrypt(i)
+        return i
+
 
 class RandomVariableExpander(BruteVariableExpander):
     """Same as BruteVariableExpander but shuffle the series to test"""
 
     def __init__(self, vlist):
         super().__init__(vlist)
-        shuffle(self.expanded)
-        self.it == self.expanded.__iter__()
+        self.permutation = IndexPermutation(self.n)
+        self.it = self.__iter__()
+
+    def index(self, i):
+        return self.permutation[i]
+
+
+class DesignVariableExpander:
+    """Pick n points across all the RangeVariables at once with a seeded
+    Latin hypercube or Sobol sequence, instead of their full cartesian
+    product. The other variables are expanded by another expander for
+    each point."""
+
+    METHODS = ['lhs', 'sobol']
+
+    def __init__(self, vlist, method, n, seed=0):
+        try:
+            from scipy.stats import qmc
+        except ImportError:
+            raise Exception("The %s: design needs scipy >= 1.7" % method)
+        ranges = [(k, v) for k, v in vlist.items() if isinstance(v, RangeVariable)]
+        if method == 'sobol':
+            sampler = qmc.Sobol(len(ranges), seed=seed) if ranges else None
+        else:
+            sampler = qmc.LatinHypercube(len(ranges), seed=seed) if ranges else None
+        self.points = []
+        if sampler:
+            seen = set()
+            for u in sampler.random(n):
+                point = tuple([v.sample(x) for (k, v), x in zip(ranges, u)])
+                if point not in seen:
+                    seen.add(point)
+                    self.points.append(point)
+        else:
+            self.points.append(())
+        self.names = [k for k, v in ranges]
+        #The other expander gives the position of the range variables
+        self.expander = BruteVariableExpander(OrderedDict([(k, SimpleVariable(k, v.a) if k in self.names else v) for k, v in vlist.items()]))
+        self.it = self.__iter__()
+
+    def __len__(self):
+        return len(self.points) * len(self.expander)
+
+    def __iter__(self):
+        for point in self.points:
+            for z in self.expander:
+                z.update(zip(self.names, point))
+                yield z
+
+    def __next__(self):
+        return self.it.__next__()
+
+    def feed(self, variables, results):
+        self.expander.feed(variables, results)
+
+
+class SearchVariableExpander:
+    """Expand the other variables with another expander, and for each
+    combination try the values of a SearchVariable one after the other,
+    the next value depending on the results given to feed()"""
+
+    def __init__(self, expander, var):
+        self.expander = expander
+        self.var = var
+        self.value = None
+        self.accepted = False
+        self.it = self.__iter__()
+
+    def __len__(self):
+        return len(self.expander) * self.var.count()
+
+    def __iter__(self):
+        for z in self.expander:
+            search = self.var.search()
+            self.value = next(search)
+            while True:
+                zv = z.copy()
+                zv[self.var.name] = self.value
+                self.accepted = False
+                yield zv
+                try:
+                    self.value = search.send(self.accepted)
+                except StopIteration:
+                    break
+
+    def __next__(self):
+        return self.it.__next__()
+
+    def feed(self, variables, results):
+        if variables.get(self.var.name, None) == self.value:
+            self.accepted = self.var.accept(results)
 
 
 class SectionVariable(Section):
@@ -326,6 +466,7 @@ class SectionVariable(Section):
         self.content = ''
         self.vlist = OrderedDict()
         self.aliases = {}
+        self.design = ExperimentalDesign()
 
     @staticmethod
     def replace_variables(v: dict, content: str, self_role=None,self_node=None, default_role_map={}):
@@ -339,10 +480,30 @@ class SectionVariable(Section):
         return values
 
     def expand(self, method=None):
-        if method == "shuffle" or method == "rand" or method == "random":
-            return RandomVariableExpander(self.vlist)
+        design = None
+        if method and method.split(':')[0] in DesignVariableExpander.METHODS:
+            design = method.split(':')
+            if len(design) < 2:
+                raise Exception("--expand %s needs a number of points, such as %s:100" % (design[0], design[0]))
+            method = None
+        search = [v for v in self.vlist.values() if isinstance(v, SearchVariable)]
+        vlist = self.vlist
+        if search:
+            if len(search) > 1:
+                raise Exception("Only one SEARCH variable is supported, found %s" % ", ".join([v.name for v in search]))
+            #The other expander gives the position of the searched variable
+            vlist = OrderedDict([(k, SimpleVariable(k, v.a) if v is search[0] else v) for k, v in self.vlist.items()])
+        elif method == "search":
+            print("WARNING : --expand search needs a SEARCH variable, all values will be tested")
+        if design:
+            expander = DesignVariableExpander(vlist, design[0], int(design[1]), int(design[2]) if len(design) > 2 else 0)
+        elif method == "shuffle" or method == "rand" or method == "random":
+            expander = RandomVariableExpander(vlist)
         else:
-            return BruteVariableExpander(self.vlist)
+            expander = BruteVariableExpander(vlist)
+        if search:
+            return SearchVariableExpander(expander, search[0])
+        return expander
 
     def __iter__(self):
         return self.expand()
@@ -476,6 +637,7 @@ class SectionVariable(Section):
         for line in content.split("\n"):
             if line.strip() == "{":
                 c = CoVariable()
+                c.design = self.design
                 sections_stack.append(c)
                 self.vlist[c.name] = c
             elif line.strip() == "}":
@@ -542,7 +704,71 @@ class SectionLateVariable(SectionVariable):
         return final
 
 
+class ConfigVariables(OrderedDict):
+    """
+    Variables of a SectionConfig, counting the modifications so the config can reset the values it resolved
+    """
+    generation = 0
+
+    def __setitem__(self, k, v):
+        self.generation += 1
+        super().__setitem__(k, v)
+
+    def __delitem__(self, k):
+        self.generation += 1
+        super().__delitem__(k)
+
+    def pop(self, *args):
+        self.generation += 1
+        return super().pop(*args)
+
+    def popitem(self, last=True):
+        self.generation += 1
+        return super().popitem(last)
+
+    def setdefault(self, k, default=None):
+        self.generation += 1
+        return super().setdefault(k, default)
+
+    def clear(self):
+        self.generation += 1
+        super().clear()
+
+
 class SectionConfig(SectionVariable):
+    """
+    Configuration of a testie. The values resolved by the lookups (including the regular expressions of the
+    dictionaries) are cached until the variables are modified, by override() or any other way.
+    """
+    @property
+    def vlist(self):
+        return self._vlist
+
+    @vlist.setter
+    def vlist(self, vlist):
+        if not isinstance(vlist, ConfigVariables):
+            vlist = ConfigVariables(vlist)
+        self._vlist = vlist
+        self._cache = {}
+        self._cache_generation = vlist.generation
+
+    def _cached(self, key, f):
+        """
+        Value of f(), cached under key until the variables change
+        """
+        if self._cache_generation != self._vlist.generation:
+            self._cache.clear()
+            self._cache_generation = self._vlist.generation
+        try:
+            if key in self._cache:
+                return self._cache[key]
+        except TypeError:
+            #Unhashable argument
+            return f()
+        v = f()
+        self._cache[key] = v
+        return v
+
     def __add(self, var, val):
         v = SimpleVariable(var, val)
         v.is_default = True
@@ -596,6 +822,11 @@ class SectionConfig(SectionVariable):
 
         self.__add_list("time_kinds", [])
         self.__add("n_runs", 3)
+        self.__add("min_runs", 3)
+        self.__add("max_runs", 30)
+        self.__add("target_ci", "2%")
+        self.__add("stop_when", None)
+        self.__add("stop_axis", None)
         self.__add("n_retry", 0)
         self.__add_dict("var_n_runs", {})
         self.__add_dict("var_markers", {}) #Do not set CDF here, small CDF may want them, and then scatterplot would not work
@@ -697,12 +928,9 @@ class SectionConfig(SectionVariable):
 
     def get_list(self, key):
         key = key.lower()
-        var = self.vlist[key]
-        v = var.makeValues()
-        return v
+        return list(self._cached(('list', key), lambda: self.vlist[key].makeValues()))
 
-    def get_dict(self, key):
-        key = key.lower()
+    def _get_dict(self, key):
         var = self.vlist[key]
         try:
             v = OrderedDict()
@@ -713,16 +941,28 @@ class SectionConfig(SectionVariable):
             return {key: var.makeValues()[0]}
         return v
 
-    def get_dict_value(self, var, key, result_type=None, default=None):
+    def get_dict(self, key):
+        key = key.lower()
+        d = self._cached(('dict', key), lambda: self._get_dict(key))
+        return d.copy()
+
+    def _get_dict_regex(self, var):
+        """
+        Compiled keys of a dictionary
+        """
+        return self._cached(('dict_regex', var.lower()),
+                            lambda: [(re.compile(k, re.IGNORECASE), v) for k, v in self.get_dict(var).items()])
+
+    def _get_dict_value(self, var, key, result_type, default):
         best_l = -1
         best = default
         if var in self:
-            d = self.get_dict(var)
+            d = self._get_dict_regex(var)
             if result_type is not None:
                 #Search for "key-result_type", such as result-throughput
                 kr = key + "-" + result_type
-                for k, v in d.items():
-                    m = re.search(k,kr,re.IGNORECASE)
+                for k, v in d:
+                    m = k.search(kr)
                     if m:
                         l =  len(m.group(0))
                         if (best_l < l):
@@ -730,8 +970,8 @@ class SectionConfig(SectionVariable):
                             best = v
 
                 #Search for result type alone such as throughput
-                for k, v in d.items():
-                    m = re.search(k, result_type,re.IGNORECASE)
+                for k, v in d:
+                    m = k.search(result_type)
                     if m:
                         l =  len(m.group(0))
                         if (best_l < l):
@@ -739,8 +979,8 @@ class SectionConfig(SectionVariable):
                             best = v
 
             #Search for the exact key if there is no result_type
-            for k, v in d.items():
-                m = re.search(k, key, re.IGNORECASE)
+            for k, v in d:
+                m = k.search(key)
                 if m:
                     l =  len(m.group(0))
                     if (best_l < l):
@@ -749,10 +989,33 @@ class SectionConfig(SectionVariable):
 
         return best
 
+    def get_dict_value(self, var, key, result_type=None, default=None):
+        return self._cached(('dict_value', var, key, result_type, default),
+                            lambda: self._get_dict_value(var, key, result_type, default))
+
     def get_bool(self, key):
         return get_bool(self[key])
 
+    def adaptive_runs(self):
+        """
+        True if n_runs is auto : each combination is then run between min_runs and max_runs times, until the
+        confidence interval of the results is within target_ci of their mean
+        """
+        return str(self["n_runs"]).strip().lower() == "auto"
+
+    def get_ratio(self, key):
+        """
+        Value of a parameter given as a ratio or a percentage, such as 0.02 or 2%
+        """
+        v = str(self[key]).strip()
+        if v.endswith('%'):
+            return float(v[:-1]) / 100
+        return float(v)
+
     def get_bool_or_in(self, var, obj, default=None):
+        return self._cached(('bool_or_in', var, obj, default), lambda: self._get_bool_or_in(var, obj, default))
+
+    def _get_bool_or_in(self, var, obj, default):
         val = self[var]
 
         if type(val) == type(obj) and val == obj:
@@ -767,25 +1030,35 @@ class SectionConfig(SectionVariable):
     def __contains__(self, key):
         return key.lower() in self.vlist
 
-    def __getitem__(self, key):
-        var = self.vlist[key.lower()]
+    def _get(self, key):
+        var = self.vlist[key]
         v = var.makeValues()
         if type(v) is list and len(v) == 1:
             return v[0]
         else:
             return v
 
+    def __getitem__(self, key):
+        key = key.lower()
+        v = self._cached(('item', key), lambda: self._get(key))
+        if type(v) is list:
+            return list(v)
+        return v
+
     def __setitem__(self, key, val):
         self.__add(key.lower(), val)
 
-    def match(self, key, val):
+    def _match(self, key, val):
         try:
-            for match in self.get_list(key):
-                if re.match(match, val):
+            for match in self._cached(('match_regex', key.lower()), lambda: [re.compile(m) for m in self.get_list(key)]):
+                if match.match(val):
                     return True
-        except sre_constants.error:
+        except re.error:
             print("ERROR : Regex %s does not work" % key)
         return False
 
+    def match(self, key, val):
+        return self._cached(('match', key, val), lambda: self._match(key, val))
+
     def finish(self, testie):
         self.vlist = self.build(self.content, testie, check_exists=True)
@@ -11,6 +11,7 @@ from typing import List
 from npf.build import Build
 from npf.testie import Testie
 from npf.types.dataset import Dataset
+from npf.types.resulttable import ResultTable
 from npf import npf
 
 class Statistics:
@@ -95,16 +96,14 @@ class Statistics:
         #map of every <variable name, format>
         dtype = testie.variables.dtype()
 
-        y = OrderedDict()
-        dataset = []
-        for i, (run, results_types) in enumerate(all_results.items()):
-            vars = list(run.variables[k] for k in dtype['names'])
-            if not results_types is None and len(results_types) > 0:
+        table = ResultTable.from_dataset(all_results)
+        #Only runs having some results are part of the dataset
+        rows = np.zeros(len(table), dtype=bool)
+        for result_type in table.result_types():
+            rows |= table.present(result_type)
+        rows = np.nonzero(rows)[0]
 
-                dataset.append([v for v in vars])
-                for result_type, results in results_types.items():
-                    r = np.mean(results)
-                    y.setdefault(result_type, []).append(r)
+        dataset = [list(table.runs[i].variables[k] for k in dtype['names']) for i in rows]
         dtype['values'] = [None] * len(dtype['formats'])
 
         for i, f in enumerate(dtype['formats']):
@@ -118,6 +117,9 @@ class Statistics:
         X = np.array(dataset, ndmin=2)
 
         lset = []
-        for result_type, v in y.items():
-            lset.append((result_type, X, np.array(v),dtype))
+        for result_type in table.result_types():
+            #Runs missing this result type are left out, so X and y stay aligned
+            has_type = table.present(result_type)[rows]
+            y = table.mean(result_type)[rows][has_type]
+            lset.append((result_type, X[has_type] if not has_type.all() else X, y, dtype))
         return lset
@@ -0,0 +1,131 @@
+import re
+
+import numpy as np
+
+from npf.types.dataset import normalize_value
+from npf.variable import RangeVariable, unit_value
+
+
+class StopCondition:
+    """
+    One condition of stop_when, either a threshold such as LATENCY>10ms, or a plateau such as THROUGHPUT:plateau(3,1%)
+    met when the last 3 points of the axis changed the mean of the result by less than 1% each
+    """
+    PLATEAU_REGEX = r'^(?P<type>.+?):plateau\([ ]*(?P<n>[0-9]+)[ ]*(,[ ]*(?P<p>[0-9.]+)(?P<percent>%?)[ ]*)?\)$'
+    THRESHOLD_REGEX = r'^(?P<type>.+?)[ ]*(?P<op><=|>=|<|>)[ ]*(?P<value>[0-9.]+(e[+-][0-9]+)?)[ ]*(?P<multiplier>[nµugmkKGT]?)(?P<unit>s|sec|b|byte|bits)?$'
+
+    def __init__(self, result_type, op, value=None, n=None):
+        self.result_type = result_type
+        self.op = op
+        self.value = value
+        self.n = n
+
+    @staticmethod
+    def parse(text):
+        text = text.strip()
+        m = re.match(StopCondition.PLATEAU_REGEX, text)
+        if m:
+            p = float(m.group('p')) if m.group('p') else 1
+            if m.group('percent') or not m.group('p'):
+                p = p / 100
+            return StopCondition(m.group('type').strip(), 'plateau', p, int(m.group('n')))
+        m = re.match(StopCondition.THRESHOLD_REGEX, text)
+        if m:
+            return StopCondition(m.group('type').strip(), m.group('op'),
+                                 unit_value(float(m.group('value')), m.group('multiplier'), m.group('unit')))
+        raise Exception("Invalid stop_when condition '%s', expected TYPE:plateau(N,P%%) or TYPE>VALUE" % text)
+
+    def met(self, points):
+        """
+        :param points: List of the mean of the result type for each point of the axis, in the axis order, the last
+        one being the point just tested. None for points without this result.
+        """
+        if self.op == 'plateau':
+            if len(points) < self.n + 1:
+                return False
+            last = points[-(self.n + 1):]
+            if any([y is None for y in last]):
+                return False
+            for a, b in zip(last[:-1], last[1:]):
+                if a == 0 or abs(b - a) / abs(a) > self.value:
+                    return False
+            return True
+        y = points[-1]
+        if y is None:
+            return False
+        if self.op == '>':
+            return y > self.value
+        elif self.op == '>=':
+            return y >= self.value
+        elif self.op == '<':
+            return y < self.value
+        else:
+            return y <= self.value
+
+
+class SweepStopper:
+    """
+    Early stopping of a sweep along one axis : once a stop_when condition is met for a combination of the other
+    variables, the higher values of the axis are skipped for that combination.
+    """
+    def __init__(self, conditions, axis):
+        self.conditions = conditions
+        self.axis = axis
+        self.history = {}  # other variables -> {axis value -> {result type -> mean}}
+        self.stopped = {}  # other variables -> axis value where the sweep stopped
+
+    @staticmethod
+    def from_testie(testie, options):
+        """
+        Build the stopper of a testie from stop_when and stop_axis, or None if there is nothing to stop.
+        It is disabled by --force-test, so skipped points can be tested later.
+        """
+        stop_when = testie.config["stop_when"]
+        if not stop_when or options.force_test:
+            return None
+        conditions = [StopCondition.parse(c) for c in str(stop_when).split('|') if c.strip()]
+        axis = testie.config["stop_axis"]
+        if not axis:
+            for k, v in testie.variables.vlist.items():
+                if isinstance(v, RangeVariable) and v.count() > 1:
+                    axis = k
+                    break
+        if not axis:
+            print("WARNING : stop_when needs a range variable to stop, set stop_axis")
+            return None
+        return SweepStopper(conditions, axis)
+
+    def _split(self, variables):
+        if self.axis not in variables:
+            return None, None
+        others = tuple(sorted([(k, normalize_value(v)) for k, v in variables.items() if k != self.axis]))
+        return others, normalize_value(variables[self.axis])
+
+    def skip(self, variables):
+        """
+        True if the axis value of variables is after a point where the sweep stopped
+        """
+        others, x = self._split(variables)
+        if others not in self.stopped:
+            return False
+        return x > self.stopped[others]
+
+    def feed(self, variables, results):
+        """
+        Record the results of a point, and stop the axis for the other variables if a condition is met
+        """
+        others, x = self._split(variables)
+        if others is None:
+            return
+        means = {}
+        for result_type, result in (results or {}).items():
+            if result:
+                means[result_type] = np.mean(result)
+        history = self.history.setdefault(others, {})
+        history[x] = means
+        previous = [history[k] for k in sorted(history.keys()) if k <= x]
+        for condition in self.conditions:
+            if condition.met([p.get(condition.result_type, None) for p in previous]):
+                if others not in self.stopped or x < self.stopped[others]:
+                    self.stopped[others] = x
+                return
@@ -0,0 +1,27 @@
+from collections import OrderedDict
+
+from npf import npf
+from npf.store.store import ResultStore
+from npf.store.textstore import TextResultStore
+from npf.store.npzstore import NpzResultStore
+from npf.store.seriesstore import SeriesResultStore
+from npf.store.sqlitestore import SqliteResultStore
+
+stores = OrderedDict([(s.name, s) for s in [TextResultStore(), NpzResultStore(), SeriesResultStore(), SqliteResultStore()]])
+
+# Store used for the kind results (time series) of each format, when it is not the format itself
+kind_stores = {'npz': 'series'}
+
+
+def get_store(result_format=None, kind=False):
+    """
+    Return the store for the given format, or the one selected with --result-format
+    :param kind: Return the store used for the kind results in that format
+    """
+    if result_format is None:
+        result_format = getattr(npf.options, 'result_format', 'text') if npf.options else 'text'
+    if result_format not in stores:
+        raise Exception("Unknown result format %s. Known formats are %s" % (result_format, ', '.join(stores.keys())))
+    if kind and result_format in kind_stores:
+        result_format = kind_stores[result_format]
+    return stores[result_format]
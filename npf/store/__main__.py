@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Convert all the result files of a result path to another format, e.g. :
+  python -m npf.store --result-format npz results/
+"""
+import argparse
+import os
+import re
+
+from npf.build import Build, JOURNAL_EXT
+from npf.store import get_store, stores, kind_stores
+
+
+def result_files(path):
+    """
+    List the base names of all the result files (of any format, or with only a journal) under path
+    """
+    files = []
+    exts = [JOURNAL_EXT] + [store.ext for store in stores.values() if store.ext]
+    for root, dirs, names in os.walk(path):
+        #Some stores keep a result file as a folder
+        stored = [d for d in dirs if any(d.endswith(ext) for ext in exts)]
+        dirs[:] = [d for d in dirs if d not in stored]
+        for name in sorted(names + stored):
+            if name.endswith('.tmp') or name.endswith('.old'):
+                continue
+            for ext in exts:
+                if name.endswith(ext):
+                    name = name[:-len(ext)]
+                    break
+            if not re.search(r'\.results(-[^.]+)?$', name):
+                continue
+            #Skip the <version>.results marker of the builds that have results
+            if os.path.isdir(os.path.join(root, name[:-len('.results')])):
+                continue
+            f = os.path.join(root, name)
+            if f not in files:
+                files.append(f)
+    for store in stores.values():
+        for f in store.files(path):
+            if f not in files:
+                files.append(f)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert NPF result files to another format')
+    parser.add_argument('--result-format', dest='result_format', choices=[s for s in stores.keys() if s not in kind_stores.values()], default='npz',
+                        help='Format to convert to')
+    parser.add_argument('path', metavar='path', type=str, nargs='*', default=['results'],
+                        help='Result paths to convert')
+    args = parser.parse_args()
+
+    build = Build(None, '')
+    n = 0
+    for path in args.path:
+        for f in result_files(path):
+            m = re.search(r'\.results-([^.]+)$', f)
+            kind = m.group(1) if m else None
+            store = get_store(args.result_format, kind=kind is not None)
+            if not any(other.exists(f) for other in stores.values() if other is not store) and not os.path.exists(f + JOURNAL_EXT):
+                continue
+            #Variables are kept as strings, they are converted when loaded by the testie
+            results = build._load_results(None, f, cache=False, kind=kind)
+            build._writeversion(f, results, allow_overwrite=True, store=store, kind=kind)
+            #The results now live in the converted format only
+            for other in stores.values():
+                if other is not store:
+                    other.delete(f)
+            n += 1
+    print("Converted %d result files to %s" % (n, args.result_format))
+
+
+if __name__ == "__main__":
+    main()
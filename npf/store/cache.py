@@ -0,0 +1,151 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from npf import npf
+from npf.types.dataset import copy_results
+from npf.types.series import KindDataset, KindSeries
+from npf.types.resulttable import ResultTableMapping
+
+# Rough memory footprint of the Python objects of a run and of one result value
+RUN_SIZE = 512
+VARIABLE_SIZE = 128
+VALUE_SIZE = 32
+
+DEFAULT_BUDGET = 256
+
+
+def signature(paths):
+    """
+    Identify the content of the files backing a result file, so a modified file is never served from the cache
+    """
+    sig = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            sig.append((path, st.st_ino, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            sig.append((path, None))
+    return tuple(sig)
+
+
+def estimate_size(results):
+    if results is None:
+        return 0
+    if isinstance(results, KindDataset):
+        size = 0
+        for run in results.runs():
+            s = results._series[run]
+            size += RUN_SIZE + VARIABLE_SIZE * len(run.variables)
+            if isinstance(s, KindSeries):
+                #Memory-mapped arrays are in the page cache, not in our memory
+                for m in list(s.values.values()) + list(s.counts.values()):
+                    if not isinstance(m, np.memmap):
+                        size += m.nbytes
+            else:
+                for t, r in s.values():
+                    size += RUN_SIZE + sum([VALUE_SIZE * len(v) for v in r.values() if v])
+        return size
+    size = 0
+    if isinstance(results, ResultTableMapping):
+        table = results.table
+        size += (VARIABLE_SIZE * len(table.columns) + (RUN_SIZE if table._runs is not None else 0)) * len(table)
+        for values, offsets, present in table.types.values():
+            for a in [values, offsets, present]:
+                if not isinstance(a, np.memmap):
+                    size += a.nbytes
+        results = results._changed
+    for run, run_results in results.items():
+        size += RUN_SIZE + VARIABLE_SIZE * len(run.variables)
+        size += sum([VALUE_SIZE * len(v) for v in run_results.values() if v])
+    return size
+
+
+def copy_dataset(results):
+    """
+    A copy of the results of a file that can be modified without changing the original. Tables are shared, only the
+    runs set or deleted afterwards being copied.
+    """
+    if results is None:
+        return None
+    if isinstance(results, (ResultTableMapping, KindDataset)):
+        return results.copy()
+    return OrderedDict([(run, copy_results(run_results)) for run, run_results in results.items()])
+
+
+class ResultCache:
+    """
+    Process-wide LRU cache of the loaded result files, shared by all Build instances.
+    Entries are validated against the signature of the files backing them, and the least recently used are
+    evicted when the estimated size exceeds the budget given by --results-cache-size.
+    Every caller gets its own copy of the results, and keeps its copy if the entry is updated afterwards.
+    """
+    def __init__(self):
+        self.entries = OrderedDict()  # filename -> (signature, results, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def budget(self):
+        mb = getattr(npf.options, 'results_cache_size', DEFAULT_BUDGET) if npf.options else DEFAULT_BUDGET
+        return mb * 1024 * 1024
+
+    def get(self, filename, sig):
+        entry = self.entries.get(filename, None)
+        if entry is None or entry[0] != sig:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(filename)
+        return copy_dataset(entry[1])
+
+    def contains(self, filename):
+        return filename in self.entries
+
+    def put(self, filename, sig, results):
+        """
+        Cache a copy of results, the caller may keep modifying its own
+        """
+        self._put(filename, sig, copy_dataset(results))
+
+    def _put(self, filename, sig, results):
+        self.invalidate(filename)
+        size = estimate_size(results)
+        self.entries[filename] = (sig, results, size)
+        self.size += size
+        budget = self.budget()
+        while self.size > budget and len(self.entries) > 1:
+            old, (old_sig, old_results, old_size) = self.entries.popitem(last=False)
+            self.size -= old_size
+            self.evictions += 1
+
+    def update(self, filename, sig, results):
+        """
+        Merge some runs written by this process in a cached entry
+        """
+        entry = self.entries.get(filename, None)
+        if entry is None:
+            return
+        merged = copy_dataset(entry[1])
+        merged.update(copy_dataset(results))
+        self._put(filename, sig, merged)
+
+    def invalidate(self, filename):
+        entry = self.entries.pop(filename, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return "Results cache : %d hits, %d misses (%.1f%% hit rate), %d evictions, %d entries using ~%.1f MB of %d MB" % (
+            self.hits, self.misses, (100.0 * self.hits / total) if total else 0, self.evictions, len(self.entries),
+            self.size / (1024 * 1024), self.budget() / (1024 * 1024))
+
+
+results_cache = ResultCache()
@@ -0,0 +1,149 @@
+import struct
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+from npf import variable
+from npf.types.resulttable import ResultTable
+from npf.store.store import ResultStore
+
+ABSENT = 0
+NONE = 1
+VALUES = 2
+
+
+def _numeric_column(values):
+    """
+    Return a float column if all the values are numbers that convert back to the exact same string, None otherwise
+    """
+    col = []
+    for s in values:
+        if s is None:
+            col.append(np.nan)
+            continue
+        if not variable.is_numeric(s):
+            return None
+        v = variable.get_numeric(s)
+        if str(v) != s:
+            return None
+        col.append(v)
+    return np.array(col, dtype=np.float64)
+
+
+def _map_npz(path):
+    """
+    The arrays of an .npz archive by name. np.load ignores mmap_mode for archives, so the numeric arrays stored
+    without compression, as written by np.savez, are memory-mapped from the archive itself.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as z, open(path, 'rb') as f:
+        for info in z.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if info.compress_type == zipfile.ZIP_STORED:
+                #The local header is followed by the file name and an extra field, then by the .npy file
+                f.seek(info.header_offset)
+                header = f.read(30)
+                f.seek(info.header_offset + 30 + sum(struct.unpack('<HH', header[26:30])))
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+                if dtype.kind in 'biuf' and len(shape) > 0 and 0 not in shape:
+                    arrays[name] = np.memmap(path, dtype=dtype, mode='r', shape=shape, order='F' if fortran else 'C',
+                                             offset=f.tell())
+                    continue
+            with z.open(info) as member:
+                arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+    return arrays
+
+
+class NpzResultStore(ResultStore):
+    """
+    Columnar binary format, one .npz archive per result file.
+    Each variable is a column, numeric when all its values are numbers, string otherwise, with a presence mask
+    when some runs do not define it. Each result type is stored as a flat array of all the values of all runs,
+    with offsets delimiting the values of each run, so loading does not need any parsing.
+    Loading gives a ResultTable of the memory-mapped arrays, as a Dataset building the runs and the lists of values
+    only when they are accessed.
+    """
+    name = 'npz'
+    ext = '.npz'
+
+    def write(self, filename, all_results):
+        runs = list(all_results.keys())
+        names = sorted(set([k for run in runs for k in run.variables.keys()]))
+        types = OrderedDict()
+        for results in all_results.values():
+            for t in results.keys():
+                types[t] = True
+
+        arrays = OrderedDict()
+        arrays['n'] = np.array(len(runs), dtype=np.int64)
+        arrays['variables'] = np.array(names, dtype=np.str_)
+        for i, name in enumerate(names):
+            values = []
+            for run in runs:
+                val = run.variables.get(name, None)
+                if type(val) is tuple:
+                    val = val[1]
+                values.append(None if val is None else str(val))
+            col = _numeric_column(values)
+            if col is None:
+                col = np.array(['' if v is None else v for v in values], dtype=np.str_)
+            arrays['v%d' % i] = col
+            if None in values:
+                arrays['m%d' % i] = np.array([v is not None for v in values], dtype=np.bool_)
+
+        arrays['types'] = np.array(list(types.keys()), dtype=np.str_)
+        for i, t in enumerate(types.keys()):
+            state = np.zeros(len(runs), dtype=np.int8)
+            offsets = np.zeros(len(runs) + 1, dtype=np.int64)
+            values = []
+            for irun, results in enumerate(all_results.values()):
+                if t in results:
+                    r = results[t]
+                    if r is None:
+                        state[irun] = NONE
+                    else:
+                        state[irun] = VALUES
+                        for val in r:
+                            if type(val) is list:
+                                values.extend(val)
+                            else:
+                                values.append(val)
+                offsets[irun + 1] = len(values)
+            arrays['r%d_state' % i] = state
+            arrays['r%d_offsets' % i] = offsets
+            arrays['r%d_values' % i] = np.array(values, dtype=np.float64)
+
+        f = self._open_tmp(filename, 'wb')
+        np.savez(f, **arrays)
+        self._commit_tmp(filename, f)
+
+    def load(self, testie, filename):
+        data = _map_npz(self.path(filename))
+        n = int(data['n'])
+        columns = OrderedDict()
+        for i, name in enumerate(data['variables'].tolist()):
+            col = data['v%d' % i]
+            numeric = testie is not None and testie.variables.is_numeric(name)
+            if col.dtype.kind == 'f':
+                values = [variable.get_numeric(v) if numeric else str(variable.get_numeric(v)) for v in col.tolist()]
+            else:
+                values = [variable.get_numeric(v) if numeric else v for v in col.tolist()]
+            if ('m%d' % i) in data:
+                values = [v if present else None for v, present in zip(values, data['m%d' % i].tolist())]
+            columns[name] = np.empty(n, dtype=object)
+            columns[name][:] = values
+
+        types = OrderedDict()
+        nones = OrderedDict()
+        for i, t in enumerate(data['types'].tolist()):
+            state = data['r%d_state' % i]
+            types[t] = (data['r%d_values' % i], data['r%d_offsets' % i], state == VALUES)
+            none = state == NONE
+            if none.any():
+                nones[t] = none
+        return ResultTable(None, columns, types, nones, n=n).as_dataset()
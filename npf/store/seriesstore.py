@@ -0,0 +1,113 @@
+import os
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+
+from npf.store.store import ResultStore
+from npf.store.npzstore import NpzResultStore
+from npf.types.series import KindDataset, KindSeries
+
+
+def _load(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        #Empty arrays cannot be mapped
+        return np.load(path)
+
+
+def _save(path, array):
+    with open(path, 'wb') as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class SeriesResultStore(ResultStore):
+    """
+    Store for kind results (such as time series), one folder per result file.
+    The runs (without the kind variable) are kept in runs.npz, and the samples of all runs are concatenated in
+    .npy arrays, memory-mapped when loading : times.npy with the kind values, offsets.npy delimiting the samples
+    of each run, and for each result type a values-N.npy matrix and a counts-N.npy vector (see KindSeries).
+    """
+    name = 'series'
+    ext = '.series'
+
+    def exists(self, filename):
+        return os.path.isdir(self.path(filename))
+
+    def delete(self, filename):
+        if self.exists(filename):
+            shutil.rmtree(self.path(filename))
+
+    @staticmethod
+    def kind(filename):
+        return filename[filename.rfind('-') + 1:]
+
+    def write(self, filename, all_results):
+        kd = KindDataset.of(self.kind(filename), all_results)
+        runs = OrderedDict()
+        series = []
+        types = OrderedDict()
+        for run, s in kd.series_items():
+            runs[run] = {}
+            series.append(s)
+            for result_type, m in s.values.items():
+                types[result_type] = max(types.get(result_type, 0), m.shape[1])
+
+        path = self.path(filename)
+        tmp = path + '.tmp'
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        NpzResultStore().write(os.path.join(tmp, 'runs'), runs)
+        offsets = np.zeros(len(series) + 1, dtype=np.int64)
+        for i, s in enumerate(series):
+            offsets[i + 1] = offsets[i] + len(s)
+        total = int(offsets[-1])
+        _save(os.path.join(tmp, 'offsets.npy'), offsets)
+        _save(os.path.join(tmp, 'times.npy'), np.concatenate([s.kind_values for s in series]) if series else np.zeros(0))
+        _save(os.path.join(tmp, 'types.npy'), np.array(list(types.keys()), dtype=np.str_))
+        for i, (result_type, w) in enumerate(types.items()):
+            m = np.full((total, w), np.nan)
+            c = np.full(total, -1, dtype=np.int32)
+            for j, s in enumerate(series):
+                if result_type in s.values:
+                    sm = s.values[result_type]
+                    m[offsets[j]:offsets[j + 1], :sm.shape[1]] = sm
+                    c[offsets[j]:offsets[j + 1]] = s.counts[result_type]
+            _save(os.path.join(tmp, 'values-%d.npy' % i), m)
+            _save(os.path.join(tmp, 'counts-%d.npy' % i), c)
+
+        #A folder cannot be atomically replaced, move the old one aside first
+        if os.path.exists(path):
+            os.replace(path, path + '.old')
+        os.replace(tmp, path)
+        if os.path.exists(path + '.old'):
+            shutil.rmtree(path + '.old')
+
+    def load(self, testie, filename):
+        path = self.path(filename)
+        runs = list(NpzResultStore().load(testie, os.path.join(path, 'runs')).keys())
+        offsets = np.load(os.path.join(path, 'offsets.npy')).tolist()
+        times = _load(os.path.join(path, 'times.npy'))
+        types = np.load(os.path.join(path, 'types.npy')).tolist()
+        values = []
+        for i, result_type in enumerate(types):
+            values.append((result_type,
+                           _load(os.path.join(path, 'values-%d.npy' % i)),
+                           _load(os.path.join(path, 'counts-%d.npy' % i))))
+        kd = KindDataset(self.kind(filename))
+        for j, run in enumerate(runs):
+            a, b = offsets[j], offsets[j + 1]
+            s_values = OrderedDict()
+            s_counts = OrderedDict()
+            for result_type, m, c in values:
+                sc = c[a:b]
+                if np.all(sc == -1):
+                    continue
+                s_values[result_type] = m[a:b]
+                s_counts[result_type] = sc
+            kd.set_series(run, KindSeries(times[a:b], s_values, s_counts))
+        return kd
@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from npf import variable
+from npf.types.dataset import Run
+from npf.store.store import ResultStore
+
+DB_NAME = 'results.sqlite'
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS results (repo TEXT NOT NULL, version TEXT NOT NULL, testie TEXT NOT NULL, kind TEXT NOT NULL, "
+    "vhash TEXT NOT NULL, seq INTEGER NOT NULL, variables TEXT NOT NULL, type TEXT, vals BLOB)",
+    "CREATE INDEX IF NOT EXISTS results_key ON results (repo, version, testie, kind, vhash, type)",
+]
+
+
+def split_filename(filename):
+    """
+    Split a result file name such as results/click/abcdef/test.npf.results-time into the result path, repo, version,
+    testie and kind ('' for the main results)
+    """
+    version_folder = os.path.dirname(filename)
+    repo_folder = os.path.dirname(version_folder)
+    name = os.path.basename(filename)
+    i = name.rfind('.results')
+    kind = name[i + len('.results'):]
+    return os.path.dirname(repo_folder), os.path.basename(repo_folder), os.path.basename(version_folder), name[:i], kind[1:] if kind else ''
+
+
+def encode_variables(run):
+    v = []
+    for key, val in sorted(run.variables.items()):
+        if type(val) is tuple:
+            val = val[1]
+        v.append([key, str(val)])
+    s = json.dumps(v)
+    return s, hashlib.sha1(s.encode()).hexdigest()[:16]
+
+
+def decode_variables(testie, s):
+    variables = OrderedDict()
+    for k, v in json.loads(s):
+        variables[k] = variable.get_numeric(v) if testie and testie.variables.is_numeric(k) else v
+    return variables
+
+
+def encode_values(r):
+    if r is None:
+        return None
+    values = []
+    for val in r:
+        if type(val) is list:
+            values.extend(val)
+        else:
+            values.append(val)
+    return np.array(values, dtype=np.float64).tobytes()
+
+
+class SqliteResultStore(ResultStore):
+    """
+    Keeps all the results of a result path in a single SQLite database, results.sqlite at the root of the result path.
+    There is one row per run and result type, indexed by repo, version, testie, kind and a hash of the variables.
+    The database uses WAL journaling and immediate transactions so multiple NPF processes may write to it concurrently.
+    """
+    name = 'sqlite'
+    ext = ''
+
+    def __init__(self):
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def db_path(self, root):
+        return os.path.join(root if root else '.', DB_NAME)
+
+    def connect(self, root, create=True):
+        """
+        Return a connection to the database of a result path, one per process and thread
+        """
+        db = self.db_path(root)
+        key = (os.path.abspath(db), os.getpid(), threading.get_ident())
+        with self._lock:
+            conn = self._connections.get(key, None)
+            if conn is not None:
+                return conn
+            if not create and not os.path.exists(db):
+                return None
+            conn = sqlite3.connect(db, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._connections[key] = conn
+            return conn
+
+    def backing_files(self, filename):
+        db = self.db_path(split_filename(filename)[0])
+        return [db, db + '-wal']
+
+    def exists(self, filename):
+        root, repo, version, testie, kind = split_filename(filename)
+        conn = self.connect(root, create=False)
+        if conn is None:
+            return False
+        return conn.execute("SELECT 1 FROM results WHERE repo=? AND version=? AND testie=? AND kind=? LIMIT 1",
+                            (repo, version, testie, kind)).fetchone() is not None
+
+    def kinds(self, filename):
+        root, repo, version, testie, kind = split_filename(filename)
+        conn = self.connect(root, create=False)
+        if conn is None:
+            return []
+        return [r[0] for r in conn.execute("SELECT DISTINCT kind FROM results WHERE repo=? AND version=? AND testie=? AND kind!=''",
+                                           (repo, version, testie))]
+
+    def files(self, root):
+        conn = self.connect(root, create=False)
+        if conn is None:
+            return []
+        files = []
+        for repo, version, testie, kind in conn.execute("SELECT DISTINCT repo, version, testie, kind FROM results"):
+            files.append(os.path.join(root, repo, version, testie + '.results' + ('-' + kind if kind else '')))
+        return files
+
+    @staticmethod
+    def _rows(repo, version, testie, kind, seq, run, results):
+        variables, vhash = encode_variables(run)
+        if not results:
+            return [(repo, version, testie, kind, vhash, seq, variables, None, None)]
+        return [(repo, version, testie, kind, vhash, seq, variables, t, encode_values(r)) for t, r in results.items()]
+
+    def _transaction(self, conn, f):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            f()
+        except:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def write(self, filename, all_results):
+        root, repo, version, testie, kind = split_filename(filename)
+        conn = self.connect(root)
+        rows = []
+        for seq, (run, results) in enumerate(all_results.items()):
+            rows.extend(self._rows(repo, version, testie, kind, seq, run, results))
+
+        def replace():
+            conn.execute("DELETE FROM results WHERE repo=? AND version=? AND testie=? AND kind=?", (repo, version, testie, kind))
+            conn.executemany("INSERT INTO results VALUES (?,?,?,?,?,?,?,?,?)", rows)
+        self._transaction(conn, replace)
+
+    def append(self, filename, results):
+        root, repo, version, testie, kind = split_filename(filename)
+        conn = self.connect(root)
+
+        def upsert():
+            seq = conn.execute("SELECT MAX(seq) FROM results WHERE repo=? AND version=? AND testie=? AND kind=?",
+                               (repo, version, testie, kind)).fetchone()[0]
+            seq = -1 if seq is None else seq
+            for run, run_results in results.items():
+                variables, vhash = encode_variables(run)
+                prev = conn.execute("SELECT seq FROM results WHERE repo=? AND version=? AND testie=? AND kind=? AND vhash=? LIMIT 1",
+                                    (repo, version, testie, kind, vhash)).fetchone()
+                if prev is None:
+                    seq += 1
+                    run_seq = seq
+                else:
+                    run_seq = prev[0]
+                    conn.execute("DELETE FROM results WHERE repo=? AND version=? AND testie=? AND kind=? AND vhash=?",
+                                 (repo, version, testie, kind, vhash))
+                conn.executemany("INSERT INTO results VALUES (?,?,?,?,?,?,?,?,?)",
+                                 self._rows(repo, version, testie, kind, run_seq, run, run_results))
+        self._transaction(conn, upsert)
+        return True
+
+    def delete(self, filename):
+        root, repo, version, testie, kind = split_filename(filename)
+        conn = self.connect(root, create=False)
+        if conn is None:
+            return
+        self._transaction(conn, lambda: conn.execute("DELETE FROM results WHERE repo=? AND version=? AND testie=? AND kind=?",
+                                                     (repo, version, testie, kind)))
+
+    @staticmethod
+    def _group(testie, rows):
+        all_results = OrderedDict()
+        runs = {}
+        for vhash, variables, t, vals in rows:
+            if vhash in runs:
+                results = runs[vhash]
+            else:
+                results = {}
+                runs[vhash] = results
+                all_results[Run(decode_variables(testie, variables))] = results
+            if t is None:
+                continue
+            results[t] = None if vals is None else np.frombuffer(vals, dtype=np.float64).tolist()
+        return all_results
+
+    def load(self, testie, filename):
+        root, repo, version, testie_name, kind = split_filename(filename)
+        conn = self.connect(root)
+        rows = conn.execute("SELECT vhash, variables, type, vals FROM results WHERE repo=? AND version=? AND testie=? AND kind=? "
+                            "ORDER BY seq, rowid", (repo, version, testie_name, kind))
+        return self._group(testie, rows)
+
+    def load_versions(self, testie, root, repo, versions, kind=''):
+        """
+        Load the results of a testie for multiple versions with a single query
+        :return: An ordered dict of version -> results, only for the versions that have results
+        """
+        conn = self.connect(root, create=False)
+        if conn is None or not versions:
+            return OrderedDict()
+        rows = {}
+        for version, vhash, variables, t, vals in conn.execute(
+                "SELECT version, vhash, variables, type, vals FROM results WHERE repo=? AND testie=? AND kind=? AND version IN (%s) "
+                "ORDER BY seq, rowid" % ','.join(['?'] * len(versions)), [repo, testie.filename, kind] + list(versions)):
+            rows.setdefault(version, []).append((vhash, variables, t, vals))
+        return OrderedDict([(version, self._group(testie, rows[version])) for version in versions if version in rows])
@@ -0,0 +1,79 @@
+import os
+from abc import ABCMeta, abstractmethod
+
+
+class ResultStore(metaclass=ABCMeta):
+    """
+    Storage backend of the result files. A result file is identified by its base name, such as
+    results/click/abcdef/test.npf.results (or test.npf.results-time for a kind), each backend
+    adding its own extension
+    """
+    name = None
+    ext = ''
+
+    def path(self, filename):
+        return filename + self.ext
+
+    def backing_files(self, filename):
+        """
+        Files whose modification means the result file changed
+        """
+        return [self.path(filename)]
+
+    def exists(self, filename):
+        return os.path.exists(self.path(filename))
+
+    @abstractmethod
+    def load(self, testie, filename):
+        """
+        Load all the runs of a result file
+        :param testie: Testie used to know which variables are numeric. If None, variables are kept as strings
+        :return: An ordered dict of Run -> {result type -> list of values}
+        """
+
+    @abstractmethod
+    def write(self, filename, all_results):
+        """
+        Replace the content of a result file by all_results. The write must be atomic, an interruption must
+        leave either the old or the new file, never a partial one
+        """
+
+    def append(self, filename, results):
+        """
+        Add or replace some runs of a result file
+        :return: False if the store cannot do it, the runs are then appended to the journal
+        """
+        return False
+
+    def kinds(self, filename):
+        """
+        List the kinds of a result file that are not kept in their own file
+        """
+        return []
+
+    def files(self, root):
+        """
+        List the result files of the result path root that are not kept in their own file
+        """
+        return []
+
+    def load_versions(self, testie, root, repo, versions, kind=''):
+        """
+        Load the results of a testie for multiple versions of a repository at once
+        :return: An ordered dict of version -> results, or None if the store does not support it
+        """
+        return None
+
+    def delete(self, filename):
+        if self.exists(filename):
+            os.unlink(self.path(filename))
+
+    def _open_tmp(self, filename, mode):
+        path = self.path(filename)
+        return open(path + '.tmp', mode)
+
+    def _commit_tmp(self, filename, f):
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(self.path(filename) + '.tmp', self.path(filename))
@@ -0,0 +1,83 @@
+import re
+from collections import OrderedDict
+
+from npf import variable
+from npf.types.dataset import Run
+from npf.store.store import ResultStore
+
+
+def format_line(run, results):
+    v = []
+    for key, val in sorted(run.variables.items()):
+        if type(val) is tuple:
+            val = val[1]
+        v.append((key + ":" + str(val).replace(':','\\:')).replace(',','\\,'))
+    type_results = []
+    for t,r in results.items():
+        str_results = []
+        if r is None:
+            pass
+        else:
+            for val in r:
+                if type(val) is list:
+                    str_results.extend([str(v) for v in val])
+                else:
+                    str_results.append(str(val))
+        type_results.append(t+':'+(','.join(str_results)))
+    return ','.join(v) + "={" + '},{'.join(type_results) + "}\n"
+
+
+def parse_line(testie, line):
+    variables_data, results_data = line.strip().split('=')
+
+    variables = OrderedDict()
+
+    for v_data in re.split(r'(?<!\\),', variables_data):
+        if v_data.strip():
+            k, v = re.split(r'(?<!\\):', v_data)
+            variables[k] = variable.get_numeric(v) if testie and testie.variables.is_numeric(k) else str(v).replace('\\:',':')
+    results = {}
+
+    results_data = results_data.strip()[1:-1].split('},{')
+    if len(results_data) == 1 and results_data[0].strip() == '':
+        pass
+    else:
+        for type_r, results_type_data in [x.split(':') for x in results_data]:
+            results_type_data = results_type_data.split(',')
+            if len(results_type_data) == 1 and results_type_data[0].strip() == '':
+                type_results = None
+            else:
+                type_results = []
+                for result in results_type_data:
+                    type_results.append(float(result.strip()))
+            results[type_r] = type_results
+    return Run(variables), results
+
+
+class TextResultStore(ResultStore):
+    """
+    The historical format, one line per run : var:value,var2:value={TYPE:v1,v2},{TYPE2:v1}
+    """
+    name = 'text'
+    ext = ''
+
+    def load(self, testie, filename):
+        all_results = OrderedDict()
+        f = open(self.path(filename), 'r')
+        try:
+            for iline,line in enumerate(f):
+                if not line.strip():
+                    continue
+                run, results = parse_line(testie, line)
+                all_results[run] = results
+        except:
+            print("Could not parse %s. The program will stop to avoid erasing data. Please correct or delete the file.\nLine %d : %s" % (filename,iline, line))
+            raise
+        f.close()
+        return all_results
+
+    def write(self, filename, all_results):
+        f = self._open_tmp(filename, 'w+')
+        for run, results in all_results.items():
+            f.write(format_line(run, results))
+        self._commit_tmp(filename, f)
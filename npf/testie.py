@@ -1,5 +1,7 @@
+import asyncio
 import multiprocessing
 import os
+import queue as queue_module
 import sys
 import threading
 import time
@@ -11,6 +13,7 @@ import itertools
 import string
 from pathlib import Path
 from queue import Empty
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, Dict
 import numpy as np
 from npf.build import Build
@@ -18,13 +21,21 @@ from npf.node import NIC
 from npf.section import *
 from npf.npf import get_valid_filename
 from npf.types.dataset import Run, Dataset
-from npf.eventbus import EventBus
-from .variable import get_bool
+from npf.types.series import KindDataset
+from npf.stopwhen import SweepStopper
+from npf.resultparser import ResultParser, ResultMatches
+from npf import livefeed
+from npf.eventbus import EventBus, ManagerEventBus, AsyncEventBus
+from npf.executor.asyncexecutor import AsyncExecutor
+from .variable import get_bool, unit_value
 from decimal import *
 from functools import reduce
 
 from subprocess import PIPE, Popen, TimeoutExpired
 
+# Folders sent to the nodes at the same time
+MAX_SENDS = 32
+
 class RemoteParameters:
     def __init__(self):
         self.default_role_map = None
@@ -46,55 +57,302 @@ class RemoteParameters:
         self.title = None
         self.env = None
         self.virt = ""
+        self.cwd = None
+        self.result_regex = None
+        self.partial = None
+        self.index = None
 
     pass
 
 
-def _parallel_exec(param: RemoteParameters):
-    nodes = npf.nodes_for_role(param.role)
-    executor = nodes[param.role_id].executor
+class WorkerPool:
+    """
+    Processes running the scripts of the tests, the manager sharing the queues with them, and the event bus.
+    They are kept for all the runs of execute_all instead of being created for each run, the pool being only
+    recreated when a run needs more scripts in parallel.
+    With asynchronous set, see --async, the scripts of a run are coroutines of a single event loop instead, the
+    executors without an asyncio implementation using a thread per script.
+    It also measures the orchestration overhead : the time of each run not spent in the slowest script, and the time
+    scripts waiting for an event took to wake up.
+    """
+    def __init__(self, asynchronous=False):
+        self.asynchronous = asynchronous
+        self._loop = None
+        self.pool = None
+        self.size = 0
+        self._manager = None
+        self._event_bus = None
+        self.n_runs = 0
+        self.run_time = 0
+        self.overhead = 0
+        self.skews = []
+
+    def manager(self):
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+        return self._manager
+
+    def loop(self):
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            #Attaches the child watcher needed by subprocesses on Python < 3.8
+            asyncio.set_event_loop(self._loop)
+        return self._loop
+
+    def queue(self):
+        """
+        Queue of the killers of the scripts of a run
+        """
+        if self.asynchronous:
+            return queue_module.Queue()
+        return self.manager().Queue()
+
+    def counter(self):
+        if self.asynchronous:
+            return multiprocessing.RawValue('i', 0)
+        return self.manager().Value('i', 0)
+
+    def event_bus(self):
+        """
+        The event bus of a new run. The shared memory bus is only inherited by forked workers, so it must exist before
+        the pool, otherwise the events go through the manager.
+        """
+        if self.asynchronous:
+            return AsyncEventBus(self.loop())
+        if multiprocessing.get_start_method() != 'fork':
+            return ManagerEventBus(self.manager())
+        if self._event_bus is None:
+            self._close_pool(terminate=False)
+            self._event_bus = EventBus()
+        else:
+            self._event_bus.reset()
+        return self._event_bus
+
+    def map(self, f, params):
+        n = len(params)
+        if self.pool is None or self.size < n:
+            self._close_pool(terminate=False)
+            self.pool = multiprocessing.Pool(n)
+            self.size = n
+        #The scripts of a run wait for each other, so each must have its own worker
+        return self.pool.map(f, params, chunksize=1)
+
+    def run(self, params):
+        """
+        Run the scripts of a run in the event loop
+        :return: The list of (time, result of _parallel_exec) of each script
+        """
+        threads = ThreadPoolExecutor(len(params))
+        try:
+            return self.loop().run_until_complete(
+                asyncio.gather(*[_timed_async_parallel_exec(param, threads) for param in params]))
+        finally:
+            threads.shutdown(wait=False)
+
+    def account(self, run_time, exec_times, skews=None):
+        self.n_runs += 1
+        self.run_time += run_time
+        self.overhead += max(0, run_time - (max(exec_times) if exec_times else 0))
+        if skews:
+            self.skews.extend(skews)
+
+    def stats(self):
+        if self.n_runs == 0:
+            return "Orchestration overhead : no run"
+        return "Orchestration overhead : %.1f ms per run over %d runs (%.1f%% of the run time)" % (
+            1000 * self.overhead / self.n_runs, self.n_runs, (100.0 * self.overhead / self.run_time) if self.run_time else 0) + \
+            ((", events woke their listeners after %.2f ms on average, %.2f ms at most" % (
+                1000 * sum(self.skews) / len(self.skews), 1000 * max(self.skews))) if self.skews else "")
+
+    def _close_pool(self, terminate):
+        if self.pool is not None:
+            if terminate:
+                self.pool.terminate()
+            else:
+                self.pool.close()
+            self.pool.join()
+            self.pool = None
+            self.size = 0
+
+    def close(self, terminate=False):
+        self._close_pool(terminate)
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+        if self._event_bus is not None:
+            self._event_bus.close()
+            self._event_bus = None
+        if self._loop is not None:
+            asyncio.set_event_loop(None)
+            self._loop.close()
+            self._loop = None
+
+
+def _timed_parallel_exec(param: RemoteParameters):
+    """
+    Run _parallel_exec in a pool worker, returning the time it took with its result
+    """
+    if param.cwd:
+        #A worker may have run scripts of another test folder
+        os.chdir(param.cwd)
+    start = time.time()
+    r = _parallel_exec(param)
+    return time.time() - start, r
+
+
+async def _timed_async_parallel_exec(param: RemoteParameters, threads):
+    start = time.time()
+    r = await _async_parallel_exec(param, threads)
+    return time.time() - start, r
+
+
+def _waited_events(param: RemoteParameters):
+    """
+    The events a script waits for before starting, as a list of (event, number of posts)
+    """
+    events = []
     for wf in param.waitfor if type(param.waitfor) is list else [param.waitfor]:
         if wf is None:
             continue
         n=1
-        #print("Waiting for %s" % wf)
         if wf[0].isdigit():
             n=int(wf[0])
             wf=wf[1:]
-        for i in range(n):
-            param.event.listen(wf)
+        events.append((wf, n))
+    return events
+
+
+def _exec_arguments(param: RemoteParameters, parser):
+    return dict(cmd=param.commands,
+                stdin=param.stdin,
+                timeout=param.timeout,
+                bin_paths=param.bin_paths,
+                queue=param.queue,
+                options=param.options,
+                sudo=param.sudo,
+                testdir=param.testdir,
+                event=param.event,
+                title=param.name,
+                env=param.env,
+                virt=param.virt,
+                on_output=parser.feed if parser else None)
+
+
+def _result_parser(param: RemoteParameters):
+    """
+    The parser of the output of a script, forwarding the results found while it runs to the main process if asked
+    """
+    if not param.result_regex:
+        return None
+    forward = None
+    if param.partial is not None:
+        forward = lambda matches: param.partial.put((param.index, matches))
+    return ResultParser(param.result_regex, forward=forward)
+
+
+def _killed_before_execution(param: RemoteParameters):
+    return 1, 'Killed before execution', 'Killed before execution', 0, param.script, None
+
+
+def _exec_result(param: RemoteParameters, parser, pid, o, e, c):
+    """
+    The result of a script given the result of exec, and whether the other scripts must be killed, when it was
+    interrupted or it is the last of the scripts to autokill
+    """
+    matches = None
+    if parser:
+        o = parser.output()
+        matches = parser.matches
+    if pid == 0:
+        return (False, o, e, c, param.script, matches), False
+    kill = pid == -1
+    if param.autokill is not None:
+        param.event.c.acquire()
+        param.autokill.value = param.autokill.value - 1
+        kill = param.autokill.value == 0
+        param.event.c.release()
+    if pid == -1:
+        return (-1, o, e, c, param.script, matches), kill
+    return (True, o, e, c, param.script, matches), kill
+
+
+async def _async_parallel_exec(param: RemoteParameters, threads):
+    """
+    _parallel_exec as a coroutine of the event loop of WorkerPool.run
+    """
+    nodes = npf.nodes_for_role(param.role)
+    executor = AsyncExecutor.of(nodes[param.role_id].executor, threads)
+    for wf, n in _waited_events(param):
+        await param.event.async_listen(wf, n)
+
+    await param.event.async_wait_for_termination(param.delay)
+    if param.event.is_terminated():
+        return _killed_before_execution(param)
+    parser = _result_parser(param)
+    pid, o, e, c = await executor.exec(**_exec_arguments(param, parser))
+    result, kill = _exec_result(param, parser, pid, o, e, c)
+    if kill:
+        #Killing waits for the scripts to die, the other coroutines may still need to read their output meanwhile
+        await asyncio.get_event_loop().run_in_executor(threads, Testie.killall, param.queue, param.event)
+    return result
+
+
+def _parallel_exec(param: RemoteParameters):
+    nodes = npf.nodes_for_role(param.role)
+    executor = nodes[param.role_id].executor
+    for wf, n in _waited_events(param):
+        param.event.listen(wf, n)
 
     param.event.wait_for_termination(param.delay)
     if param.event.is_terminated():
-        return 1, 'Killed before execution', 'Killed before execution', 0, param.script
-    pid, o, e, c = executor.exec(cmd=param.commands,
-                                 stdin=param.stdin,
-                                 timeout=param.timeout,
-                                 bin_paths=param.bin_paths,
-                                 queue=param.queue,
-                                 options=param.options,
-                                 sudo=param.sudo,
-                                 testdir=param.testdir,
-                                 event=param.event,
-                                 title=param.name,
-                                 env=param.env,
-                                 virt=param.virt)
-    if pid == 0:
-        return False, o, e, c, param.script
-    else:
-        if param.autokill is not None:
-                param.event.c.acquire()
-                param.autokill.value = param.autokill.value - 1
-                v = param.autokill.value
-                param.event.c.release()
-                if v == 0:
-                    Testie.killall(param.queue, param.event)
-
-        elif pid == -1:
-            Testie.killall(param.queue, param.event)
-        if pid == -1:
-            return -1, o, e, c, param.script
-        return True, o, e, c, param.script
+        return _killed_before_execution(param)
+    parser = _result_parser(param)
+    pid, o, e, c = executor.exec(**_exec_arguments(param, parser))
+    result, kill = _exec_result(param, parser, pid, o, e, c)
+    if kill:
+        Testie.killall(param.queue, param.event)
+    return result
+
+
+class PartialResults:
+    """
+    Collects the matches forwarded by the scripts of a run while they are running, see ResultParser, and gives all
+    the matches found so far to a callback, from a thread of the main process
+    """
+    def __init__(self, queue, callback):
+        self.queue = queue
+        self.callback = callback
+        self.matches = {}
+        self.thread = threading.Thread(target=self._collect)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _collect(self):
+        while True:
+            m = self.queue.get()
+            stop = m is None
+            #When the callback is slower than the scripts, it is only given the last state
+            while not stop:
+                self.matches.setdefault(m[0], ResultMatches()).extend(m[1])
+                try:
+                    m = self.queue.get_nowait()
+                except queue_module.Empty:
+                    break
+                stop = m is None
+            if stop:
+                return
+            matches = ResultMatches()
+            for i in sorted(self.matches.keys()):
+                matches.extend(self.matches[i])
+            try:
+                self.callback(matches)
+            except Exception as e:
+                print("Error while handling the partial results :")
+                print(e)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
 
 
 class ScriptInitException(Exception):
@@ -111,6 +369,7 @@ class Testie:
         return self.scripts
 
     def __init__(self, testie_path, options, tags=None, role=None, inline=None):
+        self.pool = None
         loc_path = npf.find_local(testie_path)
         if os.path.exists(loc_path):
             testie_path = loc_path
@@ -307,13 +566,8 @@ class Testie:
                     deprepo = Repository.get_instance(dep, self.options)
 
                     toSend.add((deprepo.reponame,role,node,deprepo.get_build_path()))
-        for repo,role,node,bp in toSend.difference(done):
-            print("Sending software %s to %s... " % (repo, role), end ='')
-            t = node.executor.sendFolder(os.path.relpath(bp,npf.npf_root_path()),local=npf.npf_root_path())
-            if (t > 0):
-                print("%d bytes sent." % t)
-            else:
-                print("Already up to date !")
+        self.send_folders([("software %s" % repo, role, node, os.path.relpath(bp,npf.npf_root_path()), npf.npf_root_path())
+                           for repo,role,node,bp in sorted(toSend.difference(done), key=lambda s: (s[0], s[1], s[2].name))])
 
         done.update(toSend)
 
@@ -324,6 +578,7 @@ class Testie:
             st.update(late_variables.execute(st, self, fail=False))
 
         L = [imp.testie.sendfile for imp in self.imports]
+        sends = []
         for role, fpaths in itertools.chain(self.sendfile.items(), {k: v for d in L for k, v in d.items()}.items()):
             nodes = npf.nodes_for_role(role)
             for node in nodes:
@@ -334,16 +589,45 @@ class Testie:
 #                    if not os.path.isabs(fpath):
 #                        fpath = './npf/' + fpath
                     fpath = os.path.relpath(fpath)
-                    print("Sending files %s to %s... " % (fpath, role), end = '')
-                    t = node.executor.sendFolder(fpath)
-                    if (t > 0):
-                        print("%d bytes sent." % t)
-                    else:
-                        print("Already up to date !")
-
+                    sends.append(("files %s" % fpath, role, node, fpath, None))
+        self.send_folders(sends)
 
         return True
 
+    @staticmethod
+    def send_folders(sends):
+        """
+        Send folders to nfs=0 nodes, all at the same time
+        :param sends: List of (description, role, node, path, local folder) given to sendFolder
+        """
+        if not sends:
+            return
+
+        #Roles mapped to the same node must not send the same folder twice at the same time
+        unique = OrderedDict()
+        for what, role, node, path, local in sends:
+            whats, roles = unique.setdefault((node, path, local), ([], []))
+            if what not in whats:
+                whats.append(what)
+            if role not in roles:
+                roles.append(role)
+
+        def send(key):
+            node, path, local = key
+            start = time.time()
+            t = node.executor.sendFolder(path, local=local)
+            return t, time.time() - start
+
+        with ThreadPoolExecutor(min(len(unique), MAX_SENDS)) as threads:
+            results = list(threads.map(send, unique.keys()))
+        for ((node, path, local), (whats, roles)), (t, duration) in zip(unique.items(), results):
+            what = ', '.join(whats)
+            role = ', '.join([str(r) for r in roles])
+            if t > 0:
+                print("Sending %s to %s (%s)... %d bytes sent in %.2f seconds." % (what, role, node.name, t, duration))
+            else:
+                print("Sending %s to %s (%s)... Already up to date !" % (what, role, node.name))
+
     def test_tags(self):
         missings = []
         for tag in self.config.get_list("require_tags"):
@@ -376,13 +660,20 @@ class Testie:
             else:
                 unique_list[filename + (role if role else '')] = (filename, p, role)
 
+        #The files are written here once, then each node receives all its files at once
+        node_files = OrderedDict()
         for whatever, (filename, p, role) in unique_list.items():
             if self.options.show_files:
                 print("File %s:" % filename)
                 print(p.strip())
+            with open(filename, "w") as f:
+                f.write(p)
             for node in npf.nodes_for_role(role):
-                if not node.executor.writeFile(filename, path_to_root, p):
-                    raise Exception("Could not create file %s on %s" % (filename, node.name))
+                node_files.setdefault(node.executor, (node, []))[1].append((filename, p))
+
+        for executor, (node, files) in node_files.items():
+            if not executor.writeFiles(files, path_to_root):
+                raise Exception("Could not create files %s on %s" % (', '.join([f for f, p in files]), node.name))
 
     def test_require(self, v, build):
         for require in self.requirements + list(itertools.chain.from_iterable([imp.testie.requirements for imp in self.imports])):
@@ -448,69 +739,44 @@ class Testie:
 
     def parse_results(self, regex_list: str, output: str, new_kind_results: dict, new_data_results: dict) -> Tuple[
         bool, bool]:
+        return self.add_results(ResultParser(regex_list).parse(output).matches, new_kind_results, new_data_results)
+
+    def add_results(self, matches, new_kind_results: dict, new_data_results: dict, quiet=False) -> Tuple[bool, bool]:
+        """
+        Add the results found by a ResultParser
+        :param matches: List of (result type, kind, kind value, value)
+        """
         has_err = False
         has_values = False
         try:
-            for result_regex in regex_list:
-                for nr in re.finditer(result_regex, output.strip(), re.IGNORECASE):
-                    result_type = nr.group("type")
-
-                    kind = nr.group("kind")
-                    if kind is None:
-                        kind = "time"
-                    kind_value = nr.group("kind_value")
-                    if result_type is None:
-                        result_type = ''
-                    n = float(nr.group("value"))
-                    mult = nr.group("multiplier")
-                    unit = ""
-                    if nr.group("unit"):
-                        unit = nr.group("unit")
-                    if unit.lower() == "sec" or unit.lower() == "s":
-                        unit = "s"
-
-                    if unit == "s":
-                        if mult == "m":
-                            n = n / 1000  # Keep all results in seconds
-                        elif mult == "u" or mult == "µ":
-                            n = n / 1000000
-                        elif mult == "n":
-                            n = n / 1000000000
-                    else:
-                        mult = mult.upper()
-
-                    if mult == "K":
-                        n *= 1024
-                    elif mult == "M":
-                        n *= 1024 * 1024
-                    elif mult == "G":
-                        n *= 1024 * 1024 * 1024
-                    if n != 0 or (self.config.match("accept_zero", result_type)) or kind_value is not None:
-                        result_add = self.config.get_bool_or_in("result_add", result_type)
-                        result_append = self.config.get_bool_or_in("result_append", result_type)
-                        if kind_value:
-                            t = float(kind_value)
-                            if result_type in new_kind_results.setdefault(kind,{}).setdefault(t, {}):
-                                if result_add:
-                                    new_kind_results[kind][t][result_type] += n
-                                else:
-                                    if type(new_kind_results[kind][t][result_type]) is not list:
-                                        new_kind_results[kind][t][result_type] = [new_kind_results[kind][t][result_type]]
-
-                                    new_kind_results[kind][t][result_type].append(n)
+            for result_type, kind, kind_value, n in matches:
+                if n != 0 or (self.config.match("accept_zero", result_type)) or kind_value is not None:
+                    result_add = self.config.get_bool_or_in("result_add", result_type)
+                    result_append = self.config.get_bool_or_in("result_append", result_type)
+                    if kind_value:
+                        t = float(kind_value)
+                        if result_type in new_kind_results.setdefault(kind,{}).setdefault(t, {}):
+                            if result_add:
+                                new_kind_results[kind][t][result_type] += n
                             else:
-                                new_kind_results[kind][t][result_type] = n
+                                if type(new_kind_results[kind][t][result_type]) is not list:
+                                    new_kind_results[kind][t][result_type] = [new_kind_results[kind][t][result_type]]
+
+                                new_kind_results[kind][t][result_type].append(n)
                         else:
-                            if result_append:
-                                new_data_results.setdefault(result_type,[]).append(n)
-                            elif result_type in new_data_results and result_add:
-                                new_data_results[result_type] += n
-                            else:
-                                new_data_results[result_type] = n
-                        has_values = True
+                            new_kind_results[kind][t][result_type] = n
                     else:
+                        if result_append:
+                            new_data_results.setdefault(result_type,[]).append(n)
+                        elif result_type in new_data_results and result_add:
+                            new_data_results[result_type] += n
+                        else:
+                            new_data_results[result_type] = n
+                    has_values = True
+                else:
+                    if not quiet:
                         print("Result for %s is 0 !" % result_type)
-                        has_err = True
+                    has_err = True
 
         except Exception as e:
             print("Exception while parsing results :")
@@ -519,8 +785,12 @@ class Testie:
         return has_err, has_values
 
     def execute(self, build, run, v, n_runs=1, n_retry=0, allowed_types=SectionScript.ALL_TYPES_SET, do_imports=True,
-                test_folder=None, event=None, v_internals={}, before_test = None) \
+                test_folder=None, event=None, v_internals={}, before_test = None, on_partial = None) \
             -> Tuple[Dict, Dict, str, str, int]:
+        """
+        :param on_partial: Called with the data results and kind results of the runs, including the results found so
+         far in the one being executed, while the scripts are running
+        """
 
         # Get address definition for roles from scripts
         self.parse_script_roles()
@@ -582,22 +852,27 @@ class Testie:
         # Launching the tests in itself
         data_results = OrderedDict()  # dict of result_name -> [val, val, val]
         all_kind_results = {}  # dict of kind -> kind_value -> {result_name -> [val, val, val]}
-        m = multiprocessing.Manager()
+        own_pool = self.pool is None
+        pool = WorkerPool(self.options.use_async) if own_pool else self.pool
         all_output = []
         all_err = []
+        feed = livefeed.get(self.options)
         for i in range(n_runs):
             for i_try in range(n_retry + 1):
                 if i_try > 0 and not self.options.quiet:
                     print("Re-try tests %d/%d..." % (i_try, n_retry + 1))
                 output = ''
                 err = ''
+                matches = ResultMatches()
 
                 if before_test:
                     before_test(i,i_try)
 
-                queue = m.Queue()
+                run_start = time.time()
+                queue = pool.queue()
+                result_regex = self.config.get_list("result_regex")
 
-                event = EventBus(m)
+                event = pool.event_bus()
 
                 remote_params = []
                 for t, v, role in (
@@ -608,7 +883,7 @@ class Testie:
                     srole = role if role else script.get_role()
                     nodes = npf.nodes_for_role(srole)
 
-                    autokill = m.Value('i', 0) if npf.parseBool(script.params.get("autokill", t.config["autokill"])) else None
+                    autokill = pool.counter() if npf.parseBool(script.params.get("autokill", t.config["autokill"])) else None
                     v["NPF_NODE_MAX"] = len(nodes)
                     for i_node, node in enumerate(nodes):
                       v["NPF_NODE"] = node.get_name()
@@ -684,6 +959,8 @@ class Testie:
                             param.env['RANDENV'] = ''.join(random.choice(string.ascii_lowercase) for i in range(random.randint(0,self.options.rand_env)))
                         if 'waitfor' in script.params:
                             param.waitfor = script.params['waitfor']
+                        param.cwd = os.getcwd()
+                        param.result_regex = result_regex
 
                         remote_params.append(param)
 
@@ -691,22 +968,32 @@ class Testie:
                 n_exec += n
                 if n == 0:
                     break
+                partial = None
+                if on_partial and result_regex:
+                    partial = PartialResults(pool.queue(),
+                                             lambda m: on_partial(*self.partial_results(m, data_results, all_kind_results, i)))
+                    for iparam, param in enumerate(remote_params):
+                        param.partial = partial.queue
+                        param.index = iparam
                 try:
-                    if self.options.allow_mp:
-                        p = multiprocessing.Pool(n)
-                        parallel_execs = p.map(_parallel_exec,
-                                               remote_params)
+                    if self.options.use_async:
+                        timed_execs = pool.run(remote_params)
+                    elif self.options.allow_mp:
+                        timed_execs = pool.map(_timed_parallel_exec, remote_params)
                     else:
                         print("Sequential execution...")
-                        parallel_execs = []
+                        timed_execs = []
                         for remoteParam in remote_params:
-                            parallel_execs.append(_parallel_exec(remoteParam))
+                            timed_execs.append(_timed_parallel_exec(remoteParam))
+                    parallel_execs = [r for t, r in timed_execs]
+                    if partial:
+                        partial.close()
 
                 except KeyboardInterrupt:
                     print("Program is interrupted")
-                    if self.options.allow_mp:
-                        p.close()
-                        p.terminate()
+                    if self.options.use_async:
+                        Testie.killall(queue, event)
+                    pool.close(terminate=True)
 
                     if not self.options.preserve_temp:
                         for imp in self.imports:
@@ -719,13 +1006,10 @@ class Testie:
                         print("Test files have been preserved in :" + test_folder)
                     sys.exit(1)
 
-                if self.options.allow_mp:
-                    p.close()
-                    p.terminate()
                 worked = False
                 critical_failed = False
 
-                for iscript, (r, o, e, c, script) in enumerate(parallel_execs):
+                for iscript, (r, o, e, c, script, m) in enumerate(parallel_execs):
                     if r == 0:
                         print("Timeout of %d seconds expired for script %s on %s..." % (
                             script.timeout, script.get_name(), script.get_role()))
@@ -737,6 +1021,7 @@ class Testie:
                             print(e)
                         continue
                     if r == -1:
+                        pool.close(terminate=True)
                         os.chdir('..')
                         if not self.options.preserve_temp and f_mine:
                             shutil.rmtree(test_folder)
@@ -756,7 +1041,7 @@ class Testie:
                             print(e)
                         continue
 
-                for iparallel, (r, o, e, c, script) in enumerate(parallel_execs):
+                for iparallel, (r, o, e, c, script, m) in enumerate(parallel_execs):
                     if len(self.scripts) > 1:
                         output += "stdout of script %s on %s :\n" % (script.get_name(), script.get_role())
                         err += "stderr of script %s on %s :\n" % (script.get_name(), script.get_role())
@@ -765,6 +1050,8 @@ class Testie:
                         worked = True
                         output += o
                         err += e
+                        if m:
+                            matches.extend(m)
 
                 if SectionScript.TYPE_EXIT in allowed_types:
                  for s,vlist in [(t.testie,t.imp_v) for t in self.imports] + [(self, v)]:
@@ -793,10 +1080,13 @@ class Testie:
                         #print(s_output, s_err)
                         output += s_output
                         err += s_err
+                        if result_regex:
+                            matches.extend(ResultParser(result_regex).parse(s_output).matches)
 
 
                 all_output.append(output)
                 all_err.append(err)
+                pool.account(time.time() - run_start, [t for t, r in timed_execs], event.skews())
 
                 if not worked or critical_failed:
                     continue
@@ -809,10 +1099,8 @@ class Testie:
                 new_data_results = {}
                 new_kind_results = {}
                 new_kind_results.setdefault("time", {})
-                regex_list = self.config.get_list("result_regex")
 
-                this_has_err, this_has_value = self.parse_results(regex_list, output, new_kind_results,
-                                                                  new_data_results)
+                this_has_err, this_has_value = self.add_results(matches, new_kind_results, new_data_results)
 
                 if this_has_err:
                     has_err = True
@@ -832,85 +1120,17 @@ class Testie:
                         print(e)
 
 
-                glob_sync = self.config.get_list("glob_sync")
-                glob_min = []
-                for g in glob_sync:
-                    for kind, kind_results in new_kind_results.items():
-                        if kind in glob_sync:
-                            mg = min(kind_results.keys())
-                            glob_min.append(mg)
-
-                for kind, kind_results in new_kind_results.items():
-                  if kind_results:
-                    all_kind_results.setdefault(kind,{})
-                    if kind in glob_sync:
-                        min_kind_value = min(glob_min)
-                    else:
-                        min_kind_value = min(kind_results.keys())
-                    nonzero = set()
-                    update = {}
-                    all_result_types = set()
-                    nz = False
-                    accept_zero = not self.config.match("accept_zero", kind)
-                    if accept_zero:
-                        nz = False
-
-                    last_val = {}
-                    acc = self.config.get_list("time_sync")
-                    for kind_value, results in sorted(kind_results.items()):
-                        if not nz: #We still haven't found a non zero kind_value
-                            for result_type, result in results.items():
-                                if result_type in self.config.get_list("var_repeat"):
-                                    last_val[result_type] = result
-
-                                if result != 0:
-                                    nz = True
-                                    if (not acc or result_type in acc) and not kind in glob_sync:
-                                        min_kind_value = kind_value
-                            if not nz:
-                                continue
-                            else:
-                                for result_type, result in last_val.items():
-                                    results[result_type] = result
-
-                        for result_type, result in results.items():
-                            if result_type in self.config.get_dict("var_n_runs") and i >= int(
-                                    self.config.get_dict("var_n_runs")[result_type]):
-                                continue
-                            nonzero.add(result_type)
-                            all_result_types.add(result_type)
-                            event_t = Decimal(
-                                ("%.0" + str(self.config['time_precision']) + "f") % round(float(kind_value - (min_kind_value if self.config.get_bool_or_in("time_sync", kind) else 0)), int(
-                                    self.config['time_precision'])))
-                            update.setdefault(event_t, {}).setdefault(result_type, [])
-                            update[event_t][result_type].extend(result if type(result) is list else [result])
-                            if result_type in self.config.get_list("var_repeat"):
-                                # Replicate existing time series for all new incoming time points
-                                self.ensure_time(event_t, result_type, all_kind_results[kind])
-
-                    # Replicate new results for every time point
-                    for event_t, results in update.items():
-                        for result_type, result in results.items():
-                            if result_type in self.config.get_list("var_repeat"):
-                                self.ensure_time(event_t, result_type, update)
-
-                    for kind_value, results in update.items():
-                        for result_type, result in results.items():
-                            all_kind_results[kind].setdefault(kind_value, {}).setdefault(result_type, []).extend(result)
-
-                    last_v=0
-                    for kind_value, results in update.items():
-                        for result_type, result in results.items():
-                            if not result:
-                                continue
-                            last_v = np.mean(result)
-
-                    diff = all_result_types.difference(nonzero)
-                    if diff:
-                        print("Result for %s is 0 !" % ', '.join(diff))
-                        has_err = True
+                this_has_err, updates = self.merge_kind_results(new_kind_results, all_kind_results, i)
+                if this_has_err:
+                    has_err = True
+                if feed:
+                    for kind, update in updates:
+                        feed.samples(self, build, run, kind, update)
                 for result_type, result in new_data_results.items():
                     data_results.setdefault(result_type, []).extend(result if type(result) == list else [result])
+                if feed and new_data_results:
+                    feed.result(self, build, run, OrderedDict([(result_type, result if type(result) == list else [result])
+                                                               for result_type, result in new_data_results.items()]))
                 if has_values:
                     break
 
@@ -936,6 +1156,8 @@ class Testie:
             for imp in self.imports:
                 imp.testie.cleanup()
             self.cleanup()
+        if own_pool:
+            pool.close()
         os.chdir(save_path)
         if not self.options.preserve_temp and f_mine:
             try:
@@ -944,6 +1166,149 @@ class Testie:
                 print("Could not delete folder %s..." % test_folder)
         return data_results, all_kind_results, all_output, all_err, n_exec, n_err
 
+    @staticmethod
+    def partial_finish(on_finish, run, replace, run_results, kind_results, all_data_results, all_kind_results):
+        """
+        The on_partial callback of execute, giving on_finish the results of all the runs with those found so far for
+        run, as they will be once the run is finished
+        """
+        def on_partial(new_data_results, new_all_kind_results):
+            data_results, partial_kind_results = Testie.detached(all_data_results, all_kind_results)
+            results = OrderedDict() if replace else OrderedDict([(result_type, list(values)) for result_type, values in run_results.items() if values is not None])
+            for result_type, values in new_data_results.items():
+                results.setdefault(result_type, []).extend(values)
+            data_results[run.copy()] = results
+            for kind, kresults in new_all_kind_results.items():
+                if not kresults:
+                    continue
+                kd = KindDataset(kind)
+                if not replace and kind in kind_results and run in kind_results[kind].runs():
+                    kd.extend(run, OrderedDict(kind_results[kind].series(run).samples()))
+                kd.extend(run, kresults)
+                partial_kind_results.setdefault(kind, KindDataset(kind)).set_series(run.copy(), kd.series(run))
+            on_finish(data_results, partial_kind_results)
+        return on_partial
+
+    @staticmethod
+    def detached(all_data_results, all_kind_results):
+        """
+        Copies of the results given to on_finish, that graphs them in another thread while the runs go on. The graphs
+        modify the variables of the runs, so the runs are copied too.
+        """
+        data_results = OrderedDict([(run.copy(), OrderedDict(results)) for run, results in all_data_results.items()])
+        kind_results = OrderedDict()
+        for kind, kr in all_kind_results.items():
+            kd = KindDataset(kind)
+            for run, s in KindDataset.of(kind, kr).series_items():
+                kd.set_series(run.copy(), s)
+            kind_results[kind] = kd
+        return data_results, kind_results
+
+    def partial_results(self, matches, data_results: dict, all_kind_results: dict, i: int):
+        """
+        The data and kind results of the previous executions of a run, with the matches found so far in the i-th one
+        """
+        new_data_results = {}
+        new_kind_results = {"time": {}}
+        self.add_results(matches, new_kind_results, new_data_results, quiet=True)
+        kind_results = OrderedDict([(kind, OrderedDict([(kind_value, dict([(result_type, list(result)) for result_type, result in results.items()]))
+                                                        for kind_value, results in kresults.items()]))
+                                    for kind, kresults in all_kind_results.items()])
+        self.merge_kind_results(new_kind_results, kind_results, i, quiet=True)
+        results = OrderedDict([(result_type, list(result)) for result_type, result in data_results.items()])
+        for result_type, result in new_data_results.items():
+            results.setdefault(result_type, []).extend(result if type(result) == list else [result])
+        return results, kind_results
+
+    def merge_kind_results(self, new_kind_results: dict, all_kind_results: dict, i: int, quiet=False):
+        """
+        Align the kind results of the i-th execution of a run, see time_sync, and add them to all_kind_results
+        :return: Whether some results are always 0, and the list of (kind, samples added)
+        """
+        has_err = False
+        updates = []
+        glob_sync = self.config.get_list("glob_sync")
+        glob_min = []
+        for g in glob_sync:
+            for kind, kind_results in new_kind_results.items():
+                if kind in glob_sync:
+                    mg = min(kind_results.keys())
+                    glob_min.append(mg)
+
+        for kind, kind_results in new_kind_results.items():
+          if kind_results:
+            all_kind_results.setdefault(kind,{})
+            if kind in glob_sync:
+                min_kind_value = min(glob_min)
+            else:
+                min_kind_value = min(kind_results.keys())
+            nonzero = set()
+            update = {}
+            all_result_types = set()
+            nz = False
+            accept_zero = not self.config.match("accept_zero", kind)
+            if accept_zero:
+                nz = False
+
+            last_val = {}
+            acc = self.config.get_list("time_sync")
+            for kind_value, results in sorted(kind_results.items()):
+                if not nz: #We still haven't found a non zero kind_value
+                    for result_type, result in results.items():
+                        if result_type in self.config.get_list("var_repeat"):
+                            last_val[result_type] = result
+
+                        if result != 0:
+                            nz = True
+                            if (not acc or result_type in acc) and not kind in glob_sync:
+                                min_kind_value = kind_value
+                    if not nz:
+                        continue
+                    else:
+                        for result_type, result in last_val.items():
+                            results[result_type] = result
+
+                for result_type, result in results.items():
+                    if result_type in self.config.get_dict("var_n_runs") and i >= int(
+                            self.config.get_dict("var_n_runs")[result_type]):
+                        continue
+                    nonzero.add(result_type)
+                    all_result_types.add(result_type)
+                    event_t = Decimal(
+                        ("%.0" + str(self.config['time_precision']) + "f") % round(float(kind_value - (min_kind_value if self.config.get_bool_or_in("time_sync", kind) else 0)), int(
+                            self.config['time_precision'])))
+                    update.setdefault(event_t, {}).setdefault(result_type, [])
+                    update[event_t][result_type].extend(result if type(result) is list else [result])
+                    if result_type in self.config.get_list("var_repeat"):
+                        # Replicate existing time series for all new incoming time points
+                        self.ensure_time(event_t, result_type, all_kind_results[kind])
+
+            # Replicate new results for every time point
+            for event_t, results in update.items():
+                for result_type, result in results.items():
+                    if result_type in self.config.get_list("var_repeat"):
+                        self.ensure_time(event_t, result_type, update)
+
+            for kind_value, results in update.items():
+                for result_type, result in results.items():
+                    all_kind_results[kind].setdefault(kind_value, {}).setdefault(result_type, []).extend(result)
+
+            last_v=0
+            for kind_value, results in update.items():
+                for result_type, result in results.items():
+                    if not result:
+                        continue
+                    last_v = np.mean(result)
+
+            updates.append((kind, update))
+
+            diff = all_result_types.difference(nonzero)
+            if diff:
+                if not quiet:
+                    print("Result for %s is 0 !" % ', '.join(diff))
+                has_err = True
+        return has_err, updates
+
     def ensure_time(self, event_t, result_type, update):
         if event_t in update:
             if result_type in update[event_t]:
@@ -999,6 +1364,47 @@ class Testie:
                     print("\n".join(err))
                 raise ScriptInitException()
 
+    def needed_runs(self, run_results) -> int:
+        """
+        Number of runs to add to a combination when n_runs is auto, so the 95% confidence interval of each expected
+        result (or of all results if results_expect is not set) is within target_ci of its mean.
+        The number is estimated from the current standard deviation, at least min_runs and at most max_runs results
+        are kept.
+        :return: 0 if the results are precise enough or there is max_runs results already
+        """
+        from scipy.stats import t
+        min_runs = int(self.config["min_runs"])
+        max_runs = int(self.config["max_runs"])
+        target = self.config.get_ratio("target_ci")
+        expect = self.config.get_list("results_expect")
+        need = 0
+        n_max = 0
+        for result_type, results in run_results.items():
+            if expect and result_type not in expect:
+                continue
+            if not results:
+                continue
+            n = len(results)
+            n_max = max(n_max, n)
+            if n < min_runs:
+                need = max(need, min_runs - n)
+                continue
+            std = np.std(results, ddof=1)
+            if std == 0:
+                continue
+            mean = abs(np.mean(results))
+            q = t.ppf(0.975, n - 1)
+            if mean > 0 and q * std / np.sqrt(n) <= target * mean:
+                continue
+            if mean > 0:
+                n_req = int(np.ceil((q * std / (target * mean)) ** 2))
+            else:
+                n_req = max_runs
+            need = max(need, n_req - n, 1)
+        if n_max == 0:
+            return min_runs
+        return max(0, min(need, max_runs - n_max))
+
     def execute_all(self, build, options, prev_results: Dataset = None, do_test=True, on_finish=None,
                     allowed_types=SectionScript.ALL_TYPES_SET, prev_kind_results: Dict[str, Dataset] = None, iserie=0,nseries=1) -> Tuple[
         Dataset, bool]:
@@ -1010,10 +1416,26 @@ class Testie:
         :param prev_results: Previous set of result for the same build to update or retrieve
         :return: Dataset(Dict of variables as key and arrays of results as value)
         """
+        self.pool = WorkerPool(options.use_async)
+        try:
+            return self._execute_all(build, options, prev_results=prev_results, do_test=do_test, on_finish=on_finish,
+                                     allowed_types=allowed_types, prev_kind_results=prev_kind_results, iserie=iserie,
+                                     nseries=nseries)
+        finally:
+            if options.show_overhead:
+                print(self.pool.stats())
+            self.pool.close()
+            self.pool = None
+
+    def _execute_all(self, build, options, prev_results: Dataset = None, do_test=True, on_finish=None,
+                     allowed_types=SectionScript.ALL_TYPES_SET, prev_kind_results: Dict[str, Dataset] = None, iserie=0,
+                     nseries=1):
         if not prev_kind_results:
             prev_kind_results = {}
+        prev_kind_results = OrderedDict([(kind, KindDataset.of(kind, kr).copy()) for kind, kr in prev_kind_results.items()])
 
         init_done = False
+        feed = livefeed.get(options)
         test_folder = self.make_test_folder()
 
         #All the following paths must be relative to the NPF experiment root folder (that is something like NPF's folder/testie1234567/)
@@ -1035,14 +1457,18 @@ class Testie:
         all_data_results = OrderedDict()
         all_kind_results = OrderedDict()
         # If one first, we first ensure 1 result per variables then n_runs
+        adaptive = self.config.adaptive_runs()
+        n_runs_config = self.config["min_runs"] if adaptive else self.config["n_runs"]
         if options.onefirst:
-            total_runs = [1, self.config["n_runs"]]
+            total_runs = [1, n_runs_config]
         else:
-            total_runs = [self.config["n_runs"]]
+            total_runs = [n_runs_config]
 
+        expander = self.variables.expand(method=options.expand)
+        stopper = SweepStopper.from_testie(self, options)
         for runs_this_pass in total_runs:  # Number of results to ensure for this run
             n = 0
-            for root_variables in self.variables.expand(method=options.expand):
+            for root_variables in expander:
                 n += 1
 
                 variables = {}
@@ -1053,11 +1479,21 @@ class Testie:
                     for k,v in imp.testie.variables.statics().items():
                         variables[k] = v.makeValues()[0]
 
-                run = Run(variables)
                 variables.update(root_variables)
+                run = Run(variables)
                 run.variables.update(build.repo.overriden_variables)
                 variables = run.variables.copy()
 
+                if stopper and stopper.skip(root_variables):
+                    # Mark the point as skipped with an empty result, unless it was already tested
+                    prev = prev_results.get(run, None) if prev_results else None
+                    if not self.options.quiet:
+                        print("%s skipped, stop_when was met" % run.format_variables(self.config["var_hide"]))
+                    all_data_results[run] = prev if prev else {}
+                    if not prev and do_test:
+                        build.appendversion(self, OrderedDict([(run, {})]))
+                    continue
+
                 if shadow_variables:
                     shadow_variables.update(root_variables)
                     shadow_variables.update(build.repo.overriden_variables)
@@ -1090,21 +1526,17 @@ class Testie:
                     run_results = {}
 
                 kind_results = {} #kind->(run_with_time -> results))
-                kind_results["time"] = OrderedDict()
+                kind_results["time"] = KindDataset("time")
                 config_time_kinds = self.config.get_list("time_kinds")
                 if prev_kind_results and not (options.force_test or options.force_retest):
                     nprev_kind_results = {}
                     for kind, prev_kresults in prev_kind_results.items():
                         if config_time_kinds and not kind in config_time_kinds:
                             continue
-                        nprev_kresults = OrderedDict()
-                        kind_results.setdefault(kind,OrderedDict())
-                        for trun, results in prev_kresults.items():
-                            if run.inside(trun):
-                                kind_results[kind][trun] = results
-                            else:
-                                nprev_kresults[trun] = results
-                        nprev_kind_results[kind] = nprev_kresults
+                        kind_results.setdefault(kind,KindDataset(kind))
+                        for trun in prev_kresults.find(run):
+                            prev_kresults.move(trun, kind_results[kind])
+                        nprev_kind_results[kind] = prev_kresults
                     prev_kind_results = nprev_kind_results
                 if not run_results and options.use_last and build.repo.url:
                     for version in build.repo.method.get_history(build.version, limit=options.use_last):
@@ -1172,6 +1604,10 @@ class Testie:
 
                 n_runs = runs_this_pass - (
                     0 if (options.force_test or options.force_retest) or len(run_results) == 0 else n_existing_results)
+                # With n_runs=auto, the last pass adds runs until the confidence interval is small enough
+                adapt = adaptive and runs_this_pass == total_runs[-1]
+                if adapt and n_runs <= 0:
+                    n_runs = self.needed_runs(run_results)
                 if n_runs > 0 and do_test:
                     if not init_done:
                         self.do_init_all(build, options, do_test, allowed_types=allowed_types, test_folder=test_folder,
@@ -1184,38 +1620,53 @@ class Testie:
                         if len(run_results) > 0:
                             if not dall:
                                 print("Results %s are missing some points..." % ", ".join(l))
-                        if len(self.variables) > 0:
+                        if len(self.variables.vlist) > 0:
                             def print_header(i, i_try):
                                 n_try=int(self.config["n_retry"])
                                 print(run.format_variables(self.config["var_hide"]),
-                                  ("[%srun %d/%d for test %d/%d"+(" of serie %d/%d" %(iserie+1,nseries) if nseries > 1 else "")+"]") % (  ("retrying %d/%d " % (i_try + 1,n_try)) if i_try > 0 else "", i+1, n_runs, n, len(self.variables)))
+                                  ("[%srun %d/%d for test %d/%d"+(" of serie %d/%d" %(iserie+1,nseries) if nseries > 1 else "")+"]") % (  ("retrying %d/%d " % (i_try + 1,n_try)) if i_try > 0 else "", run_offset+i+1, run_offset+n_runs, n, len(expander)))
                         else:
                             print("Executing single run...")
 
 
-                    new_data_results, new_all_kind_results, output, err, n_exec, n_err = self.execute(build, run, variables,
-                                                                                                  n_runs,
-                                                                                                  n_retry=self.config[
-                                                                                                      "n_retry"],
-                                                                                                  allowed_types={
-                                                                                                      SectionScript.TYPE_SCRIPT, SectionScript.TYPE_EXIT},
-                                                                                                  test_folder=test_folder,
-                                                                                                  v_internals=v_internals, before_test = print_header)
-                    if new_data_results:
-                        for result_type, values in new_data_results.items():
-                            if values is None:
-                                continue
-                            if options.force_retest:
-                                run_results[result_type] = values
-                            else:
-                                if result_type in run_results and run_results[result_type] is not None:
-                                    run_results[result_type].extend(values)
-                                else:
+                    run_offset = 0
+                    if feed:
+                        feed.run_start(self, build, run, n_runs)
+                    while n_runs > 0:
+                        replace = options.force_retest and run_offset == 0
+                        on_partial = self.partial_finish(on_finish, run, replace, run_results, kind_results,
+                                                         all_data_results, all_kind_results) if on_finish else None
+                        new_data_results, new_all_kind_results, output, err, n_exec, n_err = self.execute(build, run, variables,
+                                                                                                      n_runs,
+                                                                                                      n_retry=self.config[
+                                                                                                          "n_retry"],
+                                                                                                      allowed_types={
+                                                                                                          SectionScript.TYPE_SCRIPT, SectionScript.TYPE_EXIT},
+                                                                                                      test_folder=test_folder,
+                                                                                                      v_internals=v_internals, before_test = print_header,
+                                                                                                      on_partial=on_partial)
+                        if new_data_results:
+                            for result_type, values in new_data_results.items():
+                                if values is None:
+                                    continue
+                                if replace:
                                     run_results[result_type] = values
+                                else:
+                                    if result_type in run_results and run_results[result_type] is not None:
+                                        run_results[result_type].extend(values)
+                                    else:
+                                        run_results[result_type] = values
 
+                                have_new_results = True
+                        if new_all_kind_results:
                             have_new_results = True
-                    if new_all_kind_results:
-                        have_new_results = True
+                            if sum([len(r) for kind, r in new_all_kind_results.items()]) > 0:
+                                for kind, kresults in new_all_kind_results.items():
+                                    kind_results.setdefault(kind, KindDataset(kind)).extend(run, kresults, clear=replace)
+                        run_offset += n_runs
+                        n_runs = min(self.needed_runs(run_results), int(self.config["max_runs"]) - run_offset) if adapt and new_data_results else 0
+                    if feed:
+                        feed.run_end(self, build, run, run_results)
                 else:
                     if not self.options.quiet:
                         print(run.format_variables(self.config["var_hide"]))
@@ -1230,22 +1681,12 @@ class Testie:
                     all_data_results[run] = run_results
                 else:
                     all_data_results[run] = {}
+                expander.feed(root_variables, all_data_results[run])
+                if stopper:
+                    stopper.feed(root_variables, all_data_results[run])
 
-                if have_new_results and sum([len(r) for kind,r in new_all_kind_results.items()]) > 0:
-                    for kind, kresults in new_all_kind_results.items():
-                      kind_results.setdefault(kind, OrderedDict())
-                      for time, results in sorted(kresults.items()):
-                        time_run = Run(run.variables.copy())
-                        time_run.variables[kind] = time
-                        for result_type, result in results.items():
-                            rt = kind_results[kind].setdefault(time_run, {}).setdefault(result_type, [])
-                            if options.force_retest:
-                                rt.clear()
-                            rt.extend(result)
                 for kind, kresults in kind_results.items():
-                  all_kind_results.setdefault(kind, OrderedDict())
-                  for result_type, result in kresults.items():
-                    all_kind_results[kind][result_type] = result
+                    all_kind_results.setdefault(kind, KindDataset(kind)).merge(kresults)
 
                 if self.options.print_time_results:
                     for kind, kresults in all_kind_results.items():
@@ -1253,28 +1694,31 @@ class Testie:
                         print(kresults)
 
                 if on_finish and have_new_results:
+                    finish_results = Testie.detached(all_data_results, all_kind_results)
                     def call_finish():
-                        on_finish(all_data_results, all_kind_results)
+                        on_finish(*finish_results)
 
                     thread = threading.Thread(target=call_finish, args=())
                     thread.daemon = True
                     thread.start()
 
-                # Save results
+                # Save results, appending only this run to the journal
                 if all_data_results and have_new_results:
-                    if prev_results or prev_kind_results:
+                    merge_prev = prev_results or prev_kind_results
+                    if merge_prev:
                         if all_data_results[run]:
                             if prev_results is None:
                                 prev_results = {}
                             prev_results[run] = all_data_results[run]
-                        build.writeversion(self, prev_results, allow_overwrite=True)
                         for kind, kr in kind_results.items():
-                            prev_kind_results.setdefault(kind,OrderedDict())
-                            prev_kind_results[kind].update(kind_results[kind])
-                        build.writeversion(self, prev_kind_results, allow_overwrite=True, kind=True, reload=False)
-                    else:
-                        build.writeversion(self, all_data_results, allow_overwrite=True)
-                        build.writeversion(self, all_kind_results, allow_overwrite=True, kind=True)
+                            prev_kind_results.setdefault(kind,KindDataset(kind)).merge(kr)
+                    # Runs without results are kept too, unless they would hide the previous results of the run
+                    if all_data_results[run] or not merge_prev:
+                        build.appendversion(self, OrderedDict([(run, all_data_results[run])]))
+                    build.appendversion(self, kind_results, kind=True)
+
+        # The sweep is finished, fold the journals in the result files
+        build.compact(self)
 
         if not self.options.preserve_temp:
             try:
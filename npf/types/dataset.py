@@ -8,10 +8,77 @@ from npf import npf
 import natsort
 import csv
 
+def normalize_value(v):
+    if type(v) is tuple:
+        v = v[1]
+    if is_numeric(v):
+        return get_numeric(v)
+    return str(v)
+
+
+class RunVariables(OrderedDict):
+    """
+    Variables of a run. The normalized key used to hash and compare runs is computed once, and reset whenever the
+    variables are modified
+    """
+    def __init__(self, *args, **kwargs):
+        self._key = None
+        super().__init__(*args, **kwargs)
+
+    def key(self):
+        if self._key is None:
+            self._key = tuple(sorted([(k, normalize_value(v)) for k, v in self.items()]))
+        return self._key
+
+    def __setitem__(self, k, v):
+        self._key = None
+        super().__setitem__(k, v)
+
+    def __delitem__(self, k):
+        self._key = None
+        super().__delitem__(k)
+
+    def pop(self, *args):
+        self._key = None
+        return super().pop(*args)
+
+    def popitem(self, last=True):
+        self._key = None
+        return super().popitem(last)
+
+    def setdefault(self, k, default=None):
+        self._key = None
+        return super().setdefault(k, default)
+
+    def update(self, *args, **kwargs):
+        self._key = None
+        super().update(*args, **kwargs)
+
+    def clear(self):
+        self._key = None
+        super().clear()
+
+
 class Run:
     def __init__(self, variables):
         self.variables = variables
 
+    @property
+    def variables(self):
+        return self._variables
+
+    @variables.setter
+    def variables(self, variables):
+        if not isinstance(variables, RunVariables):
+            variables = RunVariables(variables)
+        self._variables = variables
+
+    def key(self):
+        """
+        Canonical key of the run : a sorted tuple of (variable, normalized value), numbers being compared by value
+        """
+        return self._variables.key()
+
     def format_variables(self, hide=None):
         if hide is None:
             hide = {}
@@ -59,37 +126,12 @@ class Run:
         return self
 
     def __eq__(self, o):
-        if len(self.variables) != len(o.variables):
+        if not isinstance(o, (Run, ImmutableRun)):
             return False
-        for k, v in self.variables.items():
-            if not k in o.variables:
-                return False
-            ov = o.variables[k]
-            if v == ov:
-                return True
-            if type(v) is tuple:
-                v = v[1]
-            if type(ov) is tuple:
-                ov = ov[1]
-            if is_numeric(v) and is_numeric(ov):
-                if not get_numeric(v) == get_numeric(ov):
-                    return False
-            else:
-                if not v == ov:
-                    return False
-        return True
+        return self.key() == o.key()
 
     def __hash__(self):
-        n = 0
-        for k, v in self.variables.items():
-            if type(v) is tuple:
-                v = v[1]
-            if is_numeric(v):
-                n += get_numeric(v).__hash__()
-            else:
-                n += str(v).__hash__()
-            n += k.__hash__()
-        return n
+        return hash(self.key())
 
     def __repr__(self):
         return "Run(" + self.format_variables() + ")"
@@ -122,16 +164,19 @@ class Run:
 class ImmutableRun:
     def __init__(self, variables):
         self._run = Run(numeric_dict(variables))
-        self._hash = self._run.__hash__()
+        self._key = self._run.key()
+        self._hash = hash(self._key)
+
+    def key(self):
+        return self._key
 
     def __hash__(self):
         return self._hash
 
     def __eq__(self, o):
-        if type(o) is Run:
-            return self._run.__eq__(o)
-        else:
-            return self._run.__eq__(o._run)
+        if not isinstance(o, (Run, ImmutableRun)):
+            return False
+        return self._key == o.key()
 
 
 
@@ -139,6 +184,20 @@ class ImmutableRun:
 Dataset = Dict[Run, Dict[str, List]]
 ResultType = str
 
+
+def copy_results(results):
+    """
+    Copy the results of one run, so extending the lists of values of the copy leaves the original untouched
+    """
+    if results is None:
+        return None
+    results = results.copy()
+    for result_type, result in results.items():
+        if result is not None:
+            results[result_type] = list(result)
+    return results
+
+
 # A tuple of X,Y,E and B, each a list of :
 #  * X variables, if you have one dynamic variable, X is that variable. If you have multiple series, and/or multiple variables X is the crossproduct
 #  * the "average" of the values for the related run for X. y default the mean, but that can be changed with graph_y_group to be the median, the std, etc
@@ -245,6 +304,7 @@ def write_output(datasets, statics, options, run_list, kind=None):
 
 # Converts a dataset (a most of series) to a more mathematical format, XYEB (see above)
 def convert_to_xyeb(datasets: List[Tuple['Testie', 'Build' , Dataset]], run_list, key, do_x_sort, statics, options, max_series = None, series_sort=None, y_group={}, color=[], kind = None) -> AllXYEB:
+    from npf.types.resulttable import ResultTable
     write_output(datasets, statics, options, run_list, kind)
     data_types = OrderedDict()
     all_result_types = OrderedSet()
@@ -258,34 +318,38 @@ def convert_to_xyeb(datasets: List[Tuple['Testie', 'Build' , Dataset]], run_list
         x = OrderedDict()
         y = OrderedDict()
         e = OrderedDict()
+        #Aggregate the values of all runs at once
+        table = ResultTable.from_dataset(all_results)
+        rows = [table.row(run) for run in run_list]
+        xdiv = var_divider(testie, key)
+        xvals = []
         for run in run_list:
             if len(run) == 0:
                 xval = build.pretty_name()
             else:
                 xval = run.print_variable(key, build.pretty_name())
-
-            results_types = all_results.get(run, OrderedDict())
-            for result_type in all_result_types:
-
-                #ydiv = var_divider(testie, "result", result_type) results are now divided before
-                xdiv = var_divider(testie, key)
-                result = results_types.get(result_type,None)
-
-                if xdiv != 1 and is_numeric(xval):
-                    x.setdefault(result_type, []).append(get_numeric(xval) / xdiv)
-                else:
-                    x.setdefault(result_type, []).append(xval)
-
-                if result is not None:
-                    yval = group_val(result, y_group[result_type] if result_type in y_group else ( y_group['result'] if 'result' in y_group else 'mean'))
-                    y.setdefault(result_type, []).append(yval)
-
-                    std = np.std(result)
-                    mean = np.mean(result)
-                    e.setdefault(result_type, []).append((mean, std, result))
+            if xdiv != 1 and is_numeric(xval):
+                xval = get_numeric(xval) / xdiv
+            xvals.append(xval)
+
+        for result_type in all_result_types:
+            #ydiv = var_divider(testie, "result", result_type) results are now divided before
+            method = y_group[result_type] if result_type in y_group else ( y_group['result'] if 'result' in y_group else 'mean')
+            present = table.present(result_type)
+            yvals = table.reduce(result_type, method) if method not in ['all', 'mean', 'avg'] else table.mean(result_type)
+            means = table.mean(result_type)
+            stds = table.std(result_type)
+            x[result_type] = list(xvals)
+            ty = y.setdefault(result_type, [])
+            te = e.setdefault(result_type, [])
+            for i in rows:
+                if i is not None and present[i]:
+                    result = table.values(result_type, i)
+                    ty.append(result if method == 'all' else yvals[i])
+                    te.append((means[i], stds[i], result))
                 else:
-                    y.setdefault(result_type, []).append(np.nan)
-                    e.setdefault(result_type, []).append((np.nan, np.nan, [np.nan]))
+                    ty.append(np.nan)
+                    te.append((np.nan, np.nan, [np.nan]))
 
 
         for result_type in x.keys():
@@ -0,0 +1,362 @@
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from npf.types.dataset import Run, normalize_value, copy_results
+
+
+class ResultTable:
+    """
+    Columnar view of a Dataset : one row per run, one column per variable, and for each result type the values of
+    all the runs concatenated in a single array, with offsets delimiting the values of each run and a mask telling
+    which runs have that result type at all, nones telling which runs have None instead.
+    The runs are only built when needed if not given, from the columns where the variables missing in a run are None.
+    Aggregations (mean, std, percentiles, ...) are computed for all the runs at once.
+    """
+    def __init__(self, runs, columns, types, nones=None, n=None):
+        self._runs = runs
+        self.n = len(runs) if runs is not None else n
+        self.columns = columns
+        self.types = types
+        self.nones = nones if nones is not None else OrderedDict()
+        self._rows = None
+
+    @property
+    def runs(self):
+        if self._runs is None:
+            self._runs = [Run(OrderedDict([(k, col[i]) for k, col in self.columns.items() if col[i] is not None]))
+                          for i in range(self.n)]
+        return self._runs
+
+    @staticmethod
+    def from_dataset(dataset):
+        if isinstance(dataset, ResultTableMapping):
+            return dataset.to_table()
+        runs = []
+        columns = OrderedDict()
+        types = OrderedDict()
+        nones = OrderedDict()
+        if dataset:
+            items = list(dataset.items())
+        else:
+            items = []
+        n = len(items)
+        for i, (run, results) in enumerate(items):
+            runs.append(run)
+            for k, v in run.variables.items():
+                col = columns.get(k, None)
+                if col is None:
+                    col = [None] * n
+                    columns[k] = col
+                col[i] = v
+            if not results:
+                continue
+            for result_type, result in results.items():
+                t = types.get(result_type, None)
+                if t is None:
+                    t = ([], [0] * n, [False] * n)
+                    types[result_type] = t
+                if result is None:
+                    nones.setdefault(result_type, np.zeros(n, dtype=bool))[i] = True
+                    continue
+                t[0].extend(result)
+                t[1][i] = len(result)
+                t[2][i] = True
+        for k, col in columns.items():
+            a = np.empty(n, dtype=object)
+            a[:] = col
+            columns[k] = a
+        for result_type, (values, counts, present) in types.items():
+            offsets = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            types[result_type] = (np.array(values, dtype=np.float64), offsets, np.array(present, dtype=bool))
+        return ResultTable(runs, columns, types, nones)
+
+    def __len__(self):
+        return self.n
+
+    def result_types(self):
+        return list(self.types.keys())
+
+    def row(self, run):
+        """
+        Index of the row of run, or None. Rows are indexed by the key of their run, computed from the columns if the
+        runs were not built.
+        """
+        if self._rows is None:
+            if self._runs is not None:
+                self._rows = dict([(r.key(), i) for i, r in enumerate(self._runs)])
+            else:
+                columns = list(self.columns.items())
+                self._rows = dict([(tuple(sorted([(k, normalize_value(col[i])) for k, col in columns if col[i] is not None])), i)
+                                   for i in range(self.n)])
+        return self._rows.get(run.key(), None)
+
+    def column(self, name):
+        return self.columns[name]
+
+    def present(self, result_type):
+        """
+        Mask of the runs having a (possibly empty) list of values for result_type
+        """
+        if result_type not in self.types:
+            return np.zeros(len(self), dtype=bool)
+        return self.types[result_type][2]
+
+    def counts(self, result_type):
+        if result_type not in self.types:
+            return np.zeros(len(self), dtype=np.int64)
+        return np.diff(self.types[result_type][1])
+
+    def values(self, result_type, i):
+        """
+        List of the values of result_type for the run at row i, None if it has none
+        """
+        if result_type not in self.types:
+            return None
+        values, offsets, present = self.types[result_type]
+        if not present[i]:
+            return None
+        return values[offsets[i]:offsets[i + 1]].tolist()
+
+    def reduce(self, result_type, how='mean'):
+        """
+        Aggregate the values of each run, as group_val would do
+        :param how: mean, avg, sum, min, max, std, median, percN, n, first or last
+        :return: An array with one value per run, NaN for runs without values
+        """
+        out = np.full(len(self), np.nan)
+        if result_type not in self.types:
+            return out
+        values, offsets, present = self.types[result_type]
+        counts = np.diff(offsets)
+        if how == 'n' or how == 'nres':
+            out[present] = counts[present]
+            return out
+        valid = present & (counts > 0)
+        if not np.any(valid):
+            return out
+        starts = offsets[:-1][valid]
+        if how == 'mean' or how == 'avg':
+            out[valid] = np.add.reduceat(values, starts) / counts[valid]
+        elif how == 'sum':
+            out[valid] = np.add.reduceat(values, starts)
+        elif how == 'min':
+            out[valid] = np.minimum.reduceat(values, starts)
+        elif how == 'max':
+            out[valid] = np.maximum.reduceat(values, starts)
+        elif how == 'std':
+            mean = self.reduce(result_type, 'mean')
+            dev = values - np.repeat(np.where(valid, mean, 0), counts)
+            out[valid] = np.sqrt(np.add.reduceat(dev * dev, starts) / counts[valid])
+        elif how == 'first':
+            out[valid] = values[starts]
+        elif how == 'last':
+            out[valid] = values[offsets[1:][valid] - 1]
+        elif how == 'median' or how == 'med':
+            out[valid] = [np.median(values[offsets[i]:offsets[i + 1]]) for i in np.nonzero(valid)[0]]
+        elif how[:4] == 'perc':
+            return self.percentile(result_type, int(how[4:]))
+        else:
+            print("WARNING : Unknown format %s" % how)
+        return out
+
+    def mean(self, result_type):
+        return self.reduce(result_type, 'mean')
+
+    def std(self, result_type):
+        return self.reduce(result_type, 'std')
+
+    def percentile(self, result_type, q):
+        out = np.full(len(self), np.nan)
+        if result_type not in self.types:
+            return out
+        values, offsets, present = self.types[result_type]
+        valid = present & (np.diff(offsets) > 0)
+        out[valid] = [np.percentile(values[offsets[i]:offsets[i + 1]], q) for i in np.nonzero(valid)[0]]
+        return out
+
+    def take(self, indices):
+        """
+        New table with only the given rows
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        runs = [self._runs[i] for i in indices] if self._runs is not None else None
+        columns = OrderedDict([(k, col[indices]) for k, col in self.columns.items()])
+        types = OrderedDict()
+        for result_type, (values, offsets, present) in self.types.items():
+            counts = np.diff(offsets)[indices]
+            noffsets = np.zeros(len(indices) + 1, dtype=np.int64)
+            np.cumsum(counts, out=noffsets[1:])
+            if len(values):
+                sel = np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in indices]) if len(indices) else np.zeros(0, dtype=np.int64)
+                nvalues = values[sel]
+            else:
+                nvalues = values
+            types[result_type] = (nvalues, noffsets, present[indices])
+        nones = OrderedDict([(result_type, mask[indices]) for result_type, mask in self.nones.items()])
+        return ResultTable(runs, columns, types, nones, n=len(indices))
+
+    def filter(self, mask=None, **equals):
+        """
+        Keep the rows selected by a boolean mask, and/or whose variables are equal to the given values
+        """
+        if mask is None:
+            mask = np.ones(len(self), dtype=bool)
+        else:
+            mask = np.asarray(mask, dtype=bool).copy()
+        for k, v in equals.items():
+            if k not in self.columns:
+                return self.take([])
+            mask &= np.array([c == v for c in self.columns[k]], dtype=bool)
+        return self.take(np.nonzero(mask)[0])
+
+    def group_by(self, names):
+        """
+        Group the rows by the values of some variables
+        :return: An ordered dict of tuple of values -> array of row indices
+        """
+        groups = OrderedDict()
+        cols = [self.columns[k] if k in self.columns else np.full(len(self), None, dtype=object) for k in names]
+        for i in range(len(self)):
+            groups.setdefault(tuple([col[i] for col in cols]), []).append(i)
+        return OrderedDict([(k, np.array(v, dtype=np.int64)) for k, v in groups.items()])
+
+    def pivot(self, index, columns, result_type, how='mean'):
+        """
+        Matrix of the aggregated result_type with one line per value of variable index and one column per value of
+        variable columns. Runs sharing the same cell are averaged.
+        :return: (index values, columns values, matrix)
+        """
+        y = self.reduce(result_type, how)
+        ivalues = list(OrderedDict.fromkeys(self.columns[index]))
+        cvalues = list(OrderedDict.fromkeys(self.columns[columns]))
+        ii = dict([(v, i) for i, v in enumerate(ivalues)])
+        ci = dict([(v, i) for i, v in enumerate(cvalues)])
+        rows = np.array([ii[v] for v in self.columns[index]], dtype=np.int64)
+        cols = np.array([ci[v] for v in self.columns[columns]], dtype=np.int64)
+        ok = ~np.isnan(y)
+        tot = np.zeros((len(ivalues), len(cvalues)))
+        n = np.zeros((len(ivalues), len(cvalues)))
+        np.add.at(tot, (rows[ok], cols[ok]), y[ok])
+        np.add.at(n, (rows[ok], cols[ok]), 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return ivalues, cvalues, tot / n
+
+    def as_dataset(self):
+        return ResultTableMapping(self)
+
+
+class ResultTableMapping(MutableMapping):
+    """
+    Exposes a ResultTable with the Dataset interface, a mapping of Run -> {result type -> list of values}. The runs
+    and the lists of values are only built when they are accessed, array_items and arrays giving views of the columns
+    instead. Runs set or deleted afterwards are kept aside, the table being left untouched.
+    """
+    def __init__(self, table):
+        self.table = table
+        self._changed = OrderedDict()
+        self._deleted = set()
+
+    def _results(self, i, arrays=False):
+        results = {}
+        for result_type, (values, offsets, present) in self.table.types.items():
+            if present[i]:
+                v = values[offsets[i]:offsets[i + 1]]
+                results[result_type] = v if arrays else v.tolist()
+            elif result_type in self.table.nones and self.table.nones[result_type][i]:
+                results[result_type] = None
+        return results
+
+    def _row(self, run):
+        if run in self._deleted:
+            return None
+        return self.table.row(run)
+
+    def __getitem__(self, run):
+        if run in self._changed:
+            return self._changed[run]
+        i = self._row(run)
+        if i is None:
+            raise KeyError(run)
+        return self._results(i)
+
+    def arrays(self, run):
+        """
+        The results of run, as arrays viewing the columns of the table
+        """
+        if run in self._changed:
+            return self._changed[run]
+        i = self._row(run)
+        if i is None:
+            raise KeyError(run)
+        return self._results(i, arrays=True)
+
+    def __setitem__(self, run, results):
+        self._changed[run] = results
+        self._deleted.discard(run)
+
+    def __delitem__(self, run):
+        if run not in self:
+            raise KeyError(run)
+        self._changed.pop(run, None)
+        if self.table.row(run) is not None:
+            self._deleted.add(run)
+
+    def _iter(self, arrays):
+        for i, run in enumerate(self.table.runs):
+            if run in self._changed:
+                yield run, self._changed[run]
+            elif run not in self._deleted:
+                yield run, self._results(i, arrays)
+        for run, results in self._changed.items():
+            if self.table.row(run) is None:
+                yield run, results
+
+    def array_items(self):
+        """
+        Iterate over (run, results) as arrays viewing the columns of the table
+        """
+        return self._iter(arrays=True)
+
+    def __iter__(self):
+        for run in self.table.runs:
+            if run not in self._deleted:
+                yield run
+        for run in self._changed:
+            if self.table.row(run) is None:
+                yield run
+
+    def __len__(self):
+        return len(self.table) - len(self._deleted) + len([run for run in self._changed if self.table.row(run) is None])
+
+    def __contains__(self, run):
+        return run in self._changed or self._row(run) is not None
+
+    def copy(self):
+        """
+        Another mapping over the same table, the runs set or deleted in one not being seen by the other
+        """
+        m = ResultTableMapping(self.table)
+        m._changed = OrderedDict([(run, copy_results(results)) for run, results in self._changed.items()])
+        m._deleted = set(self._deleted)
+        return m
+
+    def to_table(self):
+        """
+        The table, including the runs set or deleted since
+        """
+        if not self._changed and not self._deleted:
+            return self.table
+        return ResultTable.from_dataset(OrderedDict(self._iter(arrays=True)))
+
+
+def array_items(dataset):
+    """
+    Iterate over (run, results) of a Dataset, the results being arrays viewing the columns of a ResultTableMapping
+    instead of lists
+    """
+    if isinstance(dataset, ResultTableMapping):
+        return dataset.array_items()
+    return dataset.items()
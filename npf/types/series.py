@@ -0,0 +1,281 @@
+from collections import OrderedDict
+from collections.abc import MutableMapping, ItemsView
+
+import numpy as np
+
+from npf.variable import is_numeric, get_numeric
+from npf.types.dataset import Run, normalize_value, copy_results
+
+# Special sample counts of KindSeries.counts
+ABSENT = -1
+NONE = -2
+
+
+def _key(value):
+    if type(value) is tuple:
+        value = value[1]
+    if is_numeric(value):
+        return get_numeric(value)
+    return value
+
+
+class KindSeries:
+    """
+    All the samples of one kind (such as time) for one run, stored as arrays : a vector of kind values, and for
+    each result type a matrix with one line per sample, padded with NaN. counts gives the number of values of
+    each line, or ABSENT/NONE. The arrays may be memory-mapped from the result folder.
+    """
+    def __init__(self, kind_values, values, counts):
+        self.kind_values = kind_values
+        self.values = values
+        self.counts = counts
+        self._index = None
+
+    @staticmethod
+    def from_samples(samples):
+        """
+        Build a series from a list of (kind value, {result type -> list of values})
+        """
+        types = OrderedDict()
+        for t, results in samples:
+            for result_type, result in results.items():
+                w = len(result) if result is not None else 0
+                types[result_type] = max(types.get(result_type, 0), w)
+        kind_values = np.array([get_numeric(_key(t)) for t, results in samples], dtype=np.float64)
+        values = OrderedDict()
+        counts = OrderedDict()
+        for result_type, w in types.items():
+            m = np.full((len(samples), w), np.nan)
+            c = np.full(len(samples), ABSENT, dtype=np.int32)
+            for i, (t, results) in enumerate(samples):
+                if result_type not in results:
+                    continue
+                result = results[result_type]
+                if result is None:
+                    c[i] = NONE
+                else:
+                    m[i, :len(result)] = result
+                    c[i] = len(result)
+            values[result_type] = m
+            counts[result_type] = c
+        return KindSeries(kind_values, values, counts)
+
+    def __len__(self):
+        return len(self.kind_values)
+
+    def index(self, kind_value):
+        if self._index is None:
+            self._index = dict([(v, i) for i, v in enumerate(self.kind_values.tolist())])
+        return self._index.get(_key(kind_value), None)
+
+    def results(self, i):
+        results = {}
+        for result_type, m in self.values.items():
+            c = int(self.counts[result_type][i])
+            if c == ABSENT:
+                continue
+            results[result_type] = None if c == NONE else m[i, :c].tolist()
+        return results
+
+    def samples(self):
+        kind_values = self.kind_values.tolist()
+        for i in range(len(kind_values)):
+            yield get_numeric(kind_values[i]), self.results(i)
+
+
+class KindItemsView(ItemsView):
+    def __iter__(self):
+        return self._mapping.iteritems()
+
+
+class KindDataset(MutableMapping):
+    """
+    Results of one kind, used instead of a Dataset of Run(variables + kind) -> results.
+    Samples are grouped per run, as a KindSeries, or as a dict of kind value -> (kind value, results) for the runs
+    being modified. Runs including the kind variable are only built when iterating.
+    """
+    def __init__(self, kind):
+        self.kind = kind
+        self._series = OrderedDict()
+        self._indexes = {}  # sorted variable names -> {normalized values -> [runs]}, see find()
+
+    @staticmethod
+    def of(kind, dataset):
+        if isinstance(dataset, KindDataset):
+            return dataset
+        kd = KindDataset(kind)
+        if dataset:
+            kd.update(dataset)
+        return kd
+
+    def _split(self, trun):
+        variables = OrderedDict([(k, v) for k, v in trun.variables.items() if k != self.kind])
+        return Run(variables), trun.variables.get(self.kind, None)
+
+    def _run(self, run, kind_value):
+        variables = run.variables.copy()
+        variables[self.kind] = kind_value
+        return Run(variables)
+
+    @staticmethod
+    def _project(run, names):
+        key = []
+        for k in names:
+            if k not in run.variables:
+                return None
+            key.append(normalize_value(run.variables[k]))
+        return tuple(key)
+
+    def _add(self, run, s):
+        if run not in self._series:
+            for names, index in self._indexes.items():
+                p = self._project(run, names)
+                if p is not None:
+                    index.setdefault(p, []).append(run)
+        self._series[run] = s
+
+    def _pop(self, run):
+        s = self._series.pop(run)
+        for names, index in self._indexes.items():
+            p = self._project(run, names)
+            if p is not None:
+                l = index[p]
+                l.remove(run)
+                if not l:
+                    del index[p]
+        return s
+
+    def find(self, run):
+        """
+        List of the runs having samples whose variables include those of run with the same values, as run.inside()
+        would tell. The runs are indexed by the names of the variables of run the first time, so the following
+        lookups with the same variable names do not scan all the runs.
+        """
+        names = tuple(sorted(run.variables.keys()))
+        index = self._indexes.get(names, None)
+        if index is None:
+            index = {}
+            for trun in self._series.keys():
+                p = self._project(trun, names)
+                if p is not None:
+                    index.setdefault(p, []).append(trun)
+            self._indexes[names] = index
+        return list(index.get(self._project(run, names), []))
+
+    def _editable(self, run):
+        s = self._series.get(run, None)
+        if s is None:
+            s = OrderedDict()
+            self._add(run, s)
+        elif isinstance(s, KindSeries):
+            s = OrderedDict([(_key(t), (t, results)) for t, results in s.samples()])
+            self._series[run] = s
+        return s
+
+    def copy(self):
+        kd = KindDataset(self.kind)
+        for run, s in self._series.items():
+            if not isinstance(s, KindSeries):
+                #Series are replaced when modified, samples are modified in place
+                s = OrderedDict([(k, (t, copy_results(results))) for k, (t, results) in s.items()])
+            kd._series[run] = s
+        return kd
+
+    def runs(self):
+        """
+        List of the runs (without the kind variable) having samples
+        """
+        return list(self._series.keys())
+
+    def move(self, run, other):
+        """
+        Move the samples of run to another KindDataset
+        """
+        other._add(run, self._pop(run))
+
+    def series_items(self):
+        """
+        Iterate over (run without the kind variable, KindSeries)
+        """
+        for run in list(self._series.keys()):
+            yield run, self.series(run)
+
+    def series(self, run):
+        s = self._series[run]
+        if not isinstance(s, KindSeries):
+            s = KindSeries.from_samples(list(s.values()))
+            self._series[run] = s
+        return s
+
+    def set_series(self, run, series):
+        self._add(run, series)
+
+    def merge(self, other):
+        """
+        Replace the series of the runs of other
+        """
+        for run, s in other._series.items():
+            self._add(run, s)
+
+    def extend(self, run, kind_results, clear=False):
+        """
+        Add the samples of one execution of run
+        :param kind_results: dict of kind value -> {result type -> list of values}
+        :param clear: Replace existing values instead of extending them
+        """
+        s = self._editable(run)
+        for kind_value, results in sorted(kind_results.items()):
+            k = _key(kind_value)
+            if k not in s:
+                s[k] = (kind_value, {})
+            sample = s[k][1]
+            for result_type, result in results.items():
+                rt = sample.get(result_type, None)
+                if rt is None or clear:
+                    rt = []
+                    sample[result_type] = rt
+                rt.extend(result)
+
+    def __getitem__(self, trun):
+        run, kind_value = self._split(trun)
+        s = self._series[run]
+        if isinstance(s, KindSeries):
+            i = s.index(kind_value)
+            if i is None:
+                raise KeyError(trun)
+            return s.results(i)
+        return s[_key(kind_value)][1]
+
+    def __setitem__(self, trun, results):
+        run, kind_value = self._split(trun)
+        self._editable(run)[_key(kind_value)] = (kind_value, results)
+
+    def __delitem__(self, trun):
+        run, kind_value = self._split(trun)
+        del self._editable(run)[_key(kind_value)]
+
+    def __contains__(self, trun):
+        try:
+            self[trun]
+            return True
+        except KeyError:
+            return False
+
+    def iteritems(self):
+        for run, s in list(self._series.items()):
+            samples = s.samples() if isinstance(s, KindSeries) else s.values()
+            for kind_value, results in samples:
+                yield self._run(run, kind_value), results
+
+    def items(self):
+        return KindItemsView(self)
+
+    def __iter__(self):
+        for trun, results in self.iteritems():
+            yield trun
+
+    def __len__(self):
+        return sum([len(s) for s in self._series.values()])
+
+    def __repr__(self):
+        return repr(OrderedDict(self.iteritems()))
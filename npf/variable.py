@@ -59,6 +59,33 @@ def get_numeric(data):
     else:
         return data
 
+def unit_value(n, mult, unit):
+    """
+    Value of a result given with a multiplier and a unit, such as 10ms or 2G. Times are kept in seconds.
+    """
+    unit = unit if unit else ""
+    mult = mult if mult else ""
+    if unit.lower() == "sec" or unit.lower() == "s":
+        unit = "s"
+
+    if unit == "s":
+        if mult == "m":
+            n = n / 1000  # Keep all results in seconds
+        elif mult == "u" or mult == "µ":
+            n = n / 1000000
+        elif mult == "n":
+            n = n / 1000000000
+    else:
+        mult = mult.upper()
+
+    if mult == "K":
+        n *= 1024
+    elif mult == "M":
+        n *= 1024 * 1024
+    elif mult == "G":
+        n *= 1024 * 1024 * 1024
+    return n
+
 def numericable(l):
     for x in l:
         if not is_numeric(x):
@@ -124,11 +151,159 @@ def replace_variables(v: dict, content: str, self_role=None, self_node=None, def
     """
     Replace all variable and nics references in content
     This is done in two step : variables first, then NICs reference so variable can be used in NIC references
+    The content is compiled once in a Template, see Template.get()
     :param v: Dictionary of variables
     :param content: Text to change
     :param self_role: Role of the caller, that self reference in nic will map to
     :return: The text with reference to variables and nics replaced
     """
+    if not content:
+        return content
+    return Template.get(content).render(v, self_role, self_node, default_role_map, role_index)
+
+
+def _eval_math(expr):
+    """
+    Evaluate a math expression, memoized unless it is random
+    """
+    if 'rand' in expr:
+        return str(aeval(expr))
+    r = _math_cache.get(expr, None)
+    if r is None:
+        r = str(aeval(expr))
+        if len(_math_cache) >= Template.MAX_MATH:
+            _math_cache.clear()
+        _math_cache[expr] = r
+    return r
+
+_math_cache = {}
+
+
+class Template:
+    """
+    A content tokenized once into literal chunks and slots for variables, NIC references and math expressions,
+    so replacing the variables is a join of the slots values.
+    Rendering gives the same result than replacing variables, NICs and math one after the other with regular
+    expressions, as long as the values of the variables do not contain references themselves. In the other cases,
+    and if a variable is used to build a NIC reference, the regular expressions are used.
+    """
+    LITERAL = 0
+    VARIABLE = 1
+    NIC = 2
+    MATH = 3
+
+    MAX_TEMPLATES = 1024
+    MAX_MATH = 65536
+
+    templates = OrderedDict()
+    regex = None
+
+    def __init__(self, content):
+        self.content = content
+        # A variable inside ${...}, such as ${client:$IDX:ip}, may build a NIC reference
+        self.dynamic = re.search(r'[$][{][^}]*(?<!\\)[$]', content) is not None
+        self.tokens = self._tokenize(content, math=True) if not self.dynamic else []
+
+    @classmethod
+    def get(cls, content):
+        t = cls.templates.get(content, None)
+        if t is None:
+            t = Template(content)
+            if len(cls.templates) >= cls.MAX_TEMPLATES:
+                cls.templates.popitem(last=False)
+            cls.templates[content] = t
+        return t
+
+    @classmethod
+    def _regex(cls, math):
+        if cls.regex is None:
+            refs = '(?P<nic>' + Variable.VARIABLE_NICREF_REGEX + ')|(?P<var>' + Variable.VARIABLE_REGEX + ')'
+            cls.regex = (re.compile(refs), re.compile('(?P<math>' + Variable.MATH_REGEX + ')|' + refs))
+        return cls.regex[1 if math else 0]
+
+    def _tokenize(self, content, math):
+        tokens = []
+        pos = 0
+        for m in self._regex(math).finditer(content):
+            if m.start() > pos:
+                tokens.append((Template.LITERAL, content[pos:m.start()]))
+            if math and m.group('math') is not None:
+                tokens.append((Template.MATH, (m.group('prefix'), self._tokenize(m.group('expr'), math=False))))
+            elif m.group('nic') is not None:
+                tokens.append((Template.NIC, (m.group('role'), m.group('nic_idx'), m.group('type'), m.group('node'))))
+            else:
+                varname = m.group('varname_sp') if m.group('varname_sp') is not None else m.group('varname_in')
+                after_dollar = content[pos:m.start()].endswith('$')
+                tokens.append((Template.VARIABLE, (varname, m.group(0), after_dollar)))
+            pos = m.end()
+        if pos < len(content):
+            tokens.append((Template.LITERAL, content[pos:]))
+        return tokens
+
+    class Fallback(Exception):
+        pass
+
+    @staticmethod
+    def _nic(nic, self_role, self_node, default_role_map, role_index):
+        role, nic_idx, t, node = nic
+        nodes = npf.nodes_for_role(role, self_role, self_node, default_role_map)
+        nodeidx = role_index % len(nodes)
+        if node:
+            t = str(node)
+            if t == "node":
+                return str(len(nodes))
+            v = getattr(nodes[nodeidx], t)
+            if v is None:
+                if t == "multi":
+                    return "1"
+                else:
+                    raise Exception("Unknown node variable %s" % t)
+            else:
+                return str(v)
+        else:
+            nic = nodes[nodeidx].get_nic(int(nic_idx))
+            return str(nic[t])
+
+    def _render(self, tokens, v, args, in_math):
+        out = []
+        for kind, data in tokens:
+            if kind == Template.LITERAL:
+                out.append(data)
+            elif kind == Template.VARIABLE:
+                varname, text, after_dollar = data
+                if varname in v:
+                    val = v[varname]
+                    val = str(val[0] if type(val) is tuple else val)
+                    if '$' in val or val.endswith('\\') or (in_math and (')' in val or '\n' in val)) or (after_dollar and val[:1] in '({'):
+                        raise Template.Fallback()
+                    out.append(val)
+                else:
+                    out.append(text)
+            elif kind == Template.NIC:
+                out.append(self._nic(data, *args))
+            else:
+                prefix, expr_tokens = data
+                expr = self._render(expr_tokens, v, args, True).strip()
+                if prefix:
+                    out.append("$((" + expr + "))")
+                else:
+                    out.append(_eval_math(expr))
+        return ''.join(out)
+
+    def render(self, v, self_role=None, self_node=None, default_role_map={}, role_index=0):
+        if not self.dynamic:
+            try:
+                return self._render(self.tokens, v, (self_role, self_node, default_role_map, role_index), False)
+            except Template.Fallback:
+                pass
+        return replace_variables_regex(v, self.content, self_role, self_node, default_role_map, role_index)
+
+
+def replace_variables_regex(v: dict, content: str, self_role=None, self_node=None, default_role_map={}, role_index = 0):
+    """
+    Replace all variable and nics references in content with regular expressions, one kind of reference after
+    the other
+    """
 
     def do_replace(match):
         varname = match.group('varname_sp') if match.group('varname_sp') is not None else match.group('varname_in')
@@ -192,7 +367,7 @@ class VariableFactory:
     def build(name, valuedata, vsection=None):
         result = re.match("(?P<doubleopen>\[?)\[(?P<a>-?[0-9.]+)(?P<log>[+-]|[*]|[,])(?P<b>-?[0-9.]+)(?P<step>[#][0-9.]*)?\](?P<doubleclose>\]?)", valuedata)
         if result:
-            return RangeVariable(name, result.group('a'), result.group('b'), result.group('log') == "*", step= (get_numeric(result.group('step')[1:]) if result.group('step') else None), force_int=result.group('doubleopen')=='[')
+            return RangeVariable(name, result.group('a'), result.group('b'), result.group('log') == "*", step= (get_numeric(result.group('step')[1:]) if result.group('step') else None), force_int=result.group('doubleopen')=='[', design=getattr(vsection, 'design', None))
 
         result = regex.match("\{([^:]*:[^,:]+)(?:(?:,)([^,:]*:[^,:]+))*\}", valuedata)
         if result:
@@ -223,6 +398,17 @@ class VariableFactory:
             nums = vsection.replace_all(result.group(1))[0].strip()
             return HeadVariable(name, nums,
                                 vsection.vlist[result.group(2)].makeValues(), result.group('sep'))
+        result = regex.match("SEARCH[ ]*\((.*)\)", valuedata)
+        if result:
+            args = []
+            kwargs = {}
+            for arg in result.group(1).split(','):
+                if '=' in arg:
+                    k, v = arg.split('=', 1)
+                    kwargs[k.strip()] = v.strip()
+                else:
+                    args.append(arg.strip())
+            return SearchVariable(name, *args, **kwargs)
         result = regex.match("IF[ ]*\([ ]*([^,]+)[ ]*,[ ]*([^,]+)[ ]*,[ ]*([^,]+)[ ]*\)", valuedata)
         if result:
             if vsection is None:
@@ -252,19 +438,23 @@ class Variable:
     VARIABLE_NICREF_REGEX = r'(?<!\\)[$][{]' + NICREF_REGEX + '[}]'
 
 class ExperimentalDesign:
-    matrix = None
-    varmap = OrderedDict()
-
-    @classmethod
-    def getVals(cls, v:Variable):
-        if cls.matrix is None:
-            cls.load()
-        if v.name not in cls.varmap:
-            cls.varmap[v.name] = len(cls.varmap)
-        return cls.matrix[cls.varmap[v.name]]
-
-    @classmethod
-    def load(cls):
+    """
+    Values of the experimental design variables ([a-b#] ranges), each variable taking the next line of the matrix
+    read from the --experimental-design file. There is one design per variable section, so multiple testies may use
+    it in the same process.
+    """
+    def __init__(self):
+        self.matrix = None
+        self.varmap = OrderedDict()
+
+    def getVals(self, v:Variable):
+        if self.matrix is None:
+            self.load()
+        if v.name not in self.varmap:
+            self.varmap[v.name] = len(self.varmap)
+        return self.matrix[self.varmap[v.name]]
+
+    def load(self):
         path = npf.find_local(sys.modules["npf.npf"].options.experimental_design)
         assert path is not None
 
@@ -272,7 +462,7 @@ class ExperimentalDesign:
             csvreader = csv.reader(fd)
             data = [i for i in csvreader]
         
-        ExperimentalDesign.matrix = np.array([[float(j) for j in i] for i in data])
+        self.matrix = np.array([[float(j) for j in i] for i in data])
 
         # TODO: assert that the number of rows of the matrix is sufficient for all the values of the experimental design variables
 
@@ -476,8 +666,9 @@ class DictVariable(Variable):
         return self
 
 class RangeVariable(Variable):
-    def __init__(self, name, valuestart, valueend, log, step = None, force_int = False):
+    def __init__(self, name, valuestart, valueend, log, step = None, force_int = False, design = None):
         super().__init__(name)
+        self.design = design if design is not None else ExperimentalDesign()
 
         if is_integer(valuestart) and is_integer(valueend):
             valuestart=int(valuestart)
@@ -504,7 +695,7 @@ class RangeVariable(Variable):
     def count(self):
         """todo: think"""
         if self.step == "":
-            return len(ExperimentalDesign.getVals(self))
+            return len(self.design.getVals(self))
         else:
             if self.log:
                 return len(self.makeValues())
@@ -515,7 +706,7 @@ class RangeVariable(Variable):
     def makeValues(self):
             #Experimental design
             if self.step == "":
-                vs =  self.a + (self.b-self.a) * ExperimentalDesign.getVals(self)
+                vs =  self.a + (self.b-self.a) * self.design.getVals(self)
             else:
                 vs = []
                 i = self.a
@@ -543,6 +734,17 @@ class RangeVariable(Variable):
     def is_numeric(self):
         return True
 
+    def sample(self, u):
+        """
+        Value of the range at the quantile u in [0, 1) of its values, used by space-filling designs
+        """
+        if self.step == "":
+            v = self.a + (self.b - self.a) * u
+            return int(v) if self.force_int else v
+        #Same values as the full grid, including the upper bound when it is not aligned on the step
+        vs = self.makeValues()
+        return vs[min(int(u * len(vs)), len(vs) - 1)]
+
 class IfVariable(Variable):
     def __init__(self, name, cond, a, b):
         super().__init__(name)
@@ -584,3 +786,66 @@ class RandomVariable(Variable):
 
     def is_numeric(self):
         return True
+
+
+class SearchVariable(Variable):
+    """
+    Searches for the highest value between a and b for which the mean of the result type result stays lower or
+    equal to target, such as the highest rate without drops as RFC 2544 does. The bounds are tried first, then a
+    binary search is done until the interval is smaller than precision. The values to try are given by search(),
+    the expander sending back if the last value was accepted.
+    """
+    def __init__(self, name, a, b, result=None, target=0, precision=None):
+        super().__init__(name)
+        if result is None:
+            raise Exception("SEARCH variable %s needs a result type, such as SEARCH(a,b,result=DROPPED)" % name)
+        self.a = get_numeric(a)
+        self.b = get_numeric(b)
+        if self.a > self.b:
+            self.a, self.b = self.b, self.a
+        self.result = result
+        self.target = get_numeric(target)
+        self.force_int = type(self.a) is int and type(self.b) is int
+        if precision is None:
+            precision = (self.b - self.a) / 100
+            if self.force_int:
+                precision = max(1, int(precision))
+        self.precision = get_numeric(precision)
+
+    def accept(self, results):
+        if not results or not results.get(self.result, None):
+            return False
+        return np.mean(results[self.result]) <= self.target
+
+    def search(self):
+        lo = self.a
+        hi = self.b
+        if (yield hi):
+            return
+        if not (yield lo):
+            return
+        while hi - lo > self.precision:
+            mid = (lo + hi) / 2
+            if self.force_int:
+                mid = int(mid)
+                if mid == lo:
+                    break
+            if (yield mid):
+                lo = mid
+            else:
+                hi = mid
+
+    def makeValues(self):
+        return [self.a, self.b]
+
+    def count(self):
+        """Maximal number of values tried"""
+        if self.b - self.a <= self.precision:
+            return 2
+        return 2 + int(np.ceil(np.log2((self.b - self.a) / self.precision)))
+
+    def format(self):
+        return self.name, int if self.force_int else float
+
+    def is_numeric(self):
+        return True
@@ -16,6 +16,8 @@ from pathlib import Path
 from npf.testie import Testie
 
 from npf.statistics import Statistics
+from npf.store.cache import results_cache
+from npf.types.resulttable import array_items
 
 class Comparator():
     def __init__(self, repo_list: List[Repository]):
@@ -82,7 +84,7 @@ def do_graph(filename,args,series,kind_series,options):
     all_variables = []
     for testie, build, dataset in series:
         v_list = set()
-        for run, results in dataset.items():
+        for run in dataset:
             v_list.update(run.variables.keys())
         all_variables.append(v_list)
 
@@ -100,7 +102,7 @@ def do_graph(filename,args,series,kind_series,options):
         all_alone=True
         for i, (testie, build, dataset) in enumerate(series):
             serie_values = set()
-            for run, result_types in dataset.items():
+            for run in dataset:
                 if variable in run.variables:
                     val = run.variables[variable]
                     serie_values.add(val)
@@ -122,8 +124,8 @@ def do_graph(filename,args,series,kind_series,options):
     #Keep only the variables in Run that are usefull as defined above
     for i, (testie, build, dataset) in enumerate(series):
         ndataset = OrderedDict()
-        for run, results in dataset.items():
-            ndataset[run.intersect(useful_variables)] = results
+        for run, results in array_items(dataset):
+            ndataset[run.copy().intersect(useful_variables)] = results
         series[i] = (testie, build, ndataset)
 
     #Keep only the variables in Time Run that are usefull as defined above
@@ -133,8 +135,8 @@ def do_graph(filename,args,series,kind_series,options):
         for kind, dataset in kind_dataset.items():
           ndataset = OrderedDict()
           n_kind_series.setdefault(kind,[])
-          for run, results in dataset.items():
-            ndataset[run.intersect(useful_variables + [kind])] = results
+          for run, results in array_items(dataset):
+            ndataset[run.copy().intersect(useful_variables + [kind])] = results
           if ndataset:
             n_kind_series[kind].append((testie, build, ndataset))
 
@@ -191,6 +193,8 @@ def main():
     series, time_series = comparator.run(testie_name=args.test_files, tags=args.tags, options=args, on_finish=lambda series,time_series:do_graph(filename,args,series,time_series,options=args) if args.iterative else None)
 
     do_graph(filename,args,series, time_series, options=args)
+    if args.show_cache_stats:
+        print(results_cache.stats())
 
 if __name__ == "__main__":
     main()
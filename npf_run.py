@@ -11,6 +11,7 @@ from npf import npf
 from npf.regression import *
 from npf.statistics import Statistics
 from npf.testie import Testie, ScriptInitException
+from npf.store.cache import results_cache
 
 
 def main():
@@ -275,6 +276,8 @@ def main():
         if args.compare:
             print("[%s] Finished run for %s, %d/%d tests passed" % (repo.name, build.version, nok, ntests))
 
+    if args.show_cache_stats:
+        print(results_cache.stats())
     sys.exit(returncode)
 
 
@@ -18,6 +18,7 @@ import sys
 from npf import npf
 from npf.regression import *
 from npf.testie import Testie
+from npf.store.cache import results_cache
 
 
 class Watcher():
@@ -122,6 +123,9 @@ class Watcher():
                 if self.history == 1 and (build.n_passed < build.n_tests or self.mail_always):
                     self.mail_results(repo, build, testies, datasets)
 
+            if options.show_cache_stats:
+                print(results_cache.stats())
+
             if self.history > 1:
                 self.history -= 1
             else:
@@ -51,6 +51,7 @@ setuptools.setup(
                   'npf-run=npf_run:main',
                   'npf-compare=npf_compare:main',
                   'npf-watch=npf_watch:main',
+                  'npf-agent=npf.agent:main',
                   'npf-run.py=npf_run:main',
                   'npf-compare.py=npf_compare:main',
                   'npf-watch.py=npf_watch:main',